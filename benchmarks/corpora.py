@@ -0,0 +1,211 @@
+# Template and data generators for the benchmark suite. Everything here is deterministic, so timings from different
+# runs (and different machines) are measuring the same work.
+
+import random
+
+
+def flatTemplate(blockCount):
+    # Mixed text, simple tags, ifs and a loop, repeated. Used to measure parse time against template size.
+    block = (
+        '<div class="item">\n'
+        '  <h2><@title></h2>\n'
+        '  <@if show & !hidden><p><@body></p><@else><p>nothing</p><@/if>\n'
+        '  <ul><@loop rows><li><@name>: <@value></li><@/loop></ul>\n'
+        '  <!-- comment with <@title> in it -->\n'
+        '</div>\n'
+    )
+    return block * blockCount
+
+
+def flatData(rowCount=5):
+    return {
+        'title': 'Title',
+        'show': True,
+        'hidden': False,
+        'body': 'Body text',
+        'rows': [{'name': f'name{i}', 'value': f'value{i}'} for i in range(rowCount)],
+    }
+
+
+def staticTemplate(blockCount):
+    # Markup with comments and blank lines but no tags at all, like a static page or the fixed parts of one.
+    block = (
+        '<div class="notice">\n'
+        '  <!-- boilerplate -->\n'
+        '\n'
+        '  <p>Nothing in here changes from one render to the next.</p>\n'
+        '</div>\n'
+    )
+    return block * blockCount
+
+
+def loopTemplate():
+    return '<table>\n<@loop rows>  <tr><td><@name></td><td><@value></td><td><@:index></td></tr>\n<@/loop></table>\n'
+
+
+def loopData(rowCount):
+    return {'rows': [{'name': f'name{i}', 'value': f'value{i}'} for i in range(rowCount)]}
+
+
+def nestedLoopTemplate(depth):
+    template = '<@leaf>'
+    for level in reversed(range(depth)):
+        template = f'<@loop level{level}>[{template}]<@/loop>'
+    return template
+
+
+def nestedLoopData(depth, width=3):
+    data = {'leaf': 'x'}
+    for level in range(depth):
+        data[f'level{level}'] = [{} for _ in range(width)]
+    return data
+
+
+def expressionTemplate(tagCount):
+    expressions = [
+        'a & b', '!a | c', '(a | b) & !(c & d)', 'a, b, c, d', '!(!a & !b) & (c | !d)', 'obj.flag & (a | obj.other)',
+    ]
+    return ''.join(f'<@if {expressions[i % len(expressions)]}>{i}<@elif d>d<@else>-<@/if>\n' for i in range(tagCount))
+
+
+class Flags:
+    flag = True
+    other = False
+
+
+def expressionData():
+    return {'a': 1, 'b': 0, 'c': 'yes', 'd': '', 'obj': Flags()}
+
+
+def caseTemplate(optionCount, tagCount):
+    options = ''.join(f'<@option v{i}>option {i}' for i in range(optionCount))
+    return ''.join(f'<@case key{i % 4}>{options}<@else>none<@/case>\n' for i in range(tagCount))
+
+
+def caseData(optionCount):
+    return {f'key{i}': f'v{(i * 7) % (optionCount + 2)}' for i in range(4)}
+
+
+def saverawTemplate():
+    return (
+        '<@saveraw cell><td class="<@if odd>odd<@else>even<@/if>"><@name></td><@/saveraw>'
+        '<@loop rows><tr><@cell><@cell><@cell></tr>\n<@/loop>'
+    )
+
+
+def escapeTemplate():
+    return '<@loop rows><p><@text></p>\n<@/loop>'
+
+
+def escapeData(rowCount):
+    rng = random.Random(42)
+    alphabet = 'abcdefgh <>&"\'éüñ©®€—“”αβγ中文'
+    return {'rows': [{'text': ''.join(rng.choice(alphabet) for _ in range(40))} for _ in range(rowCount)]}
+
+
+def multiTagcharTemplate(blockCount):
+    return ('<@title> <#loop rows><#name>=<$value> <#/loop><$if flag><@footer><$/if>\n') * blockCount
+
+
+def multiTagcharData():
+    return [
+        {'title': 'Title', 'footer': 'Footer'},
+        {'rows': [{'name': f'n{i}'} for i in range(10)]},
+        {'value': 'v', 'flag': True},
+    ]
+
+
+emailFieldNames = tuple(f'field{i}' for i in range(20))
+
+
+def emailTemplate():
+    # A transactional email: many top level substitutions and a few conditionals, no loops, the same shape every time.
+    lines = [f'<p><@{name}></p>' if i % 4 else f'<@if {name}><p><@{name}></p><@/if>'
+             for i, name in enumerate(emailFieldNames)]
+    return '\n'.join(lines * 3) + '\n'
+
+
+def emailRecord():
+    # The data for emailTemplate, in emailFieldNames order. Pass dict(zip(emailFieldNames, emailRecord())) for a
+    # Mapping.
+    return tuple(f'value {i}' for i in range(len(emailFieldNames)))
+
+
+def attributeChainTemplate():
+    return '<@loop rows><@row.customer.address.city> <@row.customer.name> <@row.total.amount>\n<@/loop>'
+
+
+class _Record:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def attributeChainData(rowCount, asMappings=False):
+    # The same nested data as objects or, with asMappings, as plain dicts (for doMappingAttributes).
+    record = dict if asMappings else _Record
+    return {'rows': [
+        {'row': record(customer=record(name=f'name{i}', address=record(city=f'city{i}')),
+                       total=record(amount=f'{i}.00'))}
+        for i in range(rowCount)]}
+
+
+def realisticPageTemplate():
+    # Roughly the shape of a real page: a layout with overridable blocks, navigation, a table and a footer.
+    return '''<!DOCTYPE html>
+<html>
+<head>
+  <title><@page_title> - <@site_name></title>
+  <@saveraw head_extra><@/saveraw>
+</head>
+<body>
+  <@saveoverride head_extra><meta name="robots" content="noindex"><@super><@/saveoverride>
+  <@head_extra>
+  <nav>
+    <ul>
+    <@loop nav>
+      <li<@if active> class="active"<@/if>><a href="<@url>"><@label></a></li>
+    <@/loop>
+    </ul>
+  </nav>
+  <!-- main content -->
+  <main>
+    <@if user.is_logged_in>
+    <p>Welcome back, <@user.name>!</p>
+    <@else>
+    <p><a href="/login">Log in</a></p>
+    <@/if>
+    <table>
+    <@loop orders>
+      <tr class="<@if :isOdd>odd<@else>even<@/if>">
+        <td><@id></td>
+        <td><@customer></td>
+        <td><@case status><@option "open">Open<@option "shipped", "delivered">Done<@else>Unknown<@/case></td>
+        <td><@total></td>
+      </tr>
+    <@/loop>
+    </table>
+  </main>
+  <footer><@copyright></footer>
+</body>
+</html>
+'''
+
+
+class User:
+    is_logged_in = True
+    name = 'Jane Doe'
+
+
+def realisticPageData(orderCount=50):
+    statuses = ['open', 'shipped', 'delivered', 'cancelled']
+    return {
+        'page_title': 'Orders',
+        'site_name': 'Example Shop',
+        'nav': [{'url': f'/section{i}', 'label': f'Section {i}', 'active': i == 2} for i in range(8)],
+        'user': User(),
+        'orders': [
+            {'id': str(1000 + i), 'customer': f'Customer {i}', 'status': statuses[i % 4], 'total': f'{i * 3.5:.2f}'}
+            for i in range(orderCount)
+        ],
+        'copyright': '(c) Example Shop',
+    }
@@ -0,0 +1,173 @@
+# Performance benchmarks for tagsub. Standard library only.
+#
+#   python -m benchmarks.run                        # run everything and print a table
+#   python -m benchmarks.run -k loop                # only cases with "loop" in the name
+#   python -m benchmarks.run --save baseline.json   # store the results as a baseline
+#   python -m benchmarks.run --compare baseline.json --threshold 0.10
+#
+# With --compare, any case more than threshold slower than the baseline is reported as a regression and the exit
+# status is 1. Timings are the best per call time over several repeats, which is the most stable figure to compare.
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+
+import tagsub
+from . import corpora
+
+
+def parseCase(template):
+    return lambda: tagsub.Template('@', template)
+
+
+def renderCase(tagchars, template, data, doEncodeHtml=False, **kwargs):
+    # Same default as tagsub.substitute
+    compiled = tagsub.Template(tagchars, template, doEncodeHtml=doEncodeHtml, **kwargs)
+    return lambda: compiled.format(data)
+
+
+# name -> factory returning the callable to time. Factories are only called for the cases selected.
+CASES = {}
+
+for blockCount in (1, 10, 100):
+    CASES[f'parse_size_{blockCount}'] = (lambda n: lambda: parseCase(corpora.flatTemplate(n)))(blockCount)
+
+for rowCount in (10, 100, 1000):
+    CASES[f'render_loop_{rowCount}'] = (lambda n: lambda: renderCase(
+        '@', corpora.loopTemplate(), corpora.loopData(n)))(rowCount)
+
+for depth in (2, 4, 6):
+    CASES[f'render_nested_loops_{depth}'] = (lambda d: lambda: renderCase(
+        '@', corpora.nestedLoopTemplate(d), corpora.nestedLoopData(d)))(depth)
+
+CASES['render_flat_10'] = lambda: renderCase('@', corpora.flatTemplate(10), corpora.flatData())
+CASES['render_static_100'] = lambda: renderCase('@', corpora.staticTemplate(100), {})
+CASES['render_expressions'] = lambda: renderCase('@', corpora.expressionTemplate(60), corpora.expressionData())
+CASES['render_case_dispatch'] = lambda: renderCase('@', corpora.caseTemplate(30, 40), corpora.caseData(30))
+CASES['render_case_dispatch_optimized'] = lambda: renderCase('@', corpora.caseTemplate(30, 40), corpora.caseData(30),
+                                                             optimize=2)
+CASES['render_saveraw_reuse'] = lambda: renderCase('@', corpora.saverawTemplate(), corpora.loopData(100))
+CASES['render_escape_nonascii'] = lambda: renderCase('@', corpora.escapeTemplate(), corpora.escapeData(100),
+                                                     doEncodeHtml=True)
+CASES['render_no_escape_nonascii'] = lambda: renderCase('@', corpora.escapeTemplate(), corpora.escapeData(100),
+                                                        doEncodeHtml=False)
+CASES['render_multi_tagchar'] = lambda: renderCase('@#$', corpora.multiTagcharTemplate(20),
+                                                   corpora.multiTagcharData())
+CASES['render_attribute_chains'] = lambda: renderCase('@', corpora.attributeChainTemplate(),
+                                                      corpora.attributeChainData(100))
+CASES['render_mapping_attribute_chains'] = lambda: renderCase('@', corpora.attributeChainTemplate(),
+                                                              corpora.attributeChainData(100, asMappings=True),
+                                                              doMappingAttributes=True)
+CASES['render_email'] = lambda: renderCase('@', corpora.emailTemplate(),
+                                           dict(zip(corpora.emailFieldNames, corpora.emailRecord())))
+CASES['render_email_schema'] = lambda: renderCase('@', corpora.emailTemplate(), corpora.emailRecord(),
+                                                  schema=corpora.emailFieldNames)
+CASES['parse_realistic_page'] = lambda: parseCase(corpora.realisticPageTemplate())
+CASES['render_realistic_page'] = lambda: renderCase('@', corpora.realisticPageTemplate(), corpora.realisticPageData())
+
+
+def timeCase(func, repeat, minTime):
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    # autorange stops once a run takes at least 0.2 seconds. Scale to the requested minimum.
+    if elapsed < minTime:
+        number = max(number, int(number * minTime / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def measureMemory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def runCases(names, repeat=5, minTime=0.2, memory=False):
+    results = {}
+    for name in names:
+        func = CASES[name]()
+        result = {'seconds': timeCase(func, repeat, minTime)}
+        if memory:
+            result['peakBytes'] = measureMemory(func)
+        results[name] = result
+        print(f'  {name:32} {result["seconds"] * 1e6:12.1f} us', file=sys.stderr)
+    return results
+
+
+def compareResults(results, baseline, threshold):
+    # Returns a list of (name, baselineSeconds, seconds, ratio) for the cases that regressed.
+    regressions = []
+    for name, result in results.items():
+        baselineResult = baseline.get(name)
+        if not baselineResult:
+            continue
+        ratio = result['seconds'] / baselineResult['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((name, baselineResult['seconds'], result['seconds'], ratio))
+    return regressions
+
+
+def formatTable(results, baseline=None):
+    lines = ['%-32s %12s %12s %8s %12s' % ('case', 'time (us)', 'baseline', 'ratio', 'peak (KiB)')]
+    for name, result in results.items():
+        baselineResult = (baseline or {}).get(name)
+        peak = '%.1f' % (result['peakBytes'] / 1024) if 'peakBytes' in result else '-'
+        if baselineResult:
+            lines.append('%-32s %12.1f %12.1f %8.2f %12s' % (
+                name, result['seconds'] * 1e6, baselineResult['seconds'] * 1e6,
+                result['seconds'] / baselineResult['seconds'], peak))
+        else:
+            lines.append('%-32s %12.1f %12s %8s %12s' % (name, result['seconds'] * 1e6, '-', '-', peak))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-k', dest='pattern', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per repeat')
+    parser.add_argument('--memory', action='store_true', help='also record peak memory with tracemalloc')
+    parser.add_argument('--save', metavar='PATH', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown before a regression')
+    parser.add_argument('--list', action='store_true', help='list the case names and exit')
+    args = parser.parse_args(argv)
+
+    names = [name for name in CASES if args.pattern in name]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    results = runCases(names, repeat=args.repeat, minTime=args.min_time, memory=args.memory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    print(formatTable(results, baseline))
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({
+                'tagsub': tagsub.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'results': results,
+            }, fp, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compareResults(results, baseline, args.threshold)
+        for name, baselineSeconds, seconds, ratio in regressions:
+            print(f'REGRESSION {name}: {baselineSeconds * 1e6:.1f} us -> {seconds * 1e6:.1f} us ({ratio:.2f}x)')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# Multi-threaded stress and throughput benchmark: one compiled Template, rendered concurrently from a thread pool.
+#
+#   python -m benchmarks.threads                      # 1, 2, 4 and 8 threads
+#   python -m benchmarks.threads --threads 1,16 --seconds 5
+#
+# Every render is checked against the single threaded output, so this doubles as a stress test for shared Templates.
+# The speedup over one thread is only expected to grow with the thread count on a free-threaded CPython build; with
+# the GIL, it mostly shows the cost of contention.
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tagsub
+from . import corpora
+
+
+def isGilEnabled():
+    # sys._is_gil_enabled only exists from Python 3.13
+    isEnabled = getattr(sys, '_is_gil_enabled', None)
+    return True if isEnabled is None else isEnabled()
+
+
+def runThreads(template, dataSets, expectedOutputs, threadCount, seconds):
+    # Returns (renders per second, mismatches)
+    deadline = time.perf_counter() + seconds
+    start = threading.Barrier(threadCount)
+
+    def worker(workerIndex):
+        renders = mismatches = 0
+        start.wait()
+        while time.perf_counter() < deadline:
+            index = (workerIndex + renders) % len(dataSets)
+            if template.format(dataSets[index]) != expectedOutputs[index]:
+                mismatches += 1
+            renders += 1
+        return renders, mismatches
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threadCount) as executor:
+        results = list(executor.map(worker, range(threadCount)))
+    elapsed = time.perf_counter() - began
+    return sum(renders for renders, _ in results) / elapsed, sum(mismatches for _, mismatches in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', default='1,2,4,8', help='comma separated thread counts')
+    parser.add_argument('--seconds', type=float, default=2.0, help='how long to run each thread count')
+    args = parser.parse_args(argv)
+
+    template = tagsub.Template('@', corpora.realisticPageTemplate(), doEncodeHtml=False)
+    # Different data for each render, so a render seeing another thread's state shows up as a mismatch.
+    dataSets = [corpora.realisticPageData(orderCount) for orderCount in range(10, 60, 5)]
+    expectedOutputs = [template.format(data) for data in dataSets]
+
+    print(f'Python {sys.version.split()[0]}, GIL {"enabled" if isGilEnabled() else "disabled"}')
+    print('%8s %14s %10s %10s' % ('threads', 'renders/s', 'speedup', 'errors'))
+    baseline = None
+    failed = False
+    for threadCount in [int(count) for count in args.threads.split(',')]:
+        rate, mismatches = runThreads(template, dataSets, expectedOutputs, threadCount, args.seconds)
+        baseline = baseline or rate
+        print('%8d %14.1f %10.2f %10d' % (threadCount, rate, rate / baseline, mismatches))
+        failed = failed or mismatches
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,8 @@
 from numbers import Number
 
 from .tags import IfTagContainer
+from .tags import CacheTag
+from .tags import IncludeTag
 from .tags import ElifTag
 from .tags import ElseTag
 from .tags import CaseTag
@@ -16,6 +18,7 @@ from .tags import SimpleTag
 from .tags.Tag import Tag
 
 from .tags.RootTag import RootTag
+from .tags.NamespaceScope import NamespaceScope
 from .tags.text.TagsubCommentNode import TagsubCommentNode
 
 from .tags.values.Token import Token
@@ -24,15 +27,27 @@ from .tags.text.TextNode import TextNode, Line
 from .tags.text.CommentNode import CommentNode
 from .exceptions import TagsubTemplateSyntaxError, TagStackOverflowError
 from .exceptions import TagcharSequenceMismatchError
-from .exceptions import TagsubEofParsingTokenError
+from .exceptions import TagsubEofParsingTokenError, InvalidTagKeyName
+from .exceptions import TagsubCompileTimeError, RecursiveSubstitutionOverflowError, buildRuntimeTracebackString
+from .exceptions import LoopVarOutOfScopeError
 
 from collections import ChainMap, deque
 from collections.abc import Sequence, Mapping
+from contextlib import contextmanager
+from functools import lru_cache
 from io import StringIO
-from .constants import max_nested_tag_depth
+from threading import Lock
+from types import MappingProxyType
+from .constants import max_nested_tag_depth, max_recursive_template_depth
 
 # TagStack gets used during parsing/compiling the template
 from .util.Stack import Stack
+from .util.Resolver import Resolver, ResolverMapping
+from .util.Schema import Schema, RecordMapping
+from .util.RenderCache import ReadSet, ReadRecorder
+from .util.FragmentCache import LRUFragmentCache
+from .util.Optimizer import Optimizer, StripCommentsPass, updateFlatLoops, isStaticTree, formatStaticNodes, \
+    iterNodes
 
 
 class TagStack:
@@ -61,6 +76,14 @@ class TagStack:
     def __len__(self):
         return len(self.__stack)
 
+    @property
+    def scope(self):
+        # The nearest enclosing tag that will push a new mapping onto the NamespaceStack. The RootTag is always at the
+        # bottom, so we will always find one.
+        for tag in reversed(self.__stack):
+            if isinstance(tag, NamespaceScope):
+                return tag
+
     def __getitem__(self, index):
         # For a stack, we are looking from the end
         assert index > 0
@@ -74,7 +97,7 @@ class TagStack:
 #  - to  pop, do: namespaceStack = namespaceStack.parents
 # XXX NamespaceStack only gets used during formatting.
 class NamespaceStack:
-    def __init__(self, rootMap):
+    def __init__(self, rootMap, doIsolateSaves=False, globalDict=None):
         # FIXME We don't really treat the case where we pass in a callable, but
         #   want to set a value. And for namespace stacks, we need to deal with
         #   the situation that any mapping might be a callable instead. (Or do
@@ -82,8 +105,24 @@ class NamespaceStack:
         # if isinstance(rootMap, operations.Callable):
         # There is always the initial map for save tags to store values in.
         self._rootMap = rootMap
+        # Everything the save tags wrote during this render. With doIsolateSaves, this is also the only place they
+        # write to: an overlay above the caller's Mapping, which is then left untouched.
+        self.savedValues = {}
+        self._doIsolateSaves = doIsolateSaves
         #self._map = ChainMap({}, rootMap)
-        self._map = ChainMap(rootMap)
+        baseMaps = [self.savedValues, rootMap] if doIsolateSaves else [rootMap]
+        # The Template's frozen globals, if any, go underneath everything else. Save tags never write to them.
+        if globalDict is not None:
+            baseMaps.append(globalDict)
+        self._map = ChainMap(*baseMaps)
+        # rootMap and the globals below it, at the end of the chain.
+        self._rootMapCount = 2 if globalDict is not None else 1
+        # Only set while a Template with a RenderCache is formatting. See util/RenderCache.py
+        self.readRecorder = None
+        # The values of a record passed for a schema (see util/Schema.py), which lookups bound to a slot read
+        # directly. Dropped once a save tag writes one of the schema names, so from then on every lookup sees the
+        # saved value through the chain.
+        self.slotValues = rootMap.values if isinstance(rootMap, RecordMapping) else None
 
     # For each namespace added, we add a new scratch space for save tags. This has the net effect that for every
     # namespace we enter (including loop tags), we can override variable names, but see the original value when we
@@ -106,13 +145,31 @@ class NamespaceStack:
 
     def __setitem__(self, key, value):
         #self._map[key] = value
-        self._rootMap[key] = value
+        self.savedValues[key] = value
+        if self.slotValues is not None and key in self._rootMap.schema.slots:
+            self.slotValues = None
+        if not self._doIsolateSaves:
+            self._rootMap[key] = value
+        if self.readRecorder is not None:
+            self.readRecorder.recordWrite(key, value)
 
     def __getitem__(self, key):
         return self._map[key]
 
-    def get(self, key, default=None):
-        return self._map.get(key, default)
+    def get(self, key, default=None, recordRead=True):
+        value = self._map.get(key, default)
+        if self.readRecorder is not None and recordRead:
+            self.recordRead(key, None, value)
+        return value
+
+    def recordRead(self, key, getAttributes, value):
+        # Values found in a loop or namespace mapping derive from something already read at the root level, so we
+        # only need to record the reads that reach the root mapping (or the globals below it).
+        maps = self._map.maps
+        for mapping in maps[:len(maps) - self._rootMapCount]:
+            if key in mapping:
+                return
+        self.readRecorder.recordRead(key, getAttributes, value)
 
     def __len__(self):
         return len(self._map)
@@ -143,17 +200,99 @@ class OutputBufferStack(Stack):
 
 
 class OutputFormatter:
-    def __init__(self, tagchars, pageDictMapping):
+    def __init__(self, tagchars, pageDictMapping, doIsolateSaves=False, globalDicts=None, renderBudget=None,
+                 maxRecursiveTemplateDepth=max_recursive_template_depth, schemas=None, template=None):
+        # The Template being formatted. Only used for its fragmentCache.
+        self.template = template
         self.rootMapping = {}
+        # Only populated for the tagchars where the caller gave us a Resolver instead of a Mapping.
+        self.resolverMappings = {}
         # Need one NamespaceStack for each tagchar, based on the initial pageDict.
         for tagchar in tagchars:
-            self.rootMapping[tagchar] = NamespaceStack(pageDictMapping[tagchar])
-
+            pageDict = pageDictMapping[tagchar]
+            if isinstance(pageDict, Resolver):
+                pageDict = self.resolverMappings[tagchar] = ResolverMapping(pageDict)
+            elif not isinstance(pageDict, Mapping):
+                # A record for the tagchar's Schema. See util/Schema.py
+                schema = schemas[tagchar]
+                pageDict = RecordMapping(schema, schema.recordValues(pageDict))
+            globalDict = globalDicts[tagchar] if globalDicts is not None else None
+            self.rootMapping[tagchar] = NamespaceStack(pageDict, doIsolateSaves, globalDict)
+
+        # All the state for a render lives here rather than on the tags, so one Template can be formatted from several
+        # threads at once. Implied loop variables, keyed by LoopTag.
         self.loopTagData = {}
+        # The SavedOverrides being formatted where they are referenced, innermost last. See SaveOverrideTag.py
+        self.activeOverrides = []
+        # Traceback elements for the SimpleTags whose values we are currently substituting recursively, outermost
+        # first. Its length is the current recursion depth.
+        self.recursionTracebackStack = []
+        self.maxRecursiveTemplateDepth = maxRecursiveTemplateDepth
         self.outputCharCount = 0
+        # Set by a util.Profiler.Profiler the first time one of its instrumented tags sees this formatter.
+        self.profiler = None
+        # Set in the same way by a util.OutputAttribution.OutputAttribution, to its state for this render.
+        self.attribution = None
+        # Only kept up to date while a util.SamplingProfiler.SamplingProfiler is sampling: the tag being formatted.
+        self.currentTag = None
         self.outputBufferStack = OutputBufferStack()
         # Start with the initial tracking entry. Some save tags will cause other entries.
         self.pushOutputBuffer()
+        # A util.RenderBudget.RenderBudgetUsage when the render has a RenderBudget. The tags only check the budget when
+        # this is set.
+        self.budgetUsage = renderBudget.start(self) if renderBudget is not None else None
+
+    @property
+    def fragmentCache(self):
+        # The backend for the <@cache> tags of the Template being formatted, and of every template it includes or
+        # substitutes recursively. Those are compiled once and shared, so they have no backend of their own.
+        return self.template.fragmentCache
+
+    def prefetchScope(self, scopeTag):
+        # Make one batched request to each Resolver for the names referenced in the scope we are entering. Names
+        # already requested earlier in this render are not requested again.
+        for tagchar, names in scopeTag.prefetchNames.items():
+            resolverMapping = self.resolverMappings.get(tagchar)
+            if resolverMapping is not None:
+                resolverMapping.prefetch(names)
+
+    @contextmanager
+    def recursiveTemplate(self, tag):
+        # Wraps compiling and formatting another Template on behalf of tag (a recursively substituted value or an
+        # include), enforcing the depth limit and keeping the traceback prefix for errors raised inside it.
+        if self.maxRecursiveTemplateDepth is not None and \
+                len(self.recursionTracebackStack) >= self.maxRecursiveTemplateDepth:
+            raise RecursiveSubstitutionOverflowError("Recursive substitution overflow", tag=tag, outputFormatter=self)
+        self.recursionTracebackStack.append(buildRuntimeTracebackString(tag, tag._template, self).lstrip())
+        try:
+            yield
+        except TagsubCompileTimeError as e:
+            # Compile time errors are raised without an outputFormatter, so they do not have the prefix yet. Only the
+            # innermost template sets it.
+            if e.outputFormatter is None and not e.tracebackPrefix:
+                e.setTracebackPrefix(''.join(f"{element}/" for element in self.recursionTracebackStack))
+            raise
+        finally:
+            self.recursionTracebackStack.pop()
+
+    def exportSavedValues(self):
+        # The values the save tags left behind, by tagchar. A saveraw or saveoverride is formatted here, the same as
+        # if it were referenced at the end of the template. One that uses the implied variables of a loop can only be
+        # formatted inside that loop, so it is left out.
+        exported = {}
+        for tagchar, namespace in self.rootMapping.items():
+            values = exported[tagchar] = {}
+            for key, value in namespace.savedValues.items():
+                if isinstance(value, Tag):
+                    self.pushOutputBuffer()
+                    try:
+                        value.formatAtReference(self)
+                    except LoopVarOutOfScopeError:
+                        self.outputBufferStack.pop()
+                        continue
+                    value = self.popOutputBuffer()
+                values[key] = value
+        return exported
 
     def pushOutputBuffer(self):
         self.outputBufferStack.push(OutputBuffer())
@@ -182,6 +321,12 @@ class OutputFormatter:
         elif isinstance(textString, (str, Number)):
             self.outputBufferStack.top.maybeSuppressLine &= not str(textString)
 
+    def outputPartialLine(self, text, isBlank):
+        # Text that does not complete the current line, already put together from several pieces (see
+        # tags/FlatLoop.py). isBlank says whether the pieces would have left the line a candidate for suppression.
+        self.outputBufferStack.top.lineTextNodes.append(text)
+        self.outputBufferStack.top.maybeSuppressLine &= isBlank
+
     def suppressOrOutputLine(self):
         # Not suppressible, then output it at this point
         if not self.outputBufferStack.top.maybeSuppressLine or not self.outputBufferStack.top.suppressibleTagFound:
@@ -242,10 +387,8 @@ class TemplateIterator:
             self._lastTagCharpos = self._charpos
             self._lastTagLinenum = self._linenum
             self._lastTagLinepos = self._linepos
-        if self._eol:
-            self._eol = False
-        else:
-            self._lineLengths[-1] += 1
+        self._eol = False
+        self._lineLengths[-1] += 1
         self._charpos += 1
         if char == "\n":
             # Set this at the end for the next char to be on a new line counter
@@ -258,8 +401,12 @@ class TemplateIterator:
         while charcount:
             self._charpos -= 1
             self._lineLengths[-1] -= 1
-            if self._lineLengths[-1] < 0:
+            # Backed up over the first char of a line, so we are back to just after the previous line ending.
+            if self._lineLengths[-1] == 0 and len(self._lineLengths) > 1:
                 self._lineLengths.pop()
+                self._eol = True
+            else:
+                self._eol = False
             charcount -= 1
         # For a convenience short cut, return a reference to self, so we can do
         # an in-place rollback in the process of invoking / referencing the
@@ -267,6 +414,22 @@ class TemplateIterator:
         return self
 
 
+_fragmentCacheLock = Lock()
+
+
+# Simple tag values that contain tags get compiled here, so a snippet referenced many times (or across many renders,
+# or from many Templates) is only parsed once. Keyed on the value itself and the options of the referencing Template.
+# Any cache tags in it use the fragment cache of the Template being formatted (see OutputFormatter.fragmentCache).
+@lru_cache(maxsize=256)
+def compileValueTemplate(tagchars, templateStr, is0False, doSuppressComments, doStrictKeyLookup, doEncodeHtml,
+                         loopPrefetchDepth=0, maxNestedTagDepth=max_nested_tag_depth, optimize=0,
+                         doMappingAttributes=False):
+    return Template(tagchars, templateStr, is0False=is0False, doSuppressComments=doSuppressComments,
+                    doStrictKeyLookup=doStrictKeyLookup, doEncodeHtml=doEncodeHtml,
+                    loopPrefetchDepth=loopPrefetchDepth, maxNestedTagDepth=maxNestedTagDepth, optimize=optimize,
+                    doMappingAttributes=doMappingAttributes)
+
+
 class Template:
     tagMap = {
         "if": IfTagContainer.IfTagContainer,
@@ -280,25 +443,79 @@ class Template:
         "saveraw": SaveRawTag.SaveRawTag,
         "saveoverride": SaveOverrideTag.SaveOverrideTag,
         "super": SuperTag.SuperTag,
+        "cache": CacheTag.CacheTag,
+        "include": IncludeTag.IncludeTag,
     }
 
     def __init__(self, tagchars, template, is0False=False, doSuppressComments=False, doStrictKeyLookup=False,
-                 doEncodeHtml=True):
+                 doEncodeHtml=True, renderCache=None, fragmentCache=None, templateLoader=None, loopPrefetchDepth=0,
+                 doIsolateSaves=False, globalDict=None, renderBudget=None, maxNestedTagDepth=max_nested_tag_depth,
+                 maxRecursiveTemplateDepth=max_recursive_template_depth, optimize=0, schema=None,
+                 doMappingAttributes=False):
         self._tagchars = tagchars
         self._templateStr = template
         self.is0False = is0False
         self.doSuppressComments = doSuppressComments
         self.doStrictKeyLookup = doStrictKeyLookup
         self.doEncodeHtml = doEncodeHtml
+        # Attribute chains (name.a.b) index into Mappings that have the key, as well as getting attributes. See
+        # Value.compileAttributeChain
+        self.doMappingAttributes = doMappingAttributes
+        # Save tags write into a per-render overlay instead of the caller's Mappings. See NamespaceStack.
+        self.doIsolateSaves = doIsolateSaves
+        # Optional util.RenderBudget.RenderBudget, the limits for each render. Can be overridden for a single render by
+        # passing one to format.
+        self.renderBudget = renderBudget
+        # Optional util.RenderCache.RenderCache
+        self.renderCache = renderCache
+        # Backend for <@cache> tags. Defaults to an in-process LRU, created the first time a cache tag needs it.
+        self._fragmentCache = fragmentCache
+        # Optional util.TemplateLoader.TemplateLoader, for <@include> tags.
+        self.templateLoader = templateLoader
+        # When non-zero, loops over iterables without a length fetch up to this many items ahead on a background
+        # thread. See util/LoopPrefetcher.py
+        self.loopPrefetchDepth = loopPrefetchDepth
+        # How deeply tags may be nested, and how deeply recursively substituted values and includes may be nested, or
+        # None for no limit. Rendering does not recurse in Python for either (see Tag.runFormatSteps), so these are
+        # only there to catch runaway templates.
+        self.maxNestedTagDepth = maxNestedTagDepth
+        self.maxRecursiveTemplateDepth = maxRecursiveTemplateDepth
+        # Optimization passes to run over the tree once it is parsed: a level, or a util.Optimizer.Optimizer. What
+        # each pass changed ends up in optimizationStats.
+        self.optimize = optimize
+        self.optimizationStats = {}
+        # Set while parsing if there are comments that can never produce output. See StripCommentsPass.
+        self._hasStrippableComments = False
+        # The util.Profiler.Profiler (or OutputAttribution or SamplingProfiler) currently instrumenting this template,
+        # if any.
+        self._profiler = None
         currentTextNode = TextNode()
 
-        self._tagStack = TagStack(max_nested_tag_depth)
+        self._tagStack = TagStack(maxNestedTagDepth)
         self._tagStack.push(RootTag(None, self))
         # Separate stack, just for loops
         if not isinstance(tagchars, str):
             raise TypeError("tagchar value must be string")
         if not isinstance(template, str):
             raise TypeError("template value must be string")
+        # Read-only values every render can see, below the Mappings passed to format. Given in any of the forms format
+        # accepts. Each is flattened into a single frozen dict here, once, so a render only has to supply its own small
+        # Mapping and nothing is merged per render.
+        self.globalDicts = None
+        # The util.Schema.Schema for each tagchar given one. A single sequence of names is the schema for a single
+        # tagchar template; otherwise a Mapping from tagchar to names.
+        self.schemas = {}
+        if schema is not None:
+            if isinstance(schema, Mapping):
+                self.schemas = {tagchar: names if isinstance(names, Schema) else Schema(names)
+                                for tagchar, names in schema.items()}
+            elif len(tagchars) == 1:
+                self.schemas = {tagchars: schema if isinstance(schema, Schema) else Schema(schema)}
+            else:
+                raise TagcharSequenceMismatchError("Must have a Mapping of schemas indexed by tagchar")
+        if globalDict is not None:
+            self.globalDicts = {tagchar: MappingProxyType(dict(mapping))
+                                for tagchar, mapping in self.buildPageDictMapping(globalDict, False).items()}
         self.templateIter = TemplateIterator(template)
         lookAheadBuffer = []
         # We *cannot* have nested comments, so we only need to track if we are in an open comment. We can set it back
@@ -356,6 +573,7 @@ class Template:
                             currentTextNode.addChar(char3)
                             currentTextNode.addChar(char4)
                             node = CommentNode(self)
+                            self._hasStrippableComments |= doSuppressComments
                             currentComment = node
                             self._tagStack.top.addChild(node)
                             self._tagStack.push(node)
@@ -400,18 +618,91 @@ class Template:
         self.rootTag = self._tagStack.pop()
         if not isinstance(self.rootTag, RootTag):
             raise TagsubTemplateSyntaxError("Tag was not closed", tag=self.rootTag)
+        # Comments that are never output are cut out of the tree whatever the optimize level, so formatting does not
+        # even have to step over them.
+        if self._hasStrippableComments:
+            self.optimizationStats["stripComments"] = dict(StripCommentsPass().run(self))
+        if optimize:
+            optimizer = optimize if isinstance(optimize, Optimizer) else Optimizer(optimize)
+            self.optimizationStats.update(optimizer.optimize(self))
+        if self.optimizationStats:
+            updateFlatLoops(self.rootTag)
+        if self.schemas:
+            self._bindSchemas()
+        # A template with nothing in it that looks anything up (all text, say) gives the same output every time.
+        self._staticOutput = formatStaticNodes([self.rootTag]) if isStaticTree(self.rootTag) else None
+
+    @property
+    def fragmentCache(self):
+        if self._fragmentCache is None:
+            # Two threads rendering this Template for the first time must not end up with separate caches.
+            with _fragmentCacheLock:
+                if self._fragmentCache is None:
+                    self._fragmentCache = LRUFragmentCache()
+        return self._fragmentCache
 
     def rollback(self, charcount):
         self.templateIter.rollback(charcount)
         return self
 
-    def format(self, pageDictList):
-        if isinstance(pageDictList, Sequence):
+    def format(self, pageDictList, profiler=None, memoryProfiler=None, savedValues=None, attribution=None,
+               renderBudget=None):
+        # If savedValues is given (a dict), it is updated with what the save tags saved, as {tagchar: {name: value}}.
+        if profiler is not None:
+            with profiler.profiling(self):
+                return self.format(pageDictList, memoryProfiler=memoryProfiler, savedValues=savedValues,
+                                   attribution=attribution, renderBudget=renderBudget)
+        if attribution is not None:
+            with attribution.attributing(self):
+                return self.format(pageDictList, memoryProfiler=memoryProfiler, savedValues=savedValues,
+                                   renderBudget=renderBudget)
+
+        pageDictMapping = self.buildPageDictMapping(pageDictList)
+        if renderBudget is None:
+            renderBudget = self.renderBudget
+        if self._staticOutput is not None and renderBudget is None and memoryProfiler is None and \
+                savedValues is None and self._profiler is None:
+            return self._staticOutput
+
+        if memoryProfiler is not None:
+            with memoryProfiler.tracing(self):
+                outputFormatter = OutputFormatter(self._tagchars, pageDictMapping, self.doIsolateSaves,
+                                                  self.globalDicts, renderBudget, self.maxRecursiveTemplateDepth,
+                                                  self.schemas, self)
+                output = self._render(outputFormatter)
+                memoryProfiler.finishRender(outputFormatter)
+        else:
+            outputFormatter = OutputFormatter(self._tagchars, pageDictMapping, self.doIsolateSaves, self.globalDicts,
+                                              renderBudget, self.maxRecursiveTemplateDepth, self.schemas, self)
+            output = self._render(outputFormatter)
+        if savedValues is not None:
+            savedValues.update(outputFormatter.exportSavedValues())
+        return output
+
+    def _isRecord(self, tagchar, pageDict):
+        # With a Schema, the data for a tagchar may also be a record: a tuple or list of the values in schema order,
+        # or an object with an attribute for each name.
+        return tagchar in self.schemas and not isinstance(pageDict, (Mapping, Resolver, str))
+
+    def buildPageDictMapping(self, pageDictList, allowResolver=True):
+        # Accepts a Mapping, a Sequence of Mappings, or a Mapping of Mappings indexed by tagchar, and returns the
+        # Mapping indexed by tagchar. Records are accepted in place of Mappings for the tagchars with a Schema.
+        allowedTypes = (Mapping, Resolver) if allowResolver else Mapping
+
+        def isAllowed(tagchar, pageDict):
+            return isinstance(pageDict, allowedTypes) or allowResolver and self._isRecord(tagchar, pageDict)
+
+        if allowResolver and len(self._tagchars) == 1 and self._isRecord(self._tagchars, pageDictList) and \
+                not (isinstance(pageDictList, Sequence) and len(pageDictList) == 1 and
+                     isinstance(pageDictList[0], (Mapping, Resolver))):
+            # A lone record. A one element sequence holding a Mapping is still taken as a sequence of Mappings.
+            pageDictMapping = {self._tagchars: pageDictList}
+        elif isinstance(pageDictList, Sequence):
             if len(pageDictList) == len(self._tagchars):
                 # Good situation, so far
                 pageDictMapping = {}
                 for tagchar, pageDict in zip(self._tagchars, pageDictList):
-                    if not isinstance(pageDict, Mapping):
+                    if not isAllowed(tagchar, pageDict):
                         raise TypeError("Must provide a sequence of Mappings")
                     pageDictMapping[tagchar] = pageDict
             else:
@@ -424,15 +715,74 @@ class Template:
                 pageDictMapping = {self._tagchars: pageDictMapping}
             else:
                 for tagchar in self._tagchars:
-                    if tagchar not in pageDictMapping or not isinstance(pageDictMapping[tagchar], Mapping):
+                    if tagchar not in pageDictMapping or not isAllowed(tagchar, pageDictMapping[tagchar]):
                         raise TagcharSequenceMismatchError("Must have a Mapping for each tagchar")
+        elif allowResolver and isinstance(pageDictList, Resolver) and len(self._tagchars) == 1:
+            pageDictMapping = {self._tagchars: pageDictList}
         else:
             raise TypeError("Must provide a Mapping or a Sequence of Mappings or tagchar indexed Mapping of Mappings")
 
-        outputFormatter = OutputFormatter(self._tagchars, pageDictMapping)
+        return pageDictMapping
+
+    def _render(self, outputFormatter):
+        if self.renderCache is not None:
+            return self._formatWithRenderCache(outputFormatter)
+        if outputFormatter.resolverMappings:
+            outputFormatter.prefetchScope(self.rootTag)
         self.rootTag.format(outputFormatter)
         return outputFormatter.getOutput()
 
+    def _formatWithRenderCache(self, outputFormatter):
+        cachedEntry = self.renderCache.lookup(outputFormatter)
+        if cachedEntry is not None:
+            output, writes = cachedEntry
+            # Replay whatever the save tags wrote, so the caller's Mappings end up just as a full render leaves them.
+            for tagchar, savedValues in writes.items():
+                for key, value in savedValues.items():
+                    outputFormatter.rootMapping[tagchar][key] = value
+            return output
+
+        readSet = ReadSet()
+        for tagchar, namespace in outputFormatter.rootMapping.items():
+            namespace.readRecorder = ReadRecorder(readSet, tagchar)
+            # Every read has to be recorded, so no lookups straight from a record.
+            namespace.slotValues = None
+        if outputFormatter.resolverMappings:
+            outputFormatter.prefetchScope(self.rootTag)
+        self.rootTag.format(outputFormatter)
+        output = outputFormatter.getOutput()
+        self.renderCache.store(readSet, output)
+        return output
+
+    def _bindSchemas(self):
+        # Bind each top level lookup of a schema name to its slot. Lookups inside loop and namespace tags can be
+        # answered by the Mapping pushed there, and saveraw and saveoverride bodies are formatted wherever they are
+        # referenced, so those are left to the NamespaceStack. A top level name that is in neither the schema nor the
+        # globals, and that no save tag writes, can never be found, so it is reported now.
+        savedNames = {(node.tagchar, node.value._name) for node, depth in iterNodes(self.rootTag)
+                      if getattr(node, "tag", None) in ("saveeval", "saveraw", "saveoverride")}
+        for value in self.rootTag._scopeValues:
+            tagchar = value.tag.tagchar
+            schema = self.schemas.get(tagchar)
+            if schema is None or self._isDeferredValue(value):
+                continue
+            if value._name in schema.slots:
+                value._slot = schema.slots[value._name]
+            elif (tagchar, value._name) not in savedNames and \
+                    (self.globalDicts is None or value._name not in self.globalDicts[tagchar]):
+                raise InvalidTagKeyName(f"Name {value._name!r} is not in the schema", tag=value.tag, template=self)
+
+    @staticmethod
+    def _isDeferredValue(value):
+        # The name of a save tag, or a lookup somewhere in the body of a saveraw or saveoverride tag.
+        node = value.tag
+        while not isinstance(node, RootTag):
+            tagName = getattr(node, "tag", None)
+            if tagName in ("saveeval", "saveraw", "saveoverride") and (node is value.tag or tagName != "saveeval"):
+                return True
+            node = node.parent
+        return False
+
     def parseTag(self, tagchar):
         # Parse to first ! isLegalKeyChar(char)
         # - if we have a legal tag type, then instantiate the Tag subclass
@@ -463,6 +813,7 @@ class Template:
                 char3 = next(self.templateIter)
                 if char2 != "-" or char3 != "-":
                     raise TagsubTemplateSyntaxError("Illegal tag", template=self)
+                self._hasStrippableComments = True
                 return TagsubCommentNode(tagchar, self)
             self.templateIter.rollback(1)
             token = Token(self)
@@ -1,4 +1,16 @@
 from .Template import Template
+from .util.Resolver import Resolver
+from .util.Schema import Schema
+from .util.RenderCache import RenderCache
+from .util.RenderBudget import RenderBudget
+from .util.FragmentCache import FragmentCacheBackend, LRUFragmentCache
+from .util.TemplateLoader import TemplateLoader, DictTemplateLoader
+from .util.ColumnarData import ColumnarData
+from .util.Profiler import Profiler
+from .util.MemoryProfiler import MemoryProfiler
+from .util.OutputAttribution import OutputAttribution
+from .util.SamplingProfiler import SamplingProfiler
+from .util.Optimizer import Optimizer, OptimizationPass, TreeVisitor, dumpTree
 
 __version__ = "V1.68 Python3"
 
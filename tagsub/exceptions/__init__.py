@@ -1,9 +1,8 @@
 # Define here because the dynamic part also needs it.
 def buildStaticTracebackString(tag, template):
-	# We are not really doing recursive substitution, so, we really only
-	# have position, and if we have an outputFormatter, then we need to
-	# find the indexes to any loop tags (which we can see stepping up the
-	# NamespaceStack).
+	# This is only the position within a single template. If we are inside a
+	# recursive substitution, see addRecursionPrefix for the positions of the
+	# referencing tags.
 
 	# Compile time error
 	if tag:
@@ -19,36 +18,65 @@ def buildStaticTracebackString(tag, template):
 	return " %s(%s,%s)" % (err_abspos, err_lineno, err_linepos)
 
 
+def iterDynamicTagPath(tag, outputFormatter):
+	# The tag and each of its enclosing tags up to (not including) the RootTag, innermost first. Each comes with the
+	# 1-based index of the current iteration for a loop tag being formatted, otherwise None.
+	# Comment nodes and <@ > tags have no tag name, only the RootTag's is None.
+	currentTag = tag
+	while getattr(currentTag, "tag", "") is not None:
+		loopIndex = None
+		if getattr(currentTag, "tag", None) == "loop" and outputFormatter:
+			loopTagData = outputFormatter.loopTagData.get(currentTag)
+			if loopTagData:
+				loopIndex = loopTagData['index']
+		yield currentTag, loopIndex
+		currentTag = currentTag.parent
+
+
 def buildDynamicTracebackString(tag, template, outputFormatter):
 	# The NamespaceStack does not really indicate whether or not the
 	# Mapping is for a loop tag os a namespace tag. We need to walk up the
 	# chain of parent tags looking for loop tags.
 	tracebackElements = []
-	currentTag = tag
-	while True:
-		if currentTag.tag is None:
-			# Found the top level RootTag. Finished.
-			break
-		elif currentTag.tag == "loop" and outputFormatter:
+	for currentTag, loopIndex in iterDynamicTagPath(tag, outputFormatter):
+		if getattr(currentTag, "tag", None) == "loop" and outputFormatter:
 			# This is a loop tag. We need to include the formatting for it, but only at format time. Otherwise it
 			# is just an ordinary tag.
 			tbElement = f"{currentTag._charpos+1}({currentTag._linenum+1},{currentTag._linepos+1})"
-			loopTagData = outputFormatter.loopTagData.get(currentTag.loopId)
-			if loopTagData:
-				tracebackElements.insert(0, f"{tbElement}[{loopTagData['index']}]")
+			if loopIndex is not None:
+				tracebackElements.insert(0, f"{tbElement}[{loopIndex}]")
 			else:
 				tracebackElements.insert(0, tbElement)
 		# else, Normal tag. Skip over it.
-		currentTag = currentTag.parent
 	return ':'.join(tracebackElements)
 
 
-def buildNonTagsubException(excClass, msg, tag, template, outputFormatter=None):
+def buildRuntimeTracebackString(tag, template, outputFormatter):
 	dynamic = buildDynamicTracebackString(tag, template, outputFormatter)
 	if dynamic:
-		tb = f"{buildStaticTracebackString(tag, template)}:{dynamic}"
+		return f"{buildStaticTracebackString(tag, template)}:{dynamic}"
 	else:
-		tb = buildStaticTracebackString(tag, template)
+		return buildStaticTracebackString(tag, template)
+
+
+def addRecursionPrefix(tb, prefix):
+	# Like the C code, each simple tag whose value is being substituted
+	# recursively contributes a "pos(line,col)/" element ahead of the position
+	# in the innermost template, outermost first.
+	if not tb or not prefix:
+		return tb
+	return f" {prefix}{tb.lstrip()}"
+
+
+def getRecursionPrefix(outputFormatter):
+	if outputFormatter is None:
+		return ""
+	return ''.join(f"{element}/" for element in outputFormatter.recursionTracebackStack)
+
+
+def buildNonTagsubException(excClass, msg, tag, template, outputFormatter=None):
+	tb = addRecursionPrefix(buildRuntimeTracebackString(tag, template, outputFormatter),
+							getRecursionPrefix(outputFormatter))
 	return excClass(f"{msg} {tb}")
 
 
@@ -59,6 +87,7 @@ class TagsubBaseException(RuntimeError):
 
 class TagsubProcessingError(TagsubBaseException):
 	def __init__(self, msg, *args, **kwargs):
+		self.msg = msg
 		# One of template or tag should be set (maybe both?).
 		self.template = kwargs.get('template')
 		# If a tag is involved, we may include it here. That will aid building
@@ -68,8 +97,18 @@ class TagsubProcessingError(TagsubBaseException):
 		# the loop iteration numbers.
 		self.outputFormatter = kwargs.get("outputFormatter")
 
+		self.tracebackPrefix = getRecursionPrefix(self.outputFormatter)
+
 		tagsub_tb = self.buildTagsubTracebackString(self.tag, self.template, self.outputFormatter)
-		super().__init__(msg+tagsub_tb, *args)
+		super().__init__(msg+addRecursionPrefix(tagsub_tb, self.tracebackPrefix), *args)
+
+	def setTracebackPrefix(self, prefix):
+		# Compile time errors in a recursively substituted value are raised
+		# without an outputFormatter, so the referencing SimpleTag supplies the
+		# prefix after the fact.
+		self.tracebackPrefix = prefix
+		tagsub_tb = self.buildTagsubTracebackString(self.tag, self.template, self.outputFormatter)
+		self.args = (self.msg+addRecursionPrefix(tagsub_tb, prefix),) + self.args[1:]
 
 	def buildTagsubTracebackString(self, tag, template, outputFormatter):
 		return buildStaticTracebackString(tag, template)
@@ -87,11 +126,7 @@ class TagsubRuntimeError(TagsubProcessingError):
 		# The NamespaceStack does not really indicate whether or not the
 		# Mapping is for a loop tag os a namespace tag. We need to walk up the
 		# chain of parent tags looking for loop tags.
-		dynamic = buildDynamicTracebackString(tag, template, outputFormatter)
-		if dynamic:
-			return f"{buildStaticTracebackString(tag, template)}:{dynamic}"
-		else:
-			return buildStaticTracebackString(tag, template)
+		return buildRuntimeTracebackString(tag, template, outputFormatter)
 
 
 class TagsubCompileTimeError(TagsubProcessingError):
@@ -112,6 +147,17 @@ class TagsubValueError(TagsubRuntimeError, ValueError):
 	pass
 
 
+# An include tag named a template its templateLoader does not have.
+class TemplateNotFoundError(TagsubRuntimeError, LookupError):
+	pass
+
+
+# An implied loop variable was looked up while its loop was not being formatted (from a saveraw body referenced
+# after the loop, say).
+class LoopVarOutOfScopeError(TagsubRuntimeError, LookupError):
+	pass
+
+
 # These overflow errors may go away since we are making this pure Python,
 # Except to avoid failing existing tests, we will honor the limits. Eventually
 # we may bump them a bit higher, but we don't want it to be unlimited.
@@ -131,6 +177,11 @@ class RecursiveSaveEvalOverflowError(TagsubRuntimeError):
 	pass
 
 
+# One of the limits of a util.RenderBudget.RenderBudget was exceeded.
+class RenderBudgetExceededError(TagsubRuntimeError):
+	pass
+
+
 class TagsubTemplateSyntaxError(TagsubCompileTimeError):
 	pass
 
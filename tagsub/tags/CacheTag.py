@@ -0,0 +1,56 @@
+from hashlib import sha1
+
+from .TagContainer import TagContainer
+from .values.Token import Token
+from .values.Value import Value
+from ..exceptions import InvalidTagKeyName
+
+# <@cache name1, name2 ttl>...<@/cache>
+# The rendered body is stored in the Template's fragment cache, keyed on the string values of the named values. The
+# optional ttl is a number of seconds. On a cache hit, the body is not walked at all (so any save tags inside the body
+# will not be run either).
+class CacheTag(TagContainer):
+	tag = "cache"
+
+	def __init__(self, tagchar, template):
+		super().__init__(tagchar, template)
+
+		self._keyValues = []
+		self._ttl = None
+		while True:
+			token = Token(template)
+			self._keyValues.append(Value.createValue(token, template, self))
+			char = next(template.templateIter)
+			while char.isspace():
+				char = next(template.templateIter)
+			if char != ",":
+				break
+		template.rollback(1)
+		if char != ">":
+			token = Token(template)
+			if not token.tokenstr or not token.tokenstr.isdigit() or token.attributeChain or token.impliedLoopVarName:
+				raise InvalidTagKeyName("Invalid cache tag ttl", tag=self)
+			self._ttl = int(token.tokenstr)
+		self.closeTag()
+
+		# Identifies this particular cache tag, even for a backend shared between templates or processes. The same text
+		# renders differently with other tagchars or output options (escaping above all), so those are part of it too.
+		templateDigest = sha1(template._templateStr.encode("utf-8")).hexdigest()
+		options = "".join(str(int(bool(option))) for option in (template.doEncodeHtml, template.is0False,
+																 template.doSuppressComments,
+																 template.doMappingAttributes))
+		self._cacheKeyPrefix = f"{templateDigest}:{template._tagchars}:{self.tagchar}:{options}:{self._charpos}"
+
+	def iterFormatSteps(self, outputFormatter):
+		key = (self._cacheKeyPrefix,) + tuple(
+			str(value.getValue(self.tagchar, outputFormatter)) for value in self._keyValues)
+		fragmentCache = outputFormatter.fragmentCache
+		output = fragmentCache.get(key)
+		if output is None:
+			outputFormatter.pushOutputBuffer()
+			yield from super().iterFormatSteps(outputFormatter)
+			output = outputFormatter.popOutputBuffer()
+			fragmentCache.set(key, output, self._ttl)
+		outputFormatter.markLineSuppressible()
+		outputFormatter.outputString(output)
+		outputFormatter.markLineSuppressible()
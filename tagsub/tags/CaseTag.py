@@ -15,6 +15,10 @@ class CaseTag(TagAlternateChoice):
 		token = Token(template)
 		self.value = Value.createValue(token, template, self)
 		self.closeTag()
+		# Set by the caseDispatch optimization pass (see util/Optimizer.py) when every option is a constant: the
+		# option for each string value, and the else tag, if any, for everything else.
+		self._optionDispatch = None
+		self._dispatchDefault = None
 
 	def addChild(self, childNode):
 		if isinstance(childNode, (OptionTag, ElseTag)):
@@ -39,6 +43,9 @@ class CaseTag(TagAlternateChoice):
 		# XXX I think we walk through each option, pass it our Value and see if
 		# they match. An else tag will always claim to match. Get the contents
 		# of the matching alternate choice.
+		if self._optionDispatch is not None:
+			return self._optionDispatch.get(str(self.value.getValue(self.tagchar, outputFormatter)),
+											self._dispatchDefault)
 		for choice in self._alternateChoices:
 			if choice.matches(self.value.getValue(self.tagchar, outputFormatter), outputFormatter):
 				return choice
@@ -0,0 +1,165 @@
+from itertools import chain, repeat
+from numbers import Number
+
+from .SimpleTag import SimpleTag, htmlEscapeTable
+from .text.TextNode import Line
+from .values.Value import Value
+from ..util.ColumnarData import ColumnarData
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# Raised inside FlatLoop when a value would not render the same way as a plain string (it needs recursive
+# substitution, the name is not in the row, it would raise in the normal path, ...). The loop then falls back to
+# walking the tree for every row, which also takes care of raising any error in the usual way.
+class _Anomaly(Exception):
+	pass
+
+
+# A batched renderer for "flat" loops, whose bodies are only text and simple tags naming a value in the current row.
+# Rather than walk the tree once per row, we gather each column of values for all rows at once, HTML escape each
+# column in a single pass, then join them with the text between the tags.
+#
+# The output has to be exactly what the tree walk gives, including blank line suppression. That is why we only take
+# loops where every complete line in the body has some non-whitespace text. No line that ends in the body can then be
+# suppressed, so everything up to the last line ending is output in one go, and only the incomplete line at the end
+# (which carries on past the loop) needs its suppression state worked out.
+class FlatLoop:
+	def __init__(self, loopTag, pieces):
+		self._loopTag = loopTag
+		self._template = loopTag._template
+		# A list of Lines and the names of the simple tags, in body order.
+		self._pieces = pieces
+		self._names = [piece for piece in pieces if isinstance(piece, str)]
+		# Pieces after the last complete line, which are left pending at the end of the loop. Without a complete line,
+		# everything the loop outputs is left pending.
+		lastCompleteLine = max([index for index, piece in enumerate(pieces)
+								if isinstance(piece, Line) and piece.isCompleteLine], default=None)
+		self._hasCompleteLine = lastCompleteLine is not None
+		self._tailPieceCount = len(pieces) - lastCompleteLine - 1 if self._hasCompleteLine else None
+
+	@classmethod
+	def forLoopTag(cls, loopTag):
+		# Called once the loop is parsed. Returns None if the loop body is not flat.
+		if loopTag._startValue is not None or loopTag._limitValue is not None:
+			return None
+		pieces = []
+		for child in loopTag._children:
+			if isinstance(child, Line):
+				if child.isCompleteLine and child.isspace():
+					return None
+				pieces.append(child)
+			elif type(child) is SimpleTag and child.tagchar == loopTag.tagchar and type(child._value) is Value and \
+					child._value._name and not child._value._attributeChain and not child._value._impliedLoopVar:
+				pieces.append(child._value._name)
+			else:
+				return None
+		if not pieces or not any(isinstance(piece, str) for piece in pieces):
+			return None
+		return cls(loopTag, pieces)
+
+	def format(self, loopSequence, outputFormatter):
+		# Returns False, having output nothing, if the loop needs the tree walk instead.
+		if type(loopSequence) not in (list, tuple, ColumnarData) or not loopSequence:
+			return False
+		budgetUsage = outputFormatter.budgetUsage
+		if budgetUsage is not None:
+			# Output and time limits are checked after each tag, which the batch can only do once it has built the
+			# whole loop. So those renders take the tree walk, which stops soon after going over.
+			budget = budgetUsage.budget
+			if budget.maxOutputChars is not None or budget.maxSeconds is not None:
+				return False
+			# Stop before building anything if the whole loop would go over.
+			budgetUsage.checkLoopIterations(len(loopSequence), self._loopTag, outputFormatter)
+		try:
+			columns = {name: self.getOutputColumn(name, loopSequence) for name in self._names}
+		except _Anomaly:
+			return False
+
+		length = len(loopSequence)
+		parts = [columns[piece] if isinstance(piece, str) else repeat(str(piece), length) for piece in self._pieces]
+		flat = list(chain.from_iterable(zip(*parts)))
+
+		outputFormatter.markLineSuppressible()
+		if self._hasCompleteLine:
+			headLength = len(flat) - self._tailPieceCount
+			# Ends with a complete line that has non-whitespace text, so this outputs the pending line too.
+			outputFormatter.outputString(Line(''.join(flat[:headLength])))
+			tail = flat[headLength:]
+			tailPieces = self._pieces[-self._tailPieceCount:] if self._tailPieceCount else []
+		else:
+			tail = flat
+			tailPieces = self._pieces * length
+		if tail:
+			isBlank = all(text.isspace() if isinstance(piece, Line) else not text
+						  for piece, text in zip(tailPieces, tail))
+			outputFormatter.outputPartialLine(''.join(tail), isBlank)
+		outputFormatter.markLineSuppressible()
+		if budgetUsage is not None:
+			budgetUsage.countLoopIterations(length, self._loopTag, outputFormatter)
+		return True
+
+	def getOutputColumn(self, name, loopSequence):
+		# The strings the simple tag for name would output, for every row.
+		if isinstance(loopSequence, ColumnarData):
+			if name not in loopSequence.columns:
+				raise _Anomaly()
+			column = loopSequence.columns[name]
+			if numpy is not None and isinstance(column, numpy.ndarray) and column.dtype.kind in "iu":
+				# Whole numbers format the same way as Python ints, so convert the whole array at once.
+				column = column.tolist()
+		else:
+			column = []
+			for row in loopSequence:
+				# Rows that are not plain dicts might do anything on lookup, and a name not in the row would be looked
+				# up in the enclosing mappings.
+				if type(row) is not dict or name not in row:
+					raise _Anomaly()
+				column.append(row[name])
+
+		from .. import rawstr
+		template = self._template
+		doEncodeHtml = template.doEncodeHtml
+		is0False = template.is0False
+		toEscape = []
+		values = []
+		for value in column:
+			# The same sequence of checks Value.getValue and SimpleTag.format apply.
+			if value is None:
+				value = ""
+			elif is0False and isinstance(value, str) and value == "0":
+				if doEncodeHtml:
+					raise _Anomaly()
+				value = "0"
+			if isinstance(value, str):
+				if isinstance(value, rawstr):
+					values.append(str(value))
+					continue
+				if doEncodeHtml:
+					toEscape.append(len(values))
+				elif type(value) is str and any(f"<{tagchar}" in value for tagchar in template._tagchars):
+					raise _Anomaly()
+				values.append(value)
+			elif isinstance(value, Number) and not doEncodeHtml:
+				values.append(str(value))
+			else:
+				raise _Anomaly()
+
+		if toEscape:
+			if len(toEscape) == len(values):
+				return self.escapeColumn(values)
+			escaped = self.escapeColumn([values[index] for index in toEscape])
+			for index, text in zip(toEscape, escaped):
+				values[index] = text
+		return values
+
+	@staticmethod
+	def escapeColumn(values):
+		# One translate call for the whole column, unless a value contains our separator.
+		joined = '\0'.join(values)
+		if joined.count('\0') == len(values) - 1:
+			return joined.translate(htmlEscapeTable).split('\0')
+		return [value.translate(htmlEscapeTable) for value in values]
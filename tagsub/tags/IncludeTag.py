@@ -0,0 +1,43 @@
+from . import Tag
+from .values.Token import Token
+from ..exceptions import InvalidTagKeyName, TagsubTemplateSyntaxError, TemplateNotFoundError
+
+# <@include name> or <@include "name">
+# Renders the named template from the Template's templateLoader in place, with the current NamespaceStacks (so it
+# sees any enclosing loop and namespace mappings). The quoted form allows names that are not legal key names, like
+# "partials/header.html".
+class IncludeTag(Tag.Tag):
+	tag = "include"
+
+	def __init__(self, tagchar, template):
+		super().__init__(tagchar, template)
+		token = Token(template, isOptionValue=True)
+		if token.isOptionLookup or token.impliedLoopVarName:
+			raise InvalidTagKeyName("Invalid include tag name", tag=self)
+		self._name = '.'.join([token.tokenstr] + (token.attributeChain or []))
+		self.closeTag()
+		if template.templateLoader is None:
+			raise TagsubTemplateSyntaxError("include tag requires a templateLoader", tag=self)
+
+	def format(self, outputFormatter):
+		Tag.runFormatSteps(self.iterFormatSteps(outputFormatter), outputFormatter)
+
+	def formatSteps(self, outputFormatter):
+		return self.iterFormatSteps(outputFormatter)
+
+	def iterFormatSteps(self, outputFormatter):
+		includedTemplate = None
+		with outputFormatter.recursiveTemplate(self):
+			try:
+				includedTemplate = self._template.templateLoader.getTemplate(self._name, self._template)
+			except KeyError:
+				pass
+			else:
+				if outputFormatter.resolverMappings:
+					outputFormatter.prefetchScope(includedTemplate.rootTag)
+				yield includedTemplate.rootTag
+		# Raised out here so the traceback is just the position of this tag, not this tag referencing itself.
+		if includedTemplate is None:
+			raise TemplateNotFoundError(f"Template {self._name!r} not found", tag=self, outputFormatter=outputFormatter)
+		if outputFormatter.budgetUsage is not None:
+			outputFormatter.budgetUsage.check(self, outputFormatter)
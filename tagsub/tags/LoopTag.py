@@ -1,38 +1,108 @@
 
 import collections.abc
+from contextlib import nullcontext
+from itertools import islice
 
 from .TagContainer import TagContainer
+from .NamespaceScope import NamespaceScope
 from .values.Token import Token
 from .values.Value import Value
-from ..exceptions import InvalidTagKeyName
+from .values.ConstantValue import ConstantValue
+from ..exceptions import InvalidTagKeyName, TagsubValueError, LoopVarOutOfScopeError
 from ..exceptions import buildNonTagsubException
+from ..util.LoopPrefetcher import LoopPrefetcher
+from ..util.ColumnarData import ColumnarData
+from .FlatLoop import FlatLoop
 
-def loopTagId():
-	idVal = 1
-	while True:
-		yield idVal
-		idVal += 1
-loopTagIdIterator = loopTagId()
+def iterWithLookahead(iterable):
+	# Yields (obj, isLast) pairs. We hold back one item, so we know when we are on the last one without needing a
+	# length (and without materializing the whole iterable to get one).
+	iterator = iter(iterable)
+	try:
+		obj = next(iterator)
+	except StopIteration:
+		return
+	for nextObj in iterator:
+		yield obj, False
+		obj = nextObj
+	yield obj, True
 
-class LoopTag(TagContainer):
+class LoopTag(TagContainer, NamespaceScope):
 	tag="loop"
 
 	def __init__(self, tagchar, template):
 		super().__init__(tagchar, template)
+		self._scopeValues = []
 
-		self.loopId = next(loopTagIdIterator)
 		self._value = Value.createValue(Token(template), template, self)
+		# Set when the loop is closed, if the body qualifies for batched rendering. See FlatLoop.py
+		self._flatLoop = None
+
+		# Optional window over the loop sequence: <@loop name start=s limit=n index=window|sequence>
+		# start and limit are either whole numbers or looked up values. With index=window (the default), the implied
+		# loop vars are relative to the window. With index=sequence, they are relative to the whole sequence.
+		self._startValue = None
+		self._limitValue = None
+		self._indexRelativeToSequence = False
+		while True:
+			char = next(template.templateIter)
+			while char.isspace():
+				char = next(template.templateIter)
+			template.rollback(1)
+			if char == ">":
+				break
+			self.parseWindowOption(template)
 		self.closeTag()
 
-	def setLoopVars(self, index, length, obj, outputFormatter):
-		if self.loopId not in outputFormatter.loopTagData:
-			outputFormatter.loopTagData[self.loopId] = {"length": length}
-		loopDataDict = outputFormatter.loopTagData[self.loopId]
+	def validateCloseTag(self, tagchar, template):
+		super().validateCloseTag(tagchar, template)
+		self._flatLoop = FlatLoop.forLoopTag(self)
+
+	def parseWindowOption(self, template):
+		optionToken = Token(template)
+		if optionToken.tokenstr not in ("start", "limit", "index") or optionToken.attributeChain or \
+				optionToken.impliedLoopVarName or next(template.templateIter) != "=":
+			raise InvalidTagKeyName("Invalid loop tag option", tag=self)
+		valueToken = Token(template)
+		if optionToken.tokenstr == "index":
+			if valueToken.tokenstr not in ("window", "sequence") or valueToken.attributeChain or \
+					valueToken.impliedLoopVarName:
+				raise InvalidTagKeyName("Loop index option must be window or sequence", tag=self)
+			self._indexRelativeToSequence = valueToken.tokenstr == "sequence"
+			return
+		if valueToken.tokenstr and valueToken.tokenstr.isdigit() and not valueToken.attributeChain:
+			value = ConstantValue(int(valueToken.tokenstr))
+		else:
+			value = Value.createValue(valueToken, template, self)
+		if optionToken.tokenstr == "start":
+			self._startValue = value
+		else:
+			self._limitValue = value
+
+	def getWindowBound(self, value, outputFormatter, default):
+		if value is None:
+			return default
+		bound = value.getValue(self._tagchar, outputFormatter)
+		if bound == "":
+			return default
+		try:
+			bound = int(bound)
+		except (TypeError, ValueError):
+			bound = -1
+		if bound < 0:
+			# Like an invalid loop sequence, we have not entered the loop yet, so leave off outputFormatter.
+			raise TagsubValueError("Loop start and limit must be whole numbers", tag=self)
+		return bound
+
+	def setLoopVars(self, index, length, obj, outputFormatter, isLast=None):
+		if self not in outputFormatter.loopTagData:
+			outputFormatter.loopTagData[self] = {"length": length}
+		loopDataDict = outputFormatter.loopTagData[self]
 		# Update (or initialize) the implied loop vars.
 		# In the C code, we use int values of 1 and 0, not bool True and False.
 		loopDataDict["isFirst"] = int(index == 0)
-		# If no length, this will always be False
-		loopDataDict["isLast"] = int(index+1 == length)
+		# Without a length, the caller has to tell us (see iterWithLookahead)
+		loopDataDict["isLast"] = int(index+1 == length) if isLast is None else int(isLast)
 		loopDataDict["isOdd"] = int(index & 1 == 0)
 		loopDataDict["isEven"] = int(index & 1 != 0)
 		loopDataDict["index0"] = index
@@ -46,26 +116,30 @@ class LoopTag(TagContainer):
 		# loopDataDict["object"] = obj
 
 	def resetLoopVars(self, outputFormatter):
-		if self.loopId in outputFormatter.loopTagData:
-			del outputFormatter.loopTagData[self.loopId]
+		if self in outputFormatter.loopTagData:
+			del outputFormatter.loopTagData[self]
 
 	def getImpliedLoopVar(self, loopVarValue, outputFormatter):
 		loopVarName = loopVarValue._impliedLoopVar
-		loopDataDict = outputFormatter.loopTagData[self.loopId]
+		loopDataDict = outputFormatter.loopTagData.get(self)
+		if loopDataDict is None:
+			raise LoopVarOutOfScopeError("Implied loop var used outside of its loop", tag=loopVarValue.tag,
+										 outputFormatter=outputFormatter)
 		if loopVarName in loopDataDict:
 			return loopDataDict[loopVarName]
 		else:
 			raise InvalidTagKeyName("Invalid implied loop var name", tag=loopVarValue.tag, outputFormatter=outputFormatter)
 
-	def format(self, outputFormatter):
+	def iterFormatSteps(self, outputFormatter):
 		# TODO Loop through the dicts in our sequence. The might not need to be
 		# dicts if we treat them as objects (obj.xxx ??)
 		loopSequence = self._value.getValue(self._tagchar, outputFormatter)
-		if isinstance(loopSequence, collections.abc.Sequence):
+		if isinstance(loopSequence, collections.abc.Sequence) or (
+				isinstance(loopSequence, collections.abc.Iterable) and isinstance(loopSequence, collections.abc.Sized)):
 			# We have a known length and a rindex property (reverse index)
 			length = len(loopSequence)
 		elif isinstance(loopSequence, collections.abc.Iterable):
-			# We have most everything else.
+			# We have most everything else. isLast comes from looking ahead one item, but rindex is not available.
 			length = None
 		elif not loopSequence:
 			loopSequence = []
@@ -74,17 +148,83 @@ class LoopTag(TagContainer):
 			# Since we have not entered the loop sequence yet (not a sequence), leave off outputFormatter so it won't try building the dynamic portion.
 			raise buildNonTagsubException(TypeError, "Invalid Sequence for loop tag", tag=self, template=None)
 
+		# Batch up the names referenced in the loop body once for the whole loop, not once per iteration.
+		if outputFormatter.resolverMappings:
+			outputFormatter.prefetchScope(self)
+
 		# LoopTag is special in that it needs to preserve its internal scratch space over all the iterations,
 		# which would normally get lost when it pops the previous iteration mapping off of the NamespaceStack. So,
 		# we pass it in each iteration
 		scratchSpace = {}
-		for index, obj in enumerate(loopSequence):
-			self.setLoopVars(index, length, obj, outputFormatter)
-			if isinstance(obj, collections.abc.Mapping):
-				outputFormatter.rootMapping[self._tagchar].push(obj)#), scratchSpace)
-				super().format(outputFormatter)
-				outputFormatter.rootMapping[self._tagchar].pop()
+		loopContext = nullcontext()
+		if length is not None:
+			# The batched path does not go through the per-tag format methods, so leave it alone while a profiler has
+			# them wrapped.
+			if self._flatLoop is None or "format" in vars(self) or "setLoopVars" in vars(self) or \
+					not self._flatLoop.format(loopSequence, outputFormatter):
+				iterations = self.iterSized(loopSequence, length, outputFormatter)
 			else:
-				super().format(outputFormatter)
+				iterations = ()
+		elif self._template.loopPrefetchDepth:
+			loopContext = LoopPrefetcher(loopSequence, self._template.loopPrefetchDepth)
+			iterations = self.iterWithLookahead(loopContext, outputFormatter)
+		else:
+			iterations = self.iterWithLookahead(loopSequence, outputFormatter)
+
+		# The body of each iteration is yielded from right here, rather than through another generator per iteration,
+		# since every extra level of yield from costs something for every node in the body.
+		namespace = outputFormatter.rootMapping[self._tagchar]
+		with loopContext:
+			for index, iterationLength, obj, isLast in iterations:
+				self.setLoopVars(index, iterationLength, obj, outputFormatter, isLast)
+				if outputFormatter.budgetUsage is not None:
+					outputFormatter.budgetUsage.countLoopIterations(1, self, outputFormatter)
+				isMapping = isinstance(obj, collections.abc.Mapping)
+				if isMapping:
+					namespace.push(obj)#), scratchSpace)
+				outputFormatter.markLineSuppressible()
+				yield from self._children
+				outputFormatter.markLineSuppressible()
+				if isMapping:
+					namespace.pop()
 		self.resetLoopVars(outputFormatter)
 
+	# iterSized and iterWithLookahead give the (index, length, obj, isLast) of each iteration, for the window if there
+	# is one.
+	def iterSized(self, loopSequence, length, outputFormatter):
+		start = self.getWindowBound(self._startValue, outputFormatter, 0)
+		limit = self.getWindowBound(self._limitValue, outputFormatter, None)
+		stop = length if limit is None else min(length, start + limit)
+		if start == 0 and stop == length:
+			for index, obj in enumerate(loopSequence):
+				yield index, length, obj, None
+			return
+		# Index a Sequence directly, so the items before the window are never touched.
+		if isinstance(loopSequence, ColumnarData):
+			window = loopSequence.iterRows(start, stop)
+		elif isinstance(loopSequence, collections.abc.Sequence):
+			window = (loopSequence[index] for index in range(start, stop))
+		else:
+			window = islice(loopSequence, start, stop)
+		if self._indexRelativeToSequence:
+			for index, obj in enumerate(window, start):
+				yield index, length, obj, None
+		else:
+			windowLength = max(stop - start, 0)
+			for index, obj in enumerate(window):
+				yield index, windowLength, obj, None
+
+	def iterWithLookahead(self, iterable, outputFormatter):
+		start = self.getWindowBound(self._startValue, outputFormatter, 0)
+		limit = self.getWindowBound(self._limitValue, outputFormatter, None)
+		if not start and limit is None:
+			items = iterWithLookahead(iterable)
+		elif self._indexRelativeToSequence:
+			# isLast is relative to the whole sequence, so look ahead past the end of the window.
+			items = islice(iterWithLookahead(islice(iterable, start, None)), limit)
+		else:
+			items = iterWithLookahead(islice(iterable, start, None if limit is None else start + limit))
+		offset = start if self._indexRelativeToSequence else 0
+		for index, (obj, isLast) in enumerate(items, offset):
+			yield index, None, obj, isLast
+
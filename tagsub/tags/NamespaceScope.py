@@ -0,0 +1,24 @@
+
+# Mixin for the tags that open a new scope on the NamespaceStack at format time (the RootTag, loop and namespace
+# tags). While parsing, every Value that looks up a name registers with its nearest enclosing scope, which gives us
+# the statically known set of names referenced at each scope level.
+class NamespaceScope:
+	def addScopeValue(self, value):
+		self._scopeValues.append(value)
+
+	@property
+	def prefetchNames(self):
+		# Computed lazily, since a SimpleTag does not attach itself to its Value until after the Value is created.
+		# Keyed by tagchar, since each tagchar has its own root Mapping (or Resolver).
+		try:
+			return self._prefetchNames
+		except AttributeError:
+			pass
+		prefetchNames = {}
+		for value in self._scopeValues:
+			# The names of saveeval and saveraw tags are only ever written, never read.
+			if value.tag.tag in ("saveeval", "saveraw"):
+				continue
+			prefetchNames.setdefault(value.tag.tagchar, set()).add(value._name)
+		self._prefetchNames = {tagchar: frozenset(names) for tagchar, names in prefetchNames.items()}
+		return self._prefetchNames
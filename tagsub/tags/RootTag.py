@@ -1,10 +1,11 @@
 
 from .TagContainer import TagContainer
+from .NamespaceScope import NamespaceScope
 from collections import deque
 
 # Will only be one for a template. Will be the top level parent of all tags.
 # Only there to hold the top level children.
-class RootTag(TagContainer):
+class RootTag(TagContainer, NamespaceScope):
 	tag = None
 	def __init__(self, tagchar, template):
 		self._tagchar = tagchar
@@ -13,6 +14,7 @@ class RootTag(TagContainer):
 		self._linenum = 0
 		self._linepos = 0
 		self._children = []
+		self._scopeValues = []
 		# We will need this for blank line suppression, since we are not inheriting the TagContainer.__init__
 		self._blankLineSuppressionCandidates = deque()
 		self._maybeSupressible = True
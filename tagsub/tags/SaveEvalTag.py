@@ -17,12 +17,12 @@ class SaveEvalTag(TagContainer):
 		self.value = Value.createValue(token, template, self)
 		self.closeTag()
 
-	def format(self, outputFormatter):
+	def iterFormatSteps(self, outputFormatter):
 		# Create a new output buffer in the OutputFormatter at this point and then format the
 		#  children into that. Then we need to get the results and save that into the NamespaceStack.
 		outputFormatter.markLineSuppressible()
 		outputFormatter.pushOutputBuffer()
-		super().format(outputFormatter)
+		yield from super().iterFormatSteps(outputFormatter)
 		saveValue = outputFormatter.popOutputBuffer()
 		namespace = outputFormatter.rootMapping[self.tagchar]
 		namespace[self.value._name] = saveValue
\ No newline at end of file
@@ -1,5 +1,6 @@
 
 
+from .Tag import Tag
 from .TagContainer import TagContainer
 from .values.Token import Token
 from .values.Value import Value
@@ -15,22 +16,40 @@ class SaveOverrideTag(TagContainer):
 			raise InvalidTagKeyName("Must only have simple name for save tags", tag=self)
 		self.value = Value.createValue(token, template, self)
 		self.closeTag()
-		self._superTagReferences = []
-
-	def addSuperTagReference(self, superTag):
-		self._superTagReferences.append(superTag)
 
 	def formatAtReference(self, outputFormatter):
 		super().format(outputFormatter)
 
+	def formatSteps(self, outputFormatter):
+		# Like saveraw, the children are only formatted where it is referenced.
+		self.format(outputFormatter)
+
 	def format(self, outputFormatter):
 		namespace = outputFormatter.rootMapping[self.tagchar]
 		# When we hit it, saveraw tag does not get formatted into the output, nor do we walk the children and format
 		# them. Instead, we save a reference to the tag. The Value object recognizes that we have a Tag and calls the
 		# above formatAtReference to get it formatted into the output with the current NamespaceStack.
 		outputFormatter.markLineSuppressible()
-		overriddenValue = namespace.get(self.value._name)
-		for superTag in self._superTagReferences:
-			superTag.setReference(overriddenValue)
-		namespace[self.value._name] = self
+		namespace[self.value._name] = SavedOverride(self, namespace.get(self.value._name))
+
+
+# What a saveoverride tag saves: the tag, and the value it overrode, which its super tags stand for. The overridden
+# value is captured here when the saveoverride is formatted, so the saved value can still be referenced (super tags
+# and all) after the render that saved it. Like the saveraw and saveoverride tags themselves, it is a Tag, so it is
+# formatted where it is referenced. It is never part of a parsed tree.
+class SavedOverride(Tag):
+	tag = "saveoverride"
+	def __init__(self, saveOverrideTag, overriddenValue):
+		# Nothing to parse, so no Tag.__init__
+		self.saveOverrideTag = saveOverrideTag
+		# A str, a SaveRawTag or SavedOverride, or None.
+		self.overriddenValue = overriddenValue
+
+	def formatAtReference(self, outputFormatter):
+		# The super tags in the body look for the innermost SavedOverride of their saveoverride tag being formatted.
+		outputFormatter.activeOverrides.append(self)
+		try:
+			self.saveOverrideTag.formatAtReference(outputFormatter)
+		finally:
+			outputFormatter.activeOverrides.pop()
 
@@ -19,6 +19,11 @@ class SaveRawTag(TagContainer):
     def formatAtReference(self, outputFormatter):
         super().format(outputFormatter)
 
+    def formatSteps(self, outputFormatter):
+        # Saving the reference is all there is to do where the tag is. The children are formatted where it is
+        # referenced.
+        self.format(outputFormatter)
+
     def format(self, outputFormatter):
         namespace = outputFormatter.rootMapping[self.tagchar]
         # When we hit it, saveraw tag does not get formatted into the output, nor do we walk the children and format
@@ -1,9 +1,12 @@
 
-from .Tag import Tag
+from . import Tag
 from ..exceptions import InvalidTagKeyName
 from html.entities import codepoint2name
 
-class SimpleTag(Tag):
+# For str.translate. Gives the same result as SimpleTag.escapeStringForHtml.
+htmlEscapeTable = {codepoint: f"&{name};" for codepoint, name in codepoint2name.items()}
+
+class SimpleTag(Tag.Tag):
 	tag = "simple"
 	def __init__(self, tagchar, value, template):
 		super().__init__(tagchar, template)
@@ -20,7 +23,36 @@ class SimpleTag(Tag):
 			return f"&{entity};" if entity else char
 		return ''.join([escapedChar(c) for c in strVal])
 
+	def containsTags(self, strVal):
+		return any(f"<{tagchar}" in strVal for tagchar in self._template._tagchars)
+
+	def formatRecursively(self, strVal, outputFormatter):
+		# A formatSteps generator (see Tag.runFormatSteps). The value contains tags of its own, so it is processed as
+		# a template, using the same NamespaceStacks. Only done without HTML entity encoding, where values are trusted
+		# markup anyway. With encoding on (or for a rawstr), the tags are just text.
+		from ..Template import compileValueTemplate
+		template = self._template
+		with outputFormatter.recursiveTemplate(self):
+			valueTemplate = compileValueTemplate(template._tagchars, strVal, template.is0False,
+												 template.doSuppressComments, template.doStrictKeyLookup,
+												 template.doEncodeHtml, template.loopPrefetchDepth,
+												 template.maxNestedTagDepth, template.optimize, template.doMappingAttributes)
+			if outputFormatter.resolverMappings:
+				outputFormatter.prefetchScope(valueTemplate.rootTag)
+			outputFormatter.pushOutputBuffer()
+			yield valueTemplate.rootTag
+			value = outputFormatter.popOutputBuffer()
+		outputFormatter.outputString(value)
+		self.endOutput(outputFormatter)
+
 	def format(self, outputFormatter):
+		# Called by name, so this skips any instrumented formatSteps on the instance (which calls back into format).
+		steps = SimpleTag.formatSteps(self, outputFormatter)
+		if steps is not None:
+			Tag.runFormatSteps(steps, outputFormatter)
+
+	def formatSteps(self, outputFormatter):
+		# Returns the steps for a recursively substituted value, which still has to be formatted.
 		from .. import rawstr
 		# Look up the value. If it is a string (already a string or
 		#  saveeval), just substitute (doing HTML entity encoding as needed). If
@@ -28,8 +60,15 @@ class SimpleTag(Tag):
 		# Apparently we are considering SimpleTags as suppressible too.
 		value = self._value.getValue(self._tagchar, outputFormatter)
 		outputFormatter.markLineSuppressible()
-		if self._template.doEncodeHtml and not isinstance(value, rawstr):
+		if not self._template.doEncodeHtml and type(value) is str and self.containsTags(value):
+			return self.formatRecursively(value, outputFormatter)
+		elif self._template.doEncodeHtml and not isinstance(value, rawstr):
 			outputFormatter.outputString(self.escapeStringForHtml(value))
 		else:
 			outputFormatter.outputString(value)
-		outputFormatter.markLineSuppressible()
\ No newline at end of file
+		self.endOutput(outputFormatter)
+
+	def endOutput(self, outputFormatter):
+		outputFormatter.markLineSuppressible()
+		if outputFormatter.budgetUsage is not None:
+			outputFormatter.budgetUsage.check(self, outputFormatter)
\ No newline at end of file
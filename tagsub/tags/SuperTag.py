@@ -10,19 +10,13 @@ class SuperTag(Tag):
 	def __init__(self, tagchar, template):
 		super().__init__(tagchar, template)
 		self._parent = None
-		self._overriddenValue = None
+		# The enclosing saveoverride tag, set along with the parent.
+		self._saveOverrideTag = None
 		self.closeTag()
 
-	# Before we write the results of the parsed saveoverride tag back into the NamespaceStack (like we do with
-	# saveraw), we need, when we hit the super tag, to pull the current value of the variable specified in
-	# saveoverride and save a reference to it on the super tag (essentially the value). If it is simply text,
-	# then it would be a ConstantValue. If it is a SaverawTag or SaveOverrideTag, then that should be the value of
-	# super (or at least it should retain a reference to it) so when asked to format output, it can pass the request
-	# into the referenced tag.
-
-	def setReference(self, overriddenValue):
-		# overriddenValue may be a str, a SaveOverrideTag or SaveRawTag or None
-		self._overriddenValue = overriddenValue
+	# When the saveoverride tag is formatted, it saves a SavedOverride holding the value it overrode. That is what the
+	# super tag stands for. If it is simply text, it is output as is. If it is a SaveRawTag or SavedOverride, the
+	# request to format output is passed into it.
 
 	@property
 	def parent(self):
@@ -35,18 +29,25 @@ class SuperTag(Tag):
 			if isinstance(a_parent, RootTag):
 				raise TagsubTemplateSyntaxError(f"Misplaced {self.tag} tag", tag=self)
 			if isinstance(a_parent, SaveOverrideTag):
-				a_parent.addSuperTagReference(self)
+				self._saveOverrideTag = a_parent
 				break
 			a_parent = a_parent.parent
 
 	def format(self, outputFormatter):
 		outputFormatter.markLineSuppressible()
-		if isinstance(self._overriddenValue, Tag):
+		overriddenValue = None
+		for savedOverride in reversed(outputFormatter.activeOverrides):
+			if savedOverride.saveOverrideTag is self._saveOverrideTag:
+				overriddenValue = savedOverride.overriddenValue
+				break
+		if isinstance(overriddenValue, Tag):
 			# Assume a SaveRaw or SaveOverride
+			if outputFormatter.budgetUsage is not None:
+				outputFormatter.budgetUsage.countSaveRawExpansion(self, outputFormatter)
 			outputFormatter.pushOutputBuffer()
-			self._overriddenValue.formatAtReference(outputFormatter)
+			overriddenValue.formatAtReference(outputFormatter)
 			value = outputFormatter.popOutputBuffer()
 			outputFormatter.outputString(value)
 		else:
-			outputFormatter.outputString(str(self._overriddenValue) if self._overriddenValue is not None else "")
+			outputFormatter.outputString(str(overriddenValue) if overriddenValue is not None else "")
 		outputFormatter.markLineSuppressible()
@@ -1,5 +1,54 @@
 from ..exceptions import TagsubTemplateSyntaxError
 
+
+def runFormatSteps(steps, outputFormatter):
+	# Formats a tree from an explicit stack of formatSteps generators rather than through nested format calls, so a
+	# deeply nested template does not need a Python frame (or three) per level. Each generator yields the child nodes
+	# to format next. A child either formats itself right away (formatSteps returns None) or returns its own generator,
+	# which goes on the stack.
+	stack = [steps]
+	while stack:
+		steps = stack[-1]
+		try:
+			for node in steps:
+				childSteps = node.formatSteps(outputFormatter)
+				if childSteps is not None:
+					stack.append(childSteps)
+					break
+			else:
+				stack.pop()
+		except BaseException as e:
+			throwFormatStepsException(stack, e, outputFormatter)
+
+
+def throwFormatStepsException(stack, exception, outputFormatter):
+	# An exception is thrown into each suspended generator in turn, innermost first, just as it would propagate up
+	# through nested calls, so their with and try blocks still run. A generator that raised is finished already.
+	while True:
+		if stack[-1].gi_frame is None:
+			stack.pop()
+			if not stack:
+				raise exception
+		try:
+			node = stack[-1].throw(exception)
+		except StopIteration:
+			# Handled, and the generator is done.
+			stack.pop()
+			return
+		except BaseException as e:
+			exception = e
+			continue
+		# Handled, and the generator carries on with another child.
+		try:
+			childSteps = node.formatSteps(outputFormatter)
+		except BaseException as e:
+			exception = e
+			continue
+		if childSteps is not None:
+			stack.append(childSteps)
+		return
+
+
 class Tag:
 	def __init__(self, tagchar, template):
 		# Base class for other tag types.
@@ -27,6 +76,10 @@ class Tag:
 	def isBalancedTag(self):
 		return False
 
+	def formatSteps(self, outputFormatter):
+		# See runFormatSteps. Tags without children just format themselves.
+		self.format(outputFormatter)
+
 	def closeTag(self, optionalExceptionClass=None, optionalExceptionMessage=None):
 		# Consume any whitespace and the closing '>' character. Raise a
 		# TagsubTemplateSyntaxError if we do not find that. All tags may use
@@ -34,7 +34,13 @@ class TagAlternateChoice(TagContainer.TagContainer):
 	def chooseAlternate(self, outputFormatter):
 		raise NotImplementedError()
 
-	def format(self, outputFormatter):
+	def iterFormatSteps(self, outputFormatter):
 		activeAlternate = self.chooseAlternate(outputFormatter)
 		if activeAlternate:
-			activeAlternate.format(outputFormatter)
+			yield activeAlternate
+
+	def formatSteps(self, outputFormatter):
+		# Hand over the steps of the active alternate directly, rather than through a generator of our own.
+		activeAlternate = self.chooseAlternate(outputFormatter)
+		if activeAlternate:
+			return activeAlternate.formatSteps(outputFormatter)
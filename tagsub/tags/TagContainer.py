@@ -31,10 +31,17 @@ class TagContainer(Tag.Tag):
         outputFormatter.markLineSuppressible()
 
     def format(self, outputFormatter):
+        Tag.runFormatSteps(self.iterFormatSteps(outputFormatter), outputFormatter)
+
+    def formatSteps(self, outputFormatter):
+        return self.iterFormatSteps(outputFormatter)
+
+    def iterFormatSteps(self, outputFormatter):
+        # Subclasses wrap their own work around this (or replace it). Yields each child to be formatted in turn. See
+        # Tag.runFormatSteps.
         # TODO make a call to outputFormatter indicating the current line should be eligible for suppression
         self.markLineSuppressible(outputFormatter)
-        for child in self._children:
-            child.format(outputFormatter)
+        yield from self._children
         # TODO make another call to outputFormatter to say the current line is eligible for suppression
         self.markLineSuppressible(outputFormatter)
 
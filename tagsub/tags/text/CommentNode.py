@@ -22,11 +22,12 @@ class CommentNode(TagContainer):
         super().__init__("", template)
         # In template parsing, we already parsed the "<!--" chars. They are assumed to be present already.
 
-    def format(self, outputFormatter):
+    def iterFormatSteps(self, outputFormatter):
         # Conditionally put this out, depending on comment suppression, possibly suppress any incomplete blank line
-        # preceding the comment if the comment is suppressed.
+        # preceding the comment if the comment is suppressed. Suppressed comments are normally replaced by a
+        # SuppressibleMarker as soon as the template is parsed (see util/Optimizer.py), so do not get here.
         if self._template.doSuppressComments:
             outputFormatter.markLineSuppressible()
         else:
             # Let the TagContainer write out the children
-            super().format(outputFormatter)
+            yield from super().iterFormatSteps(outputFormatter)
@@ -0,0 +1,9 @@
+# Stands in for a subtree that can never produce output (a tagsub comment, or an HTML comment when comments are
+# suppressed). All that is left of it is telling the OutputFormatter that its line may be suppressed, just as the
+# subtree would have. See util/Optimizer.py
+class SuppressibleMarker:
+    def format(self, outputFormatter):
+        outputFormatter.markLineSuppressible()
+
+    # See Tag.runFormatSteps
+    formatSteps = format
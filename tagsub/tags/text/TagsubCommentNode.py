@@ -33,6 +33,11 @@ class TagsubCommentNode(TagContainer):
 		if char != ">":
 			raise TagsubTemplateSyntaxError("Invalid close tag", template=template)
 
+	# Like a suppressed CommentNode, normally replaced by a SuppressibleMarker once the template is parsed.
+	def formatSteps(self, outputFormatter):
+		# None of the children are ever formatted.
+		self.format(outputFormatter)
+
 	def format(self, outputFormatter):
 		# We always suppress tagsub comments. We do need to communicate with the outputFormatter that we are being
 		# suppressed so it can deal with blank line suppression.
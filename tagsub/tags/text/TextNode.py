@@ -22,6 +22,20 @@ class Line:
     def format(self, outputFormatter):
         outputFormatter.outputString(self)
 
+    # See Tag.runFormatSteps
+    formatSteps = format
+
+
+# The output of whole lines of text, worked out once when the template is compiled (see util/Optimizer.py), which
+# goes to the OutputFormatter in one piece. It may hold several lines.
+class StaticLines(Line):
+    def __init__(self, text):
+        super().__init__(text, True)
+        self._isspace = text.isspace()
+
+    def isspace(self):
+        return self._isspace
+
 
 class TextNode:
     def __init__(self):
@@ -1,10 +1,12 @@
 
 from .Operator import Operator
 class OrOperator(Operator):
-	def __init__(self, leftOperand, rightOperand):
-		super().__init__(leftOperand, rightOperand)
+	def __init__(self, *operands):
+		# Usually two operands. Chains of | (or ,) are flattened into one OrOperator by util/Optimizer.py
+		super().__init__(*operands)
 
 	def getValue(self, tagchar, outputFormatter):
-		leftOperand, rightOperand = self._operands
-		return (bool(leftOperand.getValue(tagchar, outputFormatter)) or
-			bool(rightOperand.getValue(tagchar, outputFormatter)))
+		for operand in self._operands:
+			if operand.getValue(tagchar, outputFormatter):
+				return True
+		return False
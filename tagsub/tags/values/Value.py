@@ -1,8 +1,33 @@
 
+from collections.abc import Mapping
+from functools import lru_cache
+from operator import attrgetter
+
 from ...exceptions import InvalidTagKeyName
 from ...exceptions import buildNonTagsubException
 from ..Tag import Tag
 
+
+@lru_cache(maxsize=None)
+def compileAttributeChain(attributeChain, doMappingAttributes=False):
+	# A single callable following a whole attribute chain (the a.b.c of name.a.b.c), built once at parse time rather
+	# than looping over getattr on every lookup. The AttributeError for a missing attribute names that attribute, just
+	# as getattr does. Cached, so every Value with the same chain shares one accessor, which the RenderCache keys its
+	# reads on. With doMappingAttributes, a Mapping anywhere along the chain is indexed by the name when it has that
+	# key, so JSON shaped data can be used as is.
+	if not doMappingAttributes:
+		return attrgetter(".".join(attributeChain))
+
+	def getAttributes(obj):
+		for attr in attributeChain:
+			if isinstance(obj, Mapping) and attr in obj:
+				obj = obj[attr]
+			else:
+				obj = getattr(obj, attr)
+		return obj
+	return getAttributes
+
+
 # This will be used by any Tag that needs a lookup value. An operator can also reference two of these. The actual value will be looked up at run time from the template ChainMap namespace. This is only used for looked up values, not for implied loop variables, which are attributes retrieved from an enclosing loop tag.
 class Value:
 	def __init__(self, template, name, tag=None, attributeChain=None, loopTag=None, impliedLoopVar=None):
@@ -13,17 +38,34 @@ class Value:
 		assert name or loopTag, "Must have at least one of name or loopTag"
 		self._name = name
 		self._attributeChain = attributeChain
+		# For an implied loop variable, the attribute chain names the loop tag instead.
+		self._getAttributes = compileAttributeChain(tuple(attributeChain), template.doMappingAttributes) \
+			if attributeChain and not impliedLoopVar else None
 		self._loopTag = loopTag
 		self._impliedLoopVar = impliedLoopVar
 		# loopTag implies we must have an impliedLoopVar. Otherwise, we *cannot* have an impliedLoopVar
 		assert impliedLoopVar if loopTag else not impliedLoopVar
+		# Position of the name in the template's Schema, when bound at compile time (see Template._bindSchemas).
+		self._slot = None
 
 	def getValue(self, tagchar, outputFormatter):
 		namespace = outputFormatter.rootMapping[tagchar]
 		if self._impliedLoopVar:
 			return self._loopTag.getImpliedLoopVar(self, outputFormatter)
+		elif self._slot is not None and namespace.slotValues is not None:
+			# Straight from the record passed for the schema. Never a save tag, since a write to a schema name drops
+			# the slotValues, and never recorded, since there is no RenderCache.
+			obj = namespace.slotValues[self._slot]
+			if self._getAttributes is not None and obj is not None:
+				obj = self.getAttributes(obj, outputFormatter)
+			returnVal = "" if obj is None else obj
+			if self._template.is0False and returnVal == "0":
+				return 0
+			return returnVal
 		else:
-			obj = namespace.get(self._name)
+			# When recording reads for a RenderCache, we want the value at the end of an attribute chain, not the
+			# object at the root of it.
+			obj = namespace.get(self._name, recordRead=self._getAttributes is None)
 			if isinstance(obj, Tag):
 				# Must be one of the save tags
 				assert not self._attributeChain
@@ -31,18 +73,15 @@ class Value:
 				#  for saveeval, or when referenced in the case of saveraw, which is what happens here). The formatting of
 				#  the children essentially needs its own OutputFormatter that we write to and get the result as the
 				#  string we use for substitution.
+				if outputFormatter.budgetUsage is not None:
+					outputFormatter.budgetUsage.countSaveRawExpansion(self.tag, outputFormatter)
 				outputFormatter.pushOutputBuffer()
 				obj.formatAtReference(outputFormatter)
 				return outputFormatter.popOutputBuffer()
-			if self._attributeChain and obj is not None:
-				# TODO Handle name errors here more elegantly. Probably trap the attribute exception and raise an
-				#  appropriate tagsub exception
-				for attr in self._attributeChain:
-					try:
-						obj = getattr(obj, attr)
-					except AttributeError as e:
-						raise buildNonTagsubException(AttributeError, str(e),
-													  tag=self.tag, template=None, outputFormatter=outputFormatter)
+			if self._getAttributes is not None and obj is not None:
+				obj = self.getAttributes(obj, outputFormatter)
+			if self._getAttributes is not None and namespace.readRecorder is not None:
+				namespace.recordRead(self._name, self._getAttributes, obj)
 
 			returnVal = "" if obj is None else obj
 			if self._template.is0False and returnVal == "0":
@@ -50,6 +89,13 @@ class Value:
 			else:
 				return returnVal
 
+	def getAttributes(self, obj, outputFormatter):
+		try:
+			return self._getAttributes(obj)
+		except AttributeError as e:
+			raise buildNonTagsubException(AttributeError, str(e),
+										  tag=self.tag, template=None, outputFormatter=outputFormatter)
+
 	@classmethod
 	def createValue(cls, token, template, tag=None):
 		if not token.tokenstr:
@@ -76,4 +122,8 @@ class Value:
 		else:
 			loopTag = None
 
-		return cls(template, name, tag, token.attributeChain, loopTag, token.impliedLoopVarName)
+		value = cls(template, name, tag, token.attributeChain, loopTag, token.impliedLoopVarName)
+		if name and not token.impliedLoopVarName:
+			# Let the enclosing scope know which names it references, so they can be batch resolved.
+			template._tagStack.scope.addScopeValue(value)
+		return value
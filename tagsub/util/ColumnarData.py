@@ -0,0 +1,61 @@
+from collections.abc import Mapping, Sequence
+
+
+# A view of one row of a ColumnarData. Reading a name reads that column at the current row, so nothing is copied.
+class RowView(Mapping):
+    __slots__ = ["_columns", "_index"]
+
+    def __init__(self, columns, index=0):
+        self._columns = columns
+        self._index = index
+
+    def __getitem__(self, key):
+        # A KeyError for an unknown column lets the NamespaceStack carry on to the enclosing mappings.
+        return self._columns[key][self._index]
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+
+# Loop data stored as columns (a Mapping of column name to a list, array, memoryview or anything else indexable with a
+# length) rather than as one Mapping per row. Looping over it yields the same RowView each time, just moved to the
+# next row, so a loop over a million rows does not build a million dicts. That means a row from the iteration is only
+# good until the next one. Indexing gives a RowView of its own.
+class ColumnarData(Sequence):
+    def __init__(self, columns):
+        self._columns = dict(columns)
+        lengths = {len(column) for column in self._columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All columns must be the same length")
+        self._length = lengths.pop() if lengths else 0
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarData({name: column[index] for name, column in self._columns.items()})
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ColumnarData index out of range")
+        return RowView(self._columns, index)
+
+    def __iter__(self):
+        return self.iterRows(0, self._length)
+
+    def iterRows(self, start, stop):
+        rowView = RowView(self._columns)
+        for index in range(start, min(stop, self._length)):
+            rowView._index = index
+            yield rowView
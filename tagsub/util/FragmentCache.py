@@ -0,0 +1,51 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+import time
+
+
+# Storage for the rendered bodies of <@cache> tags. Keys are tuples of strings, so a backend that needs to serialize
+# them (a local file or shared memory backend, for instance) can do so easily. Values are always strings.
+class FragmentCacheBackend(ABC):
+    @abstractmethod
+    def get(self, key):
+        # Return the cached string, or None if it is missing or expired.
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        # ttl is in seconds. None means the entry never expires (but may still be evicted).
+        raise NotImplementedError()
+
+
+# The default in-process backend. A bounded LRU with an expiry time per entry.
+class LRUFragmentCache(FragmentCacheBackend):
+    def __init__(self, maxEntries=256, clock=time.monotonic):
+        self._maxEntries = maxEntries
+        self._clock = clock
+        # key -> (expiry time or None, value)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = None if ttl is None else self._clock() + ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
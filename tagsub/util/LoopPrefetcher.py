@@ -0,0 +1,71 @@
+from queue import Queue, Empty
+from threading import Thread, Event
+
+
+# Marks the end of the items from the producer thread. Carries the exception, if the iterable raised one.
+class _ProducerFinished:
+    def __init__(self, exception=None):
+        self.exception = exception
+
+
+# Used by loop tags when the Template has a loopPrefetchDepth. A background thread pulls items from the iterable into
+# a bounded queue while the render thread formats the earlier items, so a slow iterable (a DB cursor, a paged API
+# client) is fetched while we render rather than in between. The iterable is only ever advanced on the producer
+# thread, so it must not care which thread it is used from.
+class LoopPrefetcher:
+    def __init__(self, iterable, depth):
+        self._iterable = iterable
+        self._items = Queue(maxsize=depth)
+        self._stop = Event()
+        self._finished = False
+        self._thread = Thread(target=self._produce, name="tagsub-loop-prefetch", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration()
+        item = self._items.get()
+        if isinstance(item, _ProducerFinished):
+            self._finished = True
+            if item.exception is not None:
+                # The exception keeps the traceback from the producer thread, so it reads the same as if the
+                # iterable had raised it in the loop tag directly.
+                raise item.exception
+            raise StopIteration()
+        return item
+
+    def close(self):
+        # Stop the producer early (the loop body raised, say). Draining the queue releases a producer blocked on a
+        # full queue, and it then sees the stop flag before fetching anything else. We do not wait for it, since it
+        # may be blocked on the iterable itself.
+        self._finished = True
+        self._stop.set()
+        try:
+            while True:
+                self._items.get_nowait()
+        except Empty:
+            pass
+
+    def _produce(self):
+        try:
+            for item in self._iterable:
+                if self._stop.is_set():
+                    return
+                self._items.put(item)
+        except BaseException as e:
+            self._put(_ProducerFinished(e))
+        else:
+            self._put(_ProducerFinished())
+
+    def _put(self, item):
+        if not self._stop.is_set():
+            self._items.put(item)
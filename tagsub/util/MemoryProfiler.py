@@ -0,0 +1,139 @@
+import inspect
+import tracemalloc
+from contextlib import contextmanager
+
+from .Profiler import iterTags
+from ..tags.LoopTag import LoopTag
+
+
+class MemoryReport:
+    def __init__(self, peakBytes, finalBytes, snapshot, categoryRanges, topSiteCount, outputCharCount):
+        self.peakBytes = peakBytes
+        # Still allocated when the render finished, which includes the output string itself.
+        self.finalBytes = finalBytes
+        self.outputCharCount = outputCharCount
+        statistics = snapshot.statistics("lineno")
+        self.allocatedBlocks = sum(stat.count for stat in statistics)
+        self.topSites = [(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size, stat.count)
+                         for stat in statistics[:topSiteCount]]
+        self.categories = {category: [0, 0] for category in categoryRanges}
+        self.categories["other"] = [0, 0]
+        for stat in statistics:
+            frame = stat.traceback[0]
+            for category, ranges in categoryRanges.items():
+                if any(frame.filename == filename and frame.lineno in lines for filename, lines in ranges):
+                    break
+            else:
+                category = "other"
+            self.categories[category][0] += stat.size
+            self.categories[category][1] += stat.count
+
+    def asDict(self):
+        return {
+            "peakBytes": self.peakBytes,
+            "finalBytes": self.finalBytes,
+            "allocatedBlocks": self.allocatedBlocks,
+            "outputCharCount": self.outputCharCount,
+            "topSites": [{"site": site, "bytes": size, "blocks": count} for site, size, count in self.topSites],
+            "categories": {category: {"bytes": size, "blocks": count}
+                           for category, (size, count) in self.categories.items()},
+        }
+
+    def __str__(self):
+        lines = [
+            f"peak: {self.peakBytes} bytes, final: {self.finalBytes} bytes, "
+            f"blocks: {self.allocatedBlocks}, output chars: {self.outputCharCount}",
+            "by category:",
+        ]
+        for category, (size, count) in sorted(self.categories.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {category:16} {size:12} bytes {count:8} blocks")
+        lines.append("top allocation sites:")
+        for site, size, count in self.topSites:
+            lines.append(f"  {site}: {size} bytes {count} blocks")
+        return "\n".join(lines) + "\n"
+
+
+# tracemalloc backed memory report for one Template.format call:
+#
+#   memoryProfiler = MemoryProfiler()
+#   template.format(pageDict, memoryProfiler=memoryProfiler)
+#   print(memoryProfiler.lastReport)
+#
+# tracemalloc only knows about blocks that are still allocated, so the breakdown is taken from a snapshot near the
+# high water mark of the render. Snapshots are taken at loop iterations (where memory grows on big reports) whenever
+# traced memory has grown by growthFactor since the last one, and once more at the end of the render.
+class MemoryProfiler:
+    def __init__(self, topSites=10, growthFactor=1.25):
+        self._topSiteCount = topSites
+        self._growthFactor = growthFactor
+        self.reports = []
+        self._snapshot = None
+        self._snapshotBytes = 0
+
+    @property
+    def lastReport(self):
+        return self.reports[-1] if self.reports else None
+
+    @staticmethod
+    def _categoryRanges():
+        # Imported here, since the Template module imports this one.
+        from ..Template import OutputBuffer, OutputFormatter
+        from ..tags.LoopTag import LoopTag
+        from ..tags.SimpleTag import SimpleTag
+
+        def codeRange(func):
+            lines, start = inspect.getsourcelines(func)
+            return inspect.getsourcefile(func), range(start, start + len(lines))
+        return {
+            "outputBuffers": [codeRange(OutputBuffer.__init__), codeRange(OutputFormatter.pushOutputBuffer),
+                              codeRange(OutputFormatter.popOutputBuffer),
+                              codeRange(OutputFormatter.suppressOrOutputLine), codeRange(OutputFormatter.getOutput)],
+            "lineTextNodes": [codeRange(OutputFormatter.outputString)],
+            "loopVars": [codeRange(LoopTag.setLoopVars)],
+            "escapedStrings": [codeRange(SimpleTag.escapeStringForHtml)],
+        }
+
+    def _takeSnapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        self._snapshot = snapshot
+        self._snapshotBytes = tracemalloc.get_traced_memory()[0]
+
+    def _maybeTakeSnapshot(self):
+        if tracemalloc.get_traced_memory()[0] > self._snapshotBytes * self._growthFactor:
+            self._takeSnapshot()
+
+    @contextmanager
+    def tracing(self, template):
+        wasTracing = tracemalloc.is_tracing()
+        if not wasTracing:
+            tracemalloc.start()
+        # Only measure this render, not whatever else the process allocated before it.
+        tracemalloc.clear_traces()
+        self._snapshot = None
+        self._snapshotBytes = 0
+        loopTags = [tag for tag in iterTags(template.rootTag) if isinstance(tag, LoopTag)]
+        for loopTag in loopTags:
+            loopTag.setLoopVars = self._wrapSetLoopVars(loopTag.setLoopVars)
+        try:
+            yield self
+        finally:
+            for loopTag in loopTags:
+                loopTag.__dict__.pop("setLoopVars", None)
+            if not wasTracing:
+                tracemalloc.stop()
+
+    def finishRender(self, outputFormatter):
+        # Called by Template.format while tracemalloc is still tracing.
+        currentBytes, peakBytes = tracemalloc.get_traced_memory()
+        self._maybeTakeSnapshot()
+        self.reports.append(MemoryReport(peakBytes, currentBytes, self._snapshot, self._categoryRanges(),
+                                         self._topSiteCount, outputFormatter.outputCharCount))
+
+    def _wrapSetLoopVars(self, setLoopVars):
+        def snapshottingSetLoopVars(*args, **kwargs):
+            self._maybeTakeSnapshot()
+            setLoopVars(*args, **kwargs)
+        return snapshottingSetLoopVars
@@ -0,0 +1,345 @@
+from collections import Counter
+
+from ..tags.Tag import Tag
+from ..tags.NullTag import NullTag
+from ..tags.RootTag import RootTag
+from ..tags.SimpleTag import SimpleTag
+from ..tags.LoopTag import LoopTag
+from ..tags.ElseTag import ElseTag
+from ..tags.FlatLoop import FlatLoop
+from ..tags.text.TextNode import Line, StaticLines
+from ..tags.text.CommentNode import CommentNode
+from ..tags.text.SuppressibleMarker import SuppressibleMarker
+from ..tags.values.Value import Value
+from ..tags.values.ConstantValue import ConstantValue
+from ..tags.values.AndOperator import AndOperator
+from ..tags.values.OrOperator import OrOperator
+from ..tags.values.NotOperator import NotOperator
+
+
+def iterChildLists(node):
+    # The attribute names of the child lists of node. A TagAlternateChoice (if, case) keeps its alternates separately
+    # from its (always empty) children.
+    for attribute in ("_children", "_alternateChoices"):
+        if getattr(node, attribute, None):
+            yield attribute
+
+
+# Walks a parsed template tree (Template.rootTag), for passes over the tree after parsing. Each child list is visited
+# in turn, parents before their children. For every node in the list, the most specific visit<ClassName> method
+# defined for its class (or any base class) is called with the node, and returns what takes its place: the node
+# itself, another node, a list of nodes, or None to drop it. visitChildList is then given the new list as a whole.
+# The tree is walked from a stack rather than by recursion, since templates may be nested arbitrarily deep.
+class TreeVisitor:
+    def walk(self, rootNode):
+        containers = [rootNode]
+        while containers:
+            container = containers.pop()
+            childContainers = []
+            for attribute in iterChildLists(container):
+                children = getattr(container, attribute)
+                newChildren = []
+                for child in children:
+                    replacement = self.visit(child)
+                    if isinstance(replacement, list):
+                        newChildren.extend(replacement)
+                    elif replacement is not None:
+                        newChildren.append(replacement)
+                newChildren = self.visitChildList(container, newChildren)
+                # Keep the type of the list (a deque for most tags).
+                setattr(container, attribute, type(children)(newChildren))
+                childContainers.extend(child for child in newChildren if any(iterChildLists(child)))
+            containers.extend(reversed(childContainers))
+
+    def visit(self, node):
+        for cls in type(node).__mro__:
+            method = getattr(self, f"visit{cls.__name__}", None)
+            if method is not None:
+                return method(node)
+        return node
+
+    def visitChildList(self, container, children):
+        return children
+
+
+# One optimization pass. Passes with a level above the Optimizer's level are skipped. stats counts what the pass
+# changed, for its last run.
+class OptimizationPass(TreeVisitor):
+    name = None
+    level = 1
+
+    def __init__(self):
+        self.stats = Counter()
+        self.template = None
+
+    def run(self, template):
+        self.stats = Counter()
+        self.template = template
+        self.walk(template.rootTag)
+        return self.stats
+
+
+# Nodes that format the same way whatever the Mappings hold.
+staticNodeTypes = (Line, SuppressibleMarker)
+
+
+def isStaticTree(rootNode):
+    # True if nothing in the tree looks anything up. HTML comments holding only text count as static, as do <@> tags.
+    return all(isinstance(node, staticNodeTypes) or type(node) in (RootTag, CommentNode, NullTag)
+               for node, _ in iterNodes(rootNode))
+
+
+def formatStaticNodes(nodes):
+    # The output of static nodes, formatted from the start of a line.
+    from ..Template import OutputFormatter
+    outputFormatter = OutputFormatter("", {})
+    for node in nodes:
+        node.format(outputFormatter)
+    return outputFormatter.getOutput()
+
+
+def dropRedundantMarkers(children, stats):
+    # A marker only marks its line as suppressible, and so does a SimpleTag, so a marker next to another marker or a
+    # SimpleTag is not needed.
+    keptChildren = []
+    for index, child in enumerate(children):
+        if isinstance(child, SuppressibleMarker):
+            nextChild = children[index + 1] if index + 1 < len(children) else None
+            previousChild = keptChildren[-1] if keptChildren else None
+            if isinstance(nextChild, SuppressibleMarker) or type(nextChild) is SimpleTag or \
+                    isinstance(previousChild, SuppressibleMarker) or type(previousChild) is SimpleTag:
+                stats["markersRemoved"] += 1
+                continue
+        keptChildren.append(child)
+    return keptChildren
+
+
+class StripCommentsPass(OptimizationPass):
+    # Tagsub comments, and HTML comments with doSuppressComments, never output anything, whatever tags they hold.
+    # Each is replaced by a SuppressibleMarker. Not one of the Optimizer's passes: every Template runs this once it
+    # is parsed, if it has any such comments.
+    name = "stripComments"
+    level = 0
+
+    def visitCommentNode(self, node):
+        if not self.template.doSuppressComments:
+            return node
+        self.stats["commentsStripped"] += 1
+        return SuppressibleMarker()
+
+    def visitTagsubCommentNode(self, node):
+        self.stats["tagsubCommentsStripped"] += 1
+        return SuppressibleMarker()
+
+    def visitChildList(self, container, children):
+        return dropRedundantMarkers(children, self.stats)
+
+
+class RemoveDeadNodesPass(OptimizationPass):
+    # <@> tags output nothing. Removing them can leave markers next to each other.
+    name = "removeDeadNodes"
+
+    def visitNullTag(self, node):
+        self.stats["nullTagsRemoved"] += 1
+        return None
+
+    def visitChildList(self, container, children):
+        return dropRedundantMarkers(children, self.stats)
+
+
+class MergeTextPass(OptimizationPass):
+    # Joins neighbouring Lines (left next to each other once tags between them are gone), so they go to the
+    # OutputFormatter in one piece. Only where it cannot change blank line suppression: onto the end of an incomplete
+    # line, or a complete line onto a complete line with some non-whitespace.
+    name = "mergeText"
+
+    def visitChildList(self, container, children):
+        mergedChildren = []
+        for child in children:
+            previousChild = mergedChildren[-1] if mergedChildren else None
+            if isinstance(child, Line) and isinstance(previousChild, Line) and (
+                    not previousChild.isCompleteLine or (child.isCompleteLine and not previousChild.isspace())):
+                mergedChildren[-1] = Line(str(previousChild) + str(child), child.isCompleteLine)
+                self.stats["linesMerged"] += 1
+            else:
+                mergedChildren.append(child)
+        return mergedChildren
+
+
+class PrecomputeStaticPass(OptimizationPass):
+    # Once the first line of a run of static nodes is complete, the lines up to its last line end format the same way
+    # on every render, since each line starts afresh for blank line suppression. Those are formatted once, here, into
+    # a single StaticLines. The first and last lines are left alone, as they share their lines with whatever comes
+    # before and after. HTML comments holding only text are opened up into the run first.
+    name = "precomputeStatic"
+
+    def visitCommentNode(self, node):
+        if self.template.doSuppressComments or not all(isinstance(child, staticNodeTypes) for child in node._children):
+            return node
+        # Like any TagContainer, the comment marks its line suppressible before and after its children.
+        self.stats["commentsOpened"] += 1
+        return [SuppressibleMarker(), *node._children, SuppressibleMarker()]
+
+    def visitChildList(self, container, children):
+        newChildren = []
+        run = []
+        for child in children:
+            if isinstance(child, staticNodeTypes):
+                run.append(child)
+            else:
+                newChildren.extend(self.precomputeRun(run))
+                newChildren.append(child)
+                run = []
+        newChildren.extend(self.precomputeRun(run))
+        return newChildren
+
+    def precomputeRun(self, run):
+        lineEnds = [index for index, node in enumerate(run) if isinstance(node, Line) and node.isCompleteLine]
+        if len(lineEnds) < 2:
+            return run
+        middle = run[lineEnds[0] + 1:lineEnds[-1] + 1]
+        if len(middle) == 1:
+            return run
+        output = formatStaticNodes(middle)
+        self.stats["nodesPrecomputed"] += len(middle)
+        # Lines that are all suppressed leave nothing behind.
+        return run[:lineEnds[0] + 1] + ([StaticLines(output)] if output else []) + run[lineEnds[-1] + 1:]
+
+
+class SimplifyExpressionsPass(OptimizationPass):
+    # if and elif expressions are only ever tested for truth, so !!name is the same as name. Chains of & or | become
+    # a single operator, rather than one nested operator per pair.
+    name = "simplifyExpressions"
+    level = 2
+
+    def visitIfTag(self, tag):
+        tag._expression = self.simplify(tag._expression)
+        return tag
+
+    def simplify(self, expression):
+        if isinstance(expression, NotOperator):
+            (operand, ) = expression._operands
+            operand = self.simplify(operand)
+            if isinstance(operand, NotOperator):
+                self.stats["doubleNegationsRemoved"] += 1
+                return operand._operands[0]
+            return NotOperator(operand)
+        if isinstance(expression, (AndOperator, OrOperator)):
+            operands = []
+            for operand in expression._operands:
+                operand = self.simplify(operand)
+                if type(operand) is type(expression):
+                    self.stats["operatorsFlattened"] += 1
+                    operands.extend(operand._operands)
+                else:
+                    operands.append(operand)
+            return type(expression)(*operands)
+        return expression
+
+
+class CaseDispatchPass(OptimizationPass):
+    # A case tag whose options are all constants picks its option with one dict lookup, rather than comparing against
+    # each option in turn.
+    name = "caseDispatch"
+    level = 2
+
+    def visitCaseTag(self, tag):
+        dispatch = {}
+        default = None
+        for choice in tag._alternateChoices:
+            if isinstance(choice, ElseTag):
+                default = choice
+            elif all(type(value) is ConstantValue for value in choice._optionMatchValues):
+                for value in choice._optionMatchValues:
+                    # The first option with a given value wins, as it does when they are compared in turn.
+                    dispatch.setdefault(str(value.getValue(tag.tagchar, None)), choice)
+            else:
+                return tag
+        tag._optionDispatch = dispatch
+        tag._dispatchDefault = default
+        self.stats["casesDispatched"] += 1
+        return tag
+
+
+defaultPasses = (RemoveDeadNodesPass, SimplifyExpressionsPass, CaseDispatchPass, PrecomputeStaticPass, MergeTextPass)
+
+
+# Runs the optimization passes over a Template once it is parsed. Template(..., optimize=n) is the same as
+# optimize=Optimizer(n). 0 runs nothing, 1 the passes that only remove or merge nodes, 2 everything. Comments are
+# stripped at every level (see StripCommentsPass).
+#
+#   template = Template('@', templateStr, optimize=Optimizer(2, debugStream=sys.stderr))
+#   print(template.optimizationStats)
+#
+# With a debugStream, the tree is dumped to it before and after each pass. Passes can be given as classes or
+# instances, for custom passes or to test a pass on its own.
+class Optimizer:
+    def __init__(self, level=1, passes=defaultPasses, debugStream=None):
+        self.level = level
+        self.passes = [optimizationPass() if isinstance(optimizationPass, type) else optimizationPass
+                       for optimizationPass in passes]
+        self.debugStream = debugStream
+
+    def optimize(self, template):
+        # Returns the stats of each pass that ran, by pass name.
+        stats = {}
+        for optimizationPass in self.passes:
+            if optimizationPass.level > self.level:
+                continue
+            if self.debugStream is not None:
+                self.debugStream.write(f"before {optimizationPass.name}:\n{dumpTree(template.rootTag)}")
+            stats[optimizationPass.name] = dict(optimizationPass.run(template))
+            if self.debugStream is not None:
+                self.debugStream.write(f"after {optimizationPass.name}:\n{dumpTree(template.rootTag)}")
+        return stats
+
+
+def updateFlatLoops(rootNode):
+    # Loop bodies may have changed since the loops decided whether they can be rendered in batches.
+    for tag, _ in iterNodes(rootNode):
+        if isinstance(tag, LoopTag):
+            tag._flatLoop = FlatLoop.forLoopTag(tag)
+
+
+def iterNodes(node, depth=0):
+    # Every node in the tree, depth first, with its depth.
+    nodes = [(node, depth)]
+    while nodes:
+        node, depth = nodes.pop()
+        yield node, depth
+        for attribute in reversed(list(iterChildLists(node))):
+            nodes.extend((child, depth + 1) for child in reversed(getattr(node, attribute)))
+
+
+def describeExpression(expression):
+    if isinstance(expression, Value):
+        name = expression._name or ""
+        if expression._attributeChain:
+            name += "".join(f".{attr}" for attr in expression._attributeChain)
+        if expression._impliedLoopVar:
+            name += f":{expression._impliedLoopVar}"
+        return name
+    if isinstance(expression, ConstantValue):
+        return repr(expression._value)
+    if isinstance(expression, NotOperator):
+        return f"!{describeExpression(expression._operands[0])}"
+    separator = " & " if isinstance(expression, AndOperator) else " | "
+    return f"({separator.join(describeExpression(operand) for operand in expression._operands)})"
+
+
+def describeNode(node):
+    if isinstance(node, Line):
+        return f"{type(node).__name__} {str(node)!r}" + ("" if node.isCompleteLine else " (incomplete)")
+    description = type(node).__name__
+    if isinstance(node, Tag):
+        description += f" {node.charpos + 1}({node.linenum + 1},{node.linepos + 1})"
+    if getattr(node, "_expression", None) is not None:
+        description += f" {describeExpression(node._expression)}"
+    if getattr(node, "_optionDispatch", None) is not None:
+        description += f" dispatch={sorted(node._optionDispatch)}"
+    return description
+
+
+def dumpTree(node):
+    # One node per line, indented by depth.
+    return "".join(f"{'  ' * depth}{describeNode(node)}\n" for node, depth in iterNodes(node))
@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+
+from .Profiler import Profiler, iterTags, instrumentFormat, uninstrumentFormat, tagName
+from ..tags.LoopTag import LoopTag
+
+
+class RegionStats:
+    __slots__ = ["tag", "selfBytes", "cumulativeBytes", "spans", "iterationBytes"]
+
+    def __init__(self, tag):
+        self.tag = tag
+        # Output bytes produced while this was the innermost tag being formatted. Text in the body of a container tag
+        # counts towards the container.
+        self.selfBytes = 0
+        # Output bytes produced by this tag and everything formatted inside it.
+        self.cumulativeBytes = 0
+        # Number of output spans this was the innermost tag for.
+        self.spans = 0
+        # Only used for loop tags. index0 -> cumulative output bytes of that iteration, summed over all renders.
+        self.iterationBytes = {}
+
+    @property
+    def tagName(self):
+        return tagName(self.tag)
+
+    @property
+    def position(self):
+        return f"{self.tag.charpos + 1}({self.tag.linenum + 1},{self.tag.linepos + 1})"
+
+    def asDict(self):
+        return {
+            "tag": self.tagName,
+            "charpos": self.tag.charpos + 1,
+            "linenum": self.tag.linenum + 1,
+            "linepos": self.tag.linepos + 1,
+            "selfBytes": self.selfBytes,
+            "cumulativeBytes": self.cumulativeBytes,
+            "spans": self.spans,
+            "iterationBytes": dict(self.iterationBytes),
+        }
+
+
+class OutputSpan:
+    __slots__ = ["start", "length", "tag", "iterationIndex"]
+
+    def __init__(self, start, length, tag, iterationIndex):
+        # Byte offset into the encoded output.
+        self.start = start
+        self.length = length
+        # The innermost tag being formatted when this output was produced.
+        self.tag = tag
+        # index0 of the innermost enclosing loop iteration, or None outside of any loop.
+        self.iterationIndex = iterationIndex
+
+    def __repr__(self):
+        return f"OutputSpan({self.start}, {self.length}, {tagName(self.tag)}, {self.iterationIndex})"
+
+
+# The state for one render. Pieces of output are held until we know whether their line is suppressed, since only what
+# actually reaches the output is attributed.
+class _RenderAttribution:
+    def __init__(self, attribution, outputFormatter):
+        self.attribution = attribution
+        self._outputFormatter = outputFormatter
+        # (tag, RegionStats, isLoop) for every tag being formatted, outermost first.
+        self.stack = []
+        # (attribution chain, text) for the pieces of the current line of the final output.
+        self._pendingPieces = []
+        self._offset = 0
+        self.spans = []
+
+        outputString = outputFormatter.outputString
+        suppressOrOutputLine = outputFormatter.suppressOrOutputLine
+        getOutput = outputFormatter.getOutput
+        outputBufferStack = outputFormatter.outputBufferStack
+
+        def attributingOutputString(textString):
+            # Output into a pushed buffer (a saveeval body, a recursively substituted value) only reaches the page as
+            # the value of some other tag, which is where it is counted.
+            if len(outputBufferStack) == 1 and self.stack:
+                self._pendingPieces.append((self._chain(), str(textString)))
+            outputString(textString)
+
+        def attributingSuppressOrOutputLine():
+            if len(outputBufferStack) == 1:
+                top = outputBufferStack.top
+                if top.maybeSuppressLine and top.suppressibleTagFound:
+                    self._pendingPieces.clear()
+                else:
+                    self._commitPieces()
+            suppressOrOutputLine()
+
+        def attributingGetOutput():
+            self._commitPieces()
+            return getOutput()
+
+        outputFormatter.outputString = attributingOutputString
+        outputFormatter.suppressOrOutputLine = attributingSuppressOrOutputLine
+        outputFormatter.getOutput = attributingGetOutput
+        outputFormatter.attribution = self
+
+    def _chain(self):
+        loopTagData = self._outputFormatter.loopTagData
+        chain = []
+        for tag, region, isLoop in self.stack:
+            index = loopTagData[tag]["index0"] if isLoop and tag in loopTagData else None
+            chain.append((region, index))
+        return chain
+
+    def _commitPieces(self):
+        encoding = self.attribution.encoding
+        for chain, text in self._pendingPieces:
+            size = len(text.encode(encoding))
+            if not size:
+                continue
+            region, _ = chain[-1]
+            region.selfBytes += size
+            iterationIndex = None
+            # Recursive tags (a saveraw referencing itself) only count once towards their cumulative bytes.
+            for enclosingRegion in {enclosingRegion for enclosingRegion, _ in chain}:
+                enclosingRegion.cumulativeBytes += size
+            for enclosingRegion, index in chain:
+                if index is not None:
+                    enclosingRegion.iterationBytes[index] = enclosingRegion.iterationBytes.get(index, 0) + size
+                    iterationIndex = index
+            lastSpan = self.spans[-1] if self.spans else None
+            if lastSpan is not None and lastSpan.tag is region.tag and lastSpan.iterationIndex == iterationIndex:
+                lastSpan.length += size
+            else:
+                region.spans += 1
+                self.spans.append(OutputSpan(self._offset, size, region.tag, iterationIndex))
+            self._offset += size
+        self._pendingPieces.clear()
+
+
+# Attributes the bytes of the final output to the template tags that produced them, to find which loops and fragments
+# make a page large. Like the Profiler, this wraps the format methods of the template's tags with instance attributes
+# for the length of a render only, so a template that is not being attributed pays nothing.
+#
+#   attribution = OutputAttribution()
+#   template.format(pageDict, attribution=attribution)
+#   print(attribution.report())
+#
+# Only output that survives blank line suppression is counted. Bytes are counted in the given encoding. The spans of
+# the last render, in output order, are kept in lastSpans.
+class OutputAttribution:
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
+        self._regions = {}
+        self.lastSpans = []
+
+    @contextmanager
+    def attributing(self, template):
+        # Shares the Profiler's slot, since both replace the same format methods.
+        with Profiler._installLock:
+            if template._profiler is not None:
+                raise RuntimeError("Template is already being profiled")
+            template._profiler = self
+        for tag in iterTags(template.rootTag):
+            region = self._regions.get(tag)
+            if region is None:
+                region = self._regions[tag] = RegionStats(tag)
+            instrumentFormat(tag, self._wrapFormat(region, tag.format, isinstance(tag, LoopTag)))
+        try:
+            yield self
+        finally:
+            for tag in iterTags(template.rootTag):
+                uninstrumentFormat(tag)
+            template._profiler = None
+
+    def _wrapFormat(self, region, format, isLoop):
+        def attributedFormat(outputFormatter):
+            renderAttribution = outputFormatter.attribution
+            if renderAttribution is None or renderAttribution.attribution is not self:
+                renderAttribution = _RenderAttribution(self, outputFormatter)
+                self.lastSpans = renderAttribution.spans
+            stack = renderAttribution.stack
+            stack.append((region.tag, region, isLoop))
+            try:
+                format(outputFormatter)
+            finally:
+                stack.pop()
+        return attributedFormat
+
+    def stats(self, sortKey="cumulativeBytes"):
+        return sorted(self._regions.values(), key=lambda region: getattr(region, sortKey), reverse=True)
+
+    def dump(self, sortKey="cumulativeBytes"):
+        # Machine readable. A list of dicts that json.dump will accept as is.
+        return [region.asDict() for region in self.stats(sortKey)]
+
+    def report(self, sortKey="cumulativeBytes", limit=None):
+        lines = ["%-16s %-10s %12s %12s %8s %10s %12s" % (
+            "position", "tag", "cumbytes", "selfbytes", "spans", "iterations", "max iter")]
+        for region in self.stats(sortKey)[:limit]:
+            iterations = maxIteration = ""
+            if region.iterationBytes:
+                iterations = len(region.iterationBytes)
+                size, index = max((size, index) for index, size in region.iterationBytes.items())
+                maxIteration = "%d:%d" % (index, size)
+            lines.append("%-16s %-10s %12d %12d %8d %10s %12s" % (
+                region.position, region.tagName, region.cumulativeBytes, region.selfBytes, region.spans, iterations,
+                maxIteration))
+        return "\n".join(lines) + "\n"
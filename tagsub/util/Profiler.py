@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter
+
+from ..tags.Tag import Tag
+from ..tags.LoopTag import LoopTag
+from ..tags.RootTag import RootTag
+
+
+def iterTags(node):
+    # Every Tag in a parsed template tree, depth first. Text Lines are skipped. Walked with a stack rather than by
+    # recursion, since templates may be nested deeper than the Python recursion limit.
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, Tag):
+            yield node
+        nodes.extend(reversed(getattr(node, "_children", ())))
+        nodes.extend(reversed(getattr(node, "_alternateChoices", ())))
+
+
+# Names for reports of the nodes that have no keyword of their own: HTML comments and <@ > tags.
+untaggedNodeNames = {"CommentNode": "comment", "NullTag": "null"}
+
+
+def tagName(tag):
+    if isinstance(tag, RootTag):
+        return "root"
+    return getattr(tag, "tag", None) or untaggedNodeNames.get(type(tag).__name__, type(tag).__name__)
+
+
+def instrumentFormat(tag, wrappedFormat):
+    # Shadow the format method of tag with an instance attribute. The formatSteps hook (see Tag.runFormatSteps) is
+    # shadowed too, so while a template is instrumented its tags format through nested format calls again, and each
+    # wrapper sees the whole of the formatting of its tag.
+    tag.format = wrappedFormat
+    tag.formatSteps = wrappedFormat
+
+
+def uninstrumentFormat(tag):
+    tag.__dict__.pop("format", None)
+    tag.__dict__.pop("formatSteps", None)
+
+
+class TagProfile:
+    __slots__ = ["tag", "calls", "cumulativeTime", "selfTime", "charsEmitted", "iterations", "_activeCalls"]
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.calls = 0
+        self.cumulativeTime = 0.0
+        self.selfTime = 0.0
+        # Characters passed to the OutputFormatter while this was the innermost tag being formatted. Text in the
+        # body of a container tag counts towards the container. This is before any blank line suppression.
+        self.charsEmitted = 0
+        # Only meaningful for loop tags. Total iterations over all calls.
+        self.iterations = 0
+        self._activeCalls = 0
+
+    @property
+    def tagName(self):
+        return tagName(self.tag)
+
+    @property
+    def position(self):
+        return f"{self.tag.charpos + 1}({self.tag.linenum + 1},{self.tag.linepos + 1})"
+
+    def asDict(self):
+        return {
+            "tag": self.tagName,
+            "charpos": self.tag.charpos + 1,
+            "linenum": self.tag.linenum + 1,
+            "linepos": self.tag.linepos + 1,
+            "calls": self.calls,
+            "cumulativeTime": self.cumulativeTime,
+            "selfTime": self.selfTime,
+            "charsEmitted": self.charsEmitted,
+            "iterations": self.iterations,
+        }
+
+
+# Per tag profiling of Template.format. While a template is being profiled, the format method of each of its tags is
+# wrapped by an instance attribute, which shadows the class method. When profiling stops, the instance attributes
+# are removed again, so a template that is not being profiled pays nothing at all.
+#
+#   profiler = Profiler()
+#   template.format(pageDict, profiler=profiler)    # or: with profiler.profiling(template): ...
+#   print(profiler.report())
+class Profiler:
+    _installLock = Lock()
+
+    def __init__(self, clock=perf_counter):
+        self._clock = clock
+        self._profiles = {}
+        # Each thread formatting a profiled template keeps its own stack of [profile, startTime, childTime] entries.
+        self._local = local()
+
+    @contextmanager
+    def profiling(self, template):
+        self._install(template)
+        try:
+            yield self
+        finally:
+            self._uninstall(template)
+
+    def _install(self, template):
+        with self._installLock:
+            if template._profiler is not None:
+                raise RuntimeError("Template is already being profiled")
+            template._profiler = self
+        for tag in iterTags(template.rootTag):
+            profile = self._profiles.get(tag)
+            if profile is None:
+                profile = self._profiles[tag] = TagProfile(tag)
+            instrumentFormat(tag, self._wrapFormat(profile, tag.format))
+            if isinstance(tag, LoopTag):
+                tag.setLoopVars = self._wrapSetLoopVars(profile, tag.setLoopVars)
+
+    def _uninstall(self, template):
+        for tag in iterTags(template.rootTag):
+            uninstrumentFormat(tag)
+            tag.__dict__.pop("setLoopVars", None)
+        template._profiler = None
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _attachOutputFormatter(self, outputFormatter):
+        # Count the characters emitted against whichever tag is innermost at the time.
+        outputString = outputFormatter.outputString
+        stack = self._stack()
+
+        def countingOutputString(textString):
+            if stack:
+                stack[-1][0].charsEmitted += len(str(textString))
+            outputString(textString)
+        outputFormatter.outputString = countingOutputString
+        outputFormatter.profiler = self
+
+    def _wrapFormat(self, profile, format):
+        def profiledFormat(outputFormatter):
+            if outputFormatter.profiler is not self:
+                self._attachOutputFormatter(outputFormatter)
+            stack = self._stack()
+            entry = [profile, self._clock(), 0.0]
+            stack.append(entry)
+            profile.calls += 1
+            profile._activeCalls += 1
+            try:
+                format(outputFormatter)
+            finally:
+                stack.pop()
+                profile._activeCalls -= 1
+                elapsed = self._clock() - entry[1]
+                profile.selfTime += elapsed - entry[2]
+                # Do not count recursive calls (a saveraw referencing itself, say) twice.
+                if not profile._activeCalls:
+                    profile.cumulativeTime += elapsed
+                if stack:
+                    stack[-1][2] += elapsed
+        return profiledFormat
+
+    @staticmethod
+    def _wrapSetLoopVars(profile, setLoopVars):
+        def countingSetLoopVars(*args, **kwargs):
+            profile.iterations += 1
+            setLoopVars(*args, **kwargs)
+        return countingSetLoopVars
+
+    def stats(self, sortKey="selfTime"):
+        return sorted(self._profiles.values(), key=lambda profile: getattr(profile, sortKey), reverse=True)
+
+    def dump(self, sortKey="selfTime"):
+        # Machine readable. A list of dicts that json.dump will accept as is.
+        return [profile.asDict() for profile in self.stats(sortKey)]
+
+    def report(self, sortKey="selfTime", limit=None):
+        lines = ["%-16s %-10s %8s %12s %12s %10s %10s" % (
+            "position", "tag", "calls", "cumtime", "selftime", "chars", "iterations")]
+        for profile in self.stats(sortKey)[:limit]:
+            lines.append("%-16s %-10s %8d %12.6f %12.6f %10d %10s" % (
+                profile.position, profile.tagName, profile.calls, profile.cumulativeTime, profile.selfTime,
+                profile.charsEmitted, profile.iterations if isinstance(profile.tag, LoopTag) else ""))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,84 @@
+from time import perf_counter
+
+from ..exceptions import RenderBudgetExceededError
+
+
+# Per-render limits, so a bad data set (a ten million item loop list, a saveraw that expands itself over and over)
+# fails the render rather than taking minutes and gigabytes. Any limit left as None is not checked.
+#
+#   template = Template('@', templateStr, renderBudget=RenderBudget(maxOutputChars=10_000_000, maxSeconds=2))
+#
+# maxOutputChars counts every character passed to the OutputFormatter, including those formatted into saveeval
+# bodies and recursively substituted values, before any blank line suppression. maxLoopIterations is the total over
+# all the loops in the render, and maxSaveRawExpansions the total number of times saveraw and saveoverride values are
+# formatted where they are referenced.
+#
+# The limits are checked as each loop iteration starts, after each simple and include tag, and as each saved value is
+# expanded, so a render stops soon after it goes over, with a RenderBudgetExceededError carrying the usual traceback.
+class RenderBudget:
+    def __init__(self, maxOutputChars=None, maxLoopIterations=None, maxSaveRawExpansions=None, maxSeconds=None,
+                 clock=perf_counter):
+        self.maxOutputChars = maxOutputChars
+        self.maxLoopIterations = maxLoopIterations
+        self.maxSaveRawExpansions = maxSaveRawExpansions
+        self.maxSeconds = maxSeconds
+        self._clock = clock
+
+    def start(self, outputFormatter):
+        return RenderBudgetUsage(self, outputFormatter)
+
+
+# What one render has used of its RenderBudget. Kept on the OutputFormatter as budgetUsage.
+class RenderBudgetUsage:
+    __slots__ = ["budget", "outputChars", "loopIterations", "saveRawExpansions", "deadline"]
+
+    def __init__(self, budget, outputFormatter):
+        self.budget = budget
+        self.outputChars = 0
+        self.loopIterations = 0
+        self.saveRawExpansions = 0
+        self.deadline = budget._clock() + budget.maxSeconds if budget.maxSeconds is not None else None
+        if budget.maxOutputChars is not None:
+            # outputCharCount is only updated as each line is written out, so a page without line breaks would get
+            # through. Count the pieces as they come in instead.
+            outputString = outputFormatter.outputString
+            outputPartialLine = outputFormatter.outputPartialLine
+
+            def countingOutputString(textString):
+                self.outputChars += len(str(textString))
+                outputString(textString)
+
+            def countingOutputPartialLine(text, isBlank):
+                self.outputChars += len(text)
+                outputPartialLine(text, isBlank)
+            outputFormatter.outputString = countingOutputString
+            outputFormatter.outputPartialLine = countingOutputPartialLine
+
+    def check(self, tag, outputFormatter):
+        budget = self.budget
+        if budget.maxOutputChars is not None and self.outputChars > budget.maxOutputChars:
+            raise RenderBudgetExceededError(f"Render budget exceeded: more than {budget.maxOutputChars} output "
+                                            "characters", tag=tag, outputFormatter=outputFormatter)
+        if self.deadline is not None and budget._clock() > self.deadline:
+            raise RenderBudgetExceededError(f"Render budget exceeded: more than {budget.maxSeconds} seconds",
+                                            tag=tag, outputFormatter=outputFormatter)
+
+    def checkLoopIterations(self, count, tag, outputFormatter):
+        # Raise if count more iterations would go over, without counting them.
+        maxLoopIterations = self.budget.maxLoopIterations
+        if maxLoopIterations is not None and self.loopIterations + count > maxLoopIterations:
+            raise RenderBudgetExceededError(f"Render budget exceeded: more than {maxLoopIterations} loop iterations",
+                                            tag=tag, outputFormatter=outputFormatter)
+
+    def countLoopIterations(self, count, tag, outputFormatter):
+        self.checkLoopIterations(count, tag, outputFormatter)
+        self.loopIterations += count
+        self.check(tag, outputFormatter)
+
+    def countSaveRawExpansion(self, tag, outputFormatter):
+        maxSaveRawExpansions = self.budget.maxSaveRawExpansions
+        self.saveRawExpansions += 1
+        if maxSaveRawExpansions is not None and self.saveRawExpansions > maxSaveRawExpansions:
+            raise RenderBudgetExceededError(f"Render budget exceeded: more than {maxSaveRawExpansions} saveraw "
+                                            "expansions", tag=tag, outputFormatter=outputFormatter)
+        self.check(tag, outputFormatter)
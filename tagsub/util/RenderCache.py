@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from threading import Lock
+
+from ..tags.Tag import Tag
+
+
+class Uncacheable(Exception):
+    pass
+
+
+_atomicTypes = frozenset([str, int, float, complex, bool, bytes, type(None)])
+
+
+def fingerprint(value):
+    # Build a hashable snapshot of a value that compares equal only if the value would render the same way. We
+    # include the type with every atomic value, since 1, 1.0 and True all compare equal, but do not render the same.
+    # Only the builtin container types are walked. Anything else (generators, arbitrary objects, custom Mappings whose
+    # contents we cannot trust to be stable) makes the render uncacheable.
+    from .. import rawstr
+    valueType = type(value)
+    if valueType in _atomicTypes or valueType is rawstr:
+        return valueType, value
+    elif valueType in (list, tuple):
+        return valueType, tuple(fingerprint(item) for item in value)
+    elif valueType is dict:
+        return valueType, tuple((fingerprint(key), fingerprint(item)) for key, item in value.items())
+    elif isinstance(value, Tag):
+        # A save tag left in the caller's Mapping by an earlier render. These are never mutated, so identity will do.
+        return Tag, value
+    raise Uncacheable()
+
+
+# Attached to each NamespaceStack for the length of one render. Records every name (and attribute chain) read from
+# the root level of the namespace, and every name written by the save tags.
+class ReadRecorder:
+    def __init__(self, readSet, tagchar):
+        self._readSet = readSet
+        self._tagchar = tagchar
+
+    def recordRead(self, key, getAttributes, value):
+        # getAttributes is the Value's compiled attribute chain accessor (see Value.compileAttributeChain), if any.
+        readKey = (self._tagchar, key, getAttributes)
+        if readKey not in self._readSet.reads and key not in self._readSet.writes.get(self._tagchar, ()):
+            self._readSet.reads[readKey] = value
+
+    def recordWrite(self, key, value):
+        self._readSet.writes.setdefault(self._tagchar, {})[key] = value
+
+
+class ReadSet:
+    def __init__(self):
+        # Keyed by (tagchar, name, attribute chain accessor)
+        self.reads = {}
+        # Keyed by tagchar, then name
+        self.writes = {}
+
+
+def readValue(namespace, key, getAttributes):
+    # Repeat a recorded read against a fresh NamespaceStack, the same way Value.getValue does it.
+    # A missing name reads as None, which renders exactly the same way.
+    value = namespace.get(key)
+    if getAttributes is not None and value is not None:
+        value = getAttributes(value)
+    return value
+
+
+# An optional whole-render cache for a Template. Rather than keying on the full pageDict, each cache entry is keyed on
+# the values a render actually read, so a render that only depends on a few rarely changing fields of a large
+# pageDict can still be served from the cache. Checking an entry costs one lookup per name in its read set.
+class RenderCache:
+    def __init__(self, maxEntries=16):
+        self._maxEntries = maxEntries
+        # Keyed by (readKeys, fingerprints). The value is the rendered output and the saved values to replay.
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, outputFormatter):
+        # The fingerprints of each distinct read set only need computing once, against all the entries using it. The
+        # most recently used read sets are tried first.
+        candidates = {}
+        with self._lock:
+            for readKeys, fingerprints in reversed(self._entries):
+                candidates.setdefault(readKeys, []).append(fingerprints)
+        for readKeys, entryFingerprints in candidates.items():
+            try:
+                fingerprints = self._matchFingerprints(readKeys, entryFingerprints, outputFormatter)
+            except Exception:
+                # Either uncacheable now, or the lookup itself fails. Either way, let the render deal with it.
+                continue
+            if fingerprints is None:
+                continue
+            with self._lock:
+                entry = self._entries.get((readKeys, fingerprints))
+                if entry is not None:
+                    self._entries.move_to_end((readKeys, fingerprints))
+                    self.hits += 1
+                    return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    @staticmethod
+    def _matchFingerprints(readKeys, entryFingerprints, outputFormatter):
+        # The fingerprints of the current values of readKeys, or None once no entry can match them. Names read from a
+        # plain Mapping cost nothing to check, so those go first, and the resolver is only asked for the names of a
+        # read set that some entry still matches.
+        resolverMappings = outputFormatter.resolverMappings
+        fingerprints = [None] * len(readKeys)
+        resolvedIndexes = []
+        for index, (tagchar, key, getAttributes) in enumerate(readKeys):
+            if tagchar in resolverMappings:
+                resolvedIndexes.append(index)
+                continue
+            fingerprints[index] = fingerprint(readValue(outputFormatter.rootMapping[tagchar], key, getAttributes))
+            entryFingerprints = [entry for entry in entryFingerprints if entry[index] == fingerprints[index]]
+            if not entryFingerprints:
+                return None
+        if resolvedIndexes:
+            for tagchar, resolverMapping in resolverMappings.items():
+                resolverMapping.prefetch([key for keyTagchar, key, chain in readKeys if keyTagchar == tagchar])
+            for index in resolvedIndexes:
+                tagchar, key, getAttributes = readKeys[index]
+                fingerprints[index] = fingerprint(readValue(outputFormatter.rootMapping[tagchar], key, getAttributes))
+        return tuple(fingerprints)
+
+    def store(self, readSet, output):
+        readKeys = tuple(readSet.reads)
+        try:
+            fingerprints = tuple(fingerprint(value) for value in readSet.reads.values())
+        except Uncacheable:
+            return
+        with self._lock:
+            self._entries[(readKeys, fingerprints)] = (output, readSet.writes)
+            self._entries.move_to_end((readKeys, fingerprints))
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,56 @@
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+
+
+# A Resolver may be passed to Template.format in place of a Mapping. Rather than the caller building a pageDict with
+# every value a view might need, the engine asks the resolver for the names the template actually references. The
+# statically known names for a namespace scope (the top level, or the body of a loop or namespace tag) are requested in
+# a single batched call when that scope is entered, like a dataloader.
+class Resolver(ABC):
+    @abstractmethod
+    def resolve(self, names):
+        # names is a tuple of key names. Return a Mapping with the values for whichever of those names are known. Any
+        # name left out is treated exactly like a key missing from a pageDict.
+        raise NotImplementedError()
+
+
+# Wraps a Resolver so it can sit at the root of a NamespaceStack. Each name is only ever requested from the resolver
+# once per render. Names we could not know about statically (a saveraw body referenced from another scope, for
+# instance) fall back to a lazy single name request.
+class ResolverMapping(MutableMapping):
+    def __init__(self, resolver):
+        assert isinstance(resolver, Resolver)
+        self._resolver = resolver
+        self._values = {}
+        self._requestedNames = set()
+
+    def prefetch(self, names):
+        missingNames = tuple(sorted(name for name in names if name not in self._requestedNames))
+        if missingNames:
+            self._request(missingNames)
+
+    def _request(self, names):
+        self._requestedNames.update(names)
+        resolvedValues = self._resolver.resolve(names)
+        for name in names:
+            if name in resolvedValues:
+                self._values[name] = resolvedValues[name]
+
+    def __getitem__(self, key):
+        if key not in self._requestedNames:
+            self._request((key,))
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        # Save tags write here. Once written, the resolver should never be asked for that name.
+        self._requestedNames.add(key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,62 @@
+from collections.abc import MutableMapping
+from operator import attrgetter
+
+
+# The fixed set of names a template will be given for one tagchar, for callers whose data always has the same shape.
+#
+#   template = Template('@', templateStr, schema=("firstName", "orderTotal", "items"))
+#   template.format(("Ada", "12.50", items))       # or any object with those attributes, such as a __slots__ class
+#
+# Each top level lookup of a schema name is bound to the position of that name at compile time, so a render given a
+# record reads it by index rather than through the NamespaceStack. Mappings can still be passed as before.
+class Schema:
+    def __init__(self, names):
+        if isinstance(names, str):
+            raise TypeError("schema must be a sequence of names, not a string")
+        self.names = tuple(names)
+        self.slots = {name: index for index, name in enumerate(self.names)}
+        if len(self.slots) != len(self.names):
+            raise ValueError("schema names must be unique")
+        # attrgetter with several names returns a tuple, with a single name just the value.
+        getter = attrgetter(*self.names) if self.names else lambda record: ()
+        self._getAttributes = getter if len(self.names) != 1 else lambda record: (getter(record),)
+
+    def recordValues(self, record):
+        # The values of a record, in schema order. A tuple or list is taken as the values themselves. Anything else
+        # supplies each name as an attribute, and a missing attribute is treated like a key missing from a pageDict.
+        if isinstance(record, (tuple, list)):
+            if len(record) != len(self.names):
+                raise ValueError(f"Record has {len(record)} values, the schema has {len(self.names)} names")
+            return record
+        try:
+            return self._getAttributes(record)
+        except AttributeError:
+            return tuple(getattr(record, name, None) for name in self.names)
+
+
+# A record, seen as the root Mapping of a NamespaceStack. Anything not bound to a slot (lookups inside loops and
+# namespaces, included templates, recursively substituted values) still finds the names here. Save tags write to the
+# overlay, which is never shared with the caller's record.
+class RecordMapping(MutableMapping):
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+        self._saved = {}
+
+    def __getitem__(self, key):
+        if key in self._saved:
+            return self._saved[key]
+        return self.values[self.schema.slots[key]]
+
+    def __setitem__(self, key, value):
+        self._saved[key] = value
+
+    def __delitem__(self, key):
+        del self._saved[key]
+
+    def __iter__(self):
+        yield from self.schema.names
+        yield from (key for key in self._saved if key not in self.schema.slots)
+
+    def __len__(self):
+        return len(self.schema.names) + sum(1 for key in self._saved if key not in self.schema.slots)
@@ -0,0 +1,76 @@
+from abc import ABC, abstractmethod
+from operator import itemgetter
+from threading import Lock
+
+
+# Supplies the templates pulled in by <@include name> tags. Each named template is compiled once per set of Template
+# options and the compiled tree is then shared by every template (and every render) that includes it.
+# A loader can also act as the environment for a set of top level templates: the templates from load share its
+# globalDict, frozen once, underneath the Mappings passed to each render.
+class TemplateLoader(ABC):
+    def __init__(self, globalDict=None):
+        # (name, tagchars, options) -> compiled Template
+        self._templates = {}
+        # Same again, for the templates from load
+        self._loadedTemplates = {}
+        self._lock = Lock()
+        self.globalDict = globalDict
+
+    @abstractmethod
+    def getSource(self, name):
+        # Return the template string for name. Raise KeyError if there is no such template.
+        raise NotImplementedError()
+
+    def getTemplate(self, name, includingTemplate):
+        from ..Template import Template
+        # Included templates are compiled with the same tagchars and options as the template that includes them.
+        options = dict(is0False=includingTemplate.is0False,
+                       doSuppressComments=includingTemplate.doSuppressComments,
+                       doStrictKeyLookup=includingTemplate.doStrictKeyLookup,
+                       doEncodeHtml=includingTemplate.doEncodeHtml,
+                       loopPrefetchDepth=includingTemplate.loopPrefetchDepth,
+                       maxNestedTagDepth=includingTemplate.maxNestedTagDepth,
+                       optimize=includingTemplate.optimize,
+                       doMappingAttributes=includingTemplate.doMappingAttributes)
+        key = (name, includingTemplate._tagchars) + tuple(options.values())
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                # No fragmentCache of its own: its cache tags use the one of the Template being formatted.
+                template = Template(includingTemplate._tagchars, self.getSource(name), templateLoader=self, **options)
+                self._templates[key] = template
+            return template
+
+    def load(self, name, tagchars="@", **options):
+        # A top level template, compiled with the given Template options, this loader for its includes and the
+        # loader's globalDict.
+        from ..Template import Template
+        # Sorted by option name only, the values need not be comparable with each other.
+        key = (name, tagchars) + tuple(sorted(options.items(), key=itemgetter(0)))
+        try:
+            hash(key)
+        except TypeError:
+            # An option value that can't be hashed (a schema list, a dict) can't be cached on, so load uncached.
+            return Template(tagchars, self.getSource(name), templateLoader=self, globalDict=self.globalDict, **options)
+        with self._lock:
+            template = self._loadedTemplates.get(key)
+            if template is None:
+                template = Template(tagchars, self.getSource(name), templateLoader=self, globalDict=self.globalDict,
+                                    **options)
+                self._loadedTemplates[key] = template
+            return template
+
+    def clear(self):
+        # Forget the compiled templates, so changed sources get picked up.
+        with self._lock:
+            self._templates.clear()
+            self._loadedTemplates.clear()
+
+
+class DictTemplateLoader(TemplateLoader):
+    def __init__(self, templates, globalDict=None):
+        super().__init__(globalDict)
+        self._sources = templates
+
+    def getSource(self, name):
+        return self._sources[name]
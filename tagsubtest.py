@@ -1,11 +1,18 @@
 import unittest
 import collections.abc
+import array
+import io
+import importlib.util
 import operator
+import sys
+import threading
+import time
 
 import tagsub
-from tagsub.Template import NamespaceStack, TemplateIterator
+from tagsub.Template import NamespaceStack, OutputFormatter, TemplateIterator
 from tagsub.exceptions import TagStackOverflowError, InvalidTagKeyName, ExpressionError, ExpressionStackOverflowError
 from tagsub.exceptions import TagsubTemplateSyntaxError, TagcharSequenceMismatchError
+from tagsub.exceptions import RecursiveSubstitutionOverflowError, RenderBudgetExceededError
 
 
 ## TODO Test actually hitting EOF while in a tag. Does it properly detect an error? especially if it has INCREFed a string.
@@ -2987,6 +2994,19 @@ class test_saveoverride(tagsub_TestCase):
             '<@saveoverride test><@super duper><@/saveoverride',
             {})
 
+    def test_saveoverride7(self):
+        # The overridden value stays with the saved value, so it can be referenced in a later render.
+        d = {'test': 'old'}
+        self.assertEqual('', tagsub.substitute('@', '<@saveoverride test>new <@super><@/saveoverride>', d))
+        self.assertEqual('[new old]', tagsub.substitute('@', '[<@test>]', d))
+        self.assertEqual('[new old]', tagsub.substitute('@', '[<@test>]', d))
+
+    def test_saveoverride8(self):
+        # The same saveoverride tag formatted again overrides its own earlier value.
+        self.assertEqual('(((a)))', tagsub.substitute(
+            '@', '<@loop list><@saveoverride test>(<@super>)<@/saveoverride><@/loop><@test>',
+            {'test': 'a', 'list': [{}, {}, {}]}))
+
 class test_iterator(tagsub_TestCase):
     def test_iterator1(self):
         def f(n):
@@ -2996,6 +3016,27 @@ class test_iterator(tagsub_TestCase):
         result = substitute('@', '<@loop list><@if !:isFirst>,<@/if><@count><@/loop>', d)
         self.assertEqual('0,1,2,3,4', result)
 
+    def test_iterator2(self):
+        # isLast comes from looking ahead one item. The generator is only consumed as far as the render needs.
+        consumed = []
+        def f(n):
+            for i in range(n):
+                consumed.append(i)
+                yield {'count': i}
+        result = substitute('@', '<@loop list><@count><@if :isLast>.<@else>,<@/if><@/loop>', {'list': f(4)})
+        self.assertEqual('0,1,2,3.', result)
+        self.assertEqual([0, 1, 2, 3], consumed)
+
+    def test_iterator3(self):
+        self.assertEqual('', substitute('@', '<@loop list><@:isLast><@/loop>', {'list': iter([])}))
+        self.assertEqual('1', substitute('@', '<@loop list><@:isLast><@/loop>', {'list': iter([{}])}))
+
+    def test_iterator4(self):
+        # Sized, but not a Sequence, still gets a length.
+        result = substitute('@', '<@loop list><@:rindex><@if !:isLast>,<@/if><@/loop>',
+                            {'list': collections.OrderedDict([('a', 1), ('b', 2)]).values()})
+        self.assertEqual('2,1', result)
+
 class mapping(collections.abc.Mapping):
     def __getitem__(self, key):
         if key == "error":
@@ -3209,6 +3250,1143 @@ class test_util_classes_AbstractClasses(tagsub_TestCase):
         self.assertRaises(NotImplementedError, o.getValue, '@', None)
 
 
+class recordingResolver(tagsub.Resolver):
+    def __init__(self, values):
+        self.values = values
+        self.requests = []
+
+    def resolve(self, names):
+        self.requests.append(names)
+        return {name: self.values[name] for name in names if name in self.values}
+
+
+class test_resolver(tagsub_TestCase):
+    def test_resolver1(self):
+        resolver = recordingResolver({'a': 'A', 'b': 'B', 'c': 'C'})
+        result = tagsub.Template('@', '<@a> <@if b><@b><@/if> <@missing>').format(resolver)
+        self.assertEqual('A B ', result)
+        self.assertEqual([('a', 'b', 'missing')], resolver.requests)
+
+    def test_resolver2(self):
+        # Names referenced inside the loop body are batched once for the whole loop, not once per iteration.
+        resolver = recordingResolver({'rows': [{'x': '1'}, {'x': '2'}, {}], 'title': 'T', 'x': 'outer'})
+        result = tagsub.Template('@', '<@title><@loop rows><@x>,<@loop rows><@title><@/loop><@/loop>').format(
+            [resolver])
+        self.assertEqual('T1,TTT2,TTTouter,TTT', result)
+        self.assertEqual([('rows', 'title'), ('x',)], resolver.requests)
+
+    def test_resolver3(self):
+        # The names of saveraw tags are not requested themselves, but a reference to one may be.
+        resolver = recordingResolver({'u': 'water', 'v': 'overwritten'})
+        result = tagsub.Template('@#', '<@saveraw v>repeat <@u><@/saveraw><@v> <#namespace ns><#z><#/namespace>').format(
+            {'@': resolver, '#': {'ns': {'z': 'zed'}}})
+        self.assertEqual('repeat water zed', result)
+        self.assertEqual([('u', 'v')], resolver.requests)
+
+
+class test_render_cache(tagsub_TestCase):
+    def setUp(self):
+        self.renderCache = tagsub.RenderCache()
+        self.template = tagsub.Template(
+            '@', '<@title><@loop rows> <@name><@/loop> <@user.name><@if unused><@never><@/if>',
+            renderCache=self.renderCache)
+        self.user = simple_class()
+        self.user.name = 'bob'
+
+    def test_render_cache1(self):
+        d = {'title': 'T', 'rows': [{'name': 'a'}, {'name': 'b'}], 'user': self.user, 'ignored': object()}
+        self.assertEqual('T a b bob', self.template.format(d))
+        self.assertEqual((0, 1), (self.renderCache.hits, self.renderCache.misses))
+        # Values that were never read (even uncacheable ones) do not affect the cache.
+        d['ignored'] = object()
+        self.assertEqual('T a b bob', self.template.format(d))
+        self.assertEqual((1, 1), (self.renderCache.hits, self.renderCache.misses))
+
+    def test_render_cache2(self):
+        d = {'title': 'T', 'rows': [{'name': 'a'}], 'user': self.user}
+        self.assertEqual('T a bob', self.template.format(d))
+        d['rows'][0]['name'] = 'changed'
+        self.assertEqual('T changed bob', self.template.format(d))
+        self.user.name = 'ted'
+        self.assertEqual('T changed ted', self.template.format(d))
+        d['unused'] = True
+        d['never'] = 'now'
+        self.assertEqual('T changed tednow', self.template.format(d))
+        self.assertEqual((0, 4), (self.renderCache.hits, self.renderCache.misses))
+        del d['unused']
+        self.assertEqual('T changed ted', self.template.format(d))
+        self.assertEqual(1, self.renderCache.hits)
+
+    def test_render_cache3(self):
+        # Generators can not be fingerprinted, so those renders are never cached.
+        d = {'title': 'T', 'rows': iter([{'name': 'a'}]), 'user': self.user}
+        self.assertEqual('T a bob', self.template.format(d))
+        self.assertEqual(0, len(self.renderCache))
+
+    def test_render_cache4(self):
+        # Saved values are replayed into the caller's Mapping on a cache hit.
+        template = tagsub.Template('@', '<@saveeval field><@value>!<@/saveeval><@field>',
+                                   renderCache=self.renderCache)
+        self.assertEqual('x!', template.format({'value': 'x'}))
+        d = {'value': 'x'}
+        self.assertEqual('x!', template.format(d))
+        self.assertEqual(1, self.renderCache.hits)
+        self.assertEqual('x!', d['field'])
+
+    def test_render_cache5(self):
+        renderCache = tagsub.RenderCache(maxEntries=2)
+        template = tagsub.Template('@', '<@value>', renderCache=renderCache)
+        for value in 'abc':
+            self.assertEqual(value, template.format({'value': value}))
+        self.assertEqual(2, len(renderCache))
+        self.assertEqual('c', template.format({'value': 'c'}))
+        self.assertEqual('a', template.format({'value': 'a'}))
+        self.assertEqual((1, 4), (renderCache.hits, renderCache.misses))
+
+    def test_render_cache6(self):
+        # A probe only asks the resolver for the names of read sets some entry still matches on their other names.
+        template = tagsub.Template('@#', '<#if kind><@a><#else><@b><#/if>', renderCache=self.renderCache)
+        values = {'a': 'A', 'b': 'B'}
+        self.assertEqual('A', template.format({'@': recordingResolver(values), '#': {'kind': 1}}))
+        self.assertEqual('B', template.format({'@': recordingResolver(values), '#': {'kind': 0}}))
+        for kind, name in ((0, 'b'), (1, 'a'), (0, 'b')):
+            resolver = recordingResolver(values)
+            self.assertEqual(name.upper(), template.format({'@': resolver, '#': {'kind': kind}}))
+            self.assertEqual([(name,)], resolver.requests)
+        self.assertEqual((3, 2), (self.renderCache.hits, self.renderCache.misses))
+
+    def test_render_cache7(self):
+        # Hits and misses are counted for every render, even when rendering from several threads at once.
+        from concurrent.futures import ThreadPoolExecutor
+        renderCache = tagsub.RenderCache(maxEntries=4)
+        template = tagsub.Template('@', '<@value>', renderCache=renderCache)
+        def render(n):
+            return all(template.format({'value': str((n + i) % 8)}) == str((n + i) % 8) for i in range(50))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(render, range(16))))
+        self.assertEqual(16 * 50, renderCache.hits + renderCache.misses)
+
+
+class test_cache_tag(tagsub_TestCase):
+    def setUp(self):
+        self.now = 0
+        self.fragmentCache = tagsub.LRUFragmentCache(maxEntries=2, clock=lambda: self.now)
+        self.template = tagsub.Template('@', '[<@cache section, user.name 60><@loop items><@name>;<@/loop><@/cache>]',
+                                        fragmentCache=self.fragmentCache)
+        self.user = simple_class()
+        self.user.name = 'bob'
+
+    def format(self, section, items):
+        return self.template.format({'section': section, 'user': self.user, 'items': items})
+
+    def test_cache_tag1(self):
+        self.assertEqual('[a;b;]', self.format('nav', [{'name': 'a'}, {'name': 'b'}]))
+        # Same key, so the body is not rendered again.
+        self.assertEqual('[a;b;]', self.format('nav', [{'name': 'changed'}]))
+        self.assertEqual('[changed;]', self.format('sidebar', [{'name': 'changed'}]))
+        self.user.name = 'ted'
+        self.assertEqual('[other;]', self.format('nav', [{'name': 'other'}]))
+
+    def test_cache_tag2(self):
+        self.assertEqual('[a;]', self.format('nav', [{'name': 'a'}]))
+        self.now = 59
+        self.assertEqual('[a;]', self.format('nav', [{'name': 'b'}]))
+        self.now = 60
+        self.assertEqual('[b;]', self.format('nav', [{'name': 'b'}]))
+
+    def test_cache_tag3(self):
+        # Least recently used entries are evicted first.
+        self.format('one', [{'name': '1'}])
+        self.format('two', [{'name': '2'}])
+        self.format('one', [])
+        self.format('three', [{'name': '3'}])
+        self.assertEqual(2, len(self.fragmentCache))
+        self.assertEqual('[1;]', self.format('one', []))
+        self.assertEqual('[]', self.format('two', []))
+
+    def test_cache_tag4(self):
+        # No ttl, and the default in process backend.
+        template = tagsub.Template('@', '<@cache key>(<@value>)<@/cache>')
+        self.assertEqual('(1)', template.format({'key': 'k', 'value': '1'}))
+        self.assertEqual('(1)', template.format({'key': 'k', 'value': '2'}))
+        self.assertEqual('(2)', template.format({'key': 'j', 'value': '2'}))
+
+    def test_cache_tag5(self):
+        self.assertRaisesAndMatchesTraceback(InvalidTagKeyName, '2(1,2)',
+                                             substitute, '@', 'x<@cache key ttl>body<@/cache>', {})
+        self.assertRaisesAndMatchesTraceback(TagsubTemplateSyntaxError, '2(1,2)',
+                                             substitute, '@', 'x<@cache key 60 120>body<@/cache>', {})
+        self.assertRaisesAndMatchesTraceback(TagsubTemplateSyntaxError, '2(1,2)',
+                                             substitute, '@', 'x<@cache key>body', {})
+
+    def test_cache_tag6(self):
+        # A backend shared between templates with the same text but different output options keeps their entries apart.
+        text = '<@cache k><@v><@/cache>'
+        raw = tagsub.Template('@', text, fragmentCache=self.fragmentCache, doEncodeHtml=False)
+        escaped = tagsub.Template('@', text, fragmentCache=self.fragmentCache)
+        d = {'k': '1', 'v': '<b>&'}
+        self.assertEqual('<b>&', raw.format(d))
+        self.assertEqual('&lt;b&gt;&amp;', escaped.format(d))
+        self.assertEqual('<b>&', raw.format(d))
+        # As do templates with other tagchars.
+        self.fragmentCache = tagsub.LRUFragmentCache()
+        single = tagsub.Template('@', text, fragmentCache=self.fragmentCache)
+        double = tagsub.Template('@#', text, fragmentCache=self.fragmentCache)
+        self.assertEqual('1', single.format({'k': '1', 'v': '1'}))
+        self.assertEqual('2', double.format([{'k': '1', 'v': '2'}, {}]))
+
+
+class test_profiler(tagsub_TestCase):
+    def setUp(self):
+        self.ticks = 0
+
+        def clock():
+            self.ticks += 1
+            return self.ticks
+        self.profiler = tagsub.Profiler(clock=clock)
+        self.template = tagsub.Template('@', 'head\n<@loop rows><@if show><@name><@/if>,<@/loop>\n<@title>')
+
+    def test_profiler1(self):
+        d = {'rows': [{'name': 'a', 'show': 1}, {'name': 'bb'}, {'name': 'ccc', 'show': 1}], 'title': 'T'}
+        result = self.template.format(d, profiler=self.profiler)
+        self.assertEqual('head\na,,ccc,\nT', result)
+        dump = self.profiler.dump()
+        # The if tag container and its first alternate share a position.
+        self.assertEqual(['if@18', 'if@18', 'loop@6', 'root@1', 'simple@28', 'simple@51'],
+                         sorted(entry['tag'] + '@' + str(entry['charpos']) for entry in dump))
+        stats = {entry['tag'] + '@' + str(entry['charpos']): entry for entry in dump}
+        loop = stats['loop@6']
+        self.assertEqual((1, 3, 3), (loop['calls'], loop['iterations'], loop['charsEmitted']))
+        self.assertEqual(2, stats['simple@28']['calls'])
+        self.assertEqual(4, stats['simple@28']['charsEmitted'])
+        self.assertEqual(6, stats['root@1']['charsEmitted'])
+        self.assertEqual((1, 2), (stats['root@1']['linenum'], stats['loop@6']['linenum']))
+        # Every clock reading is one tick later. The root sees one tick between itself and each of its two children.
+        root = stats['root@1']
+        self.assertEqual(3, root['selfTime'])
+        self.assertGreater(root['cumulativeTime'], loop['cumulativeTime'])
+        self.assertIn('loop', self.profiler.report())
+
+    def test_profiler2(self):
+        # Nothing is left behind on the template once profiling is finished.
+        with self.profiler.profiling(self.template):
+            self.assertIn('format', self.template.rootTag.__dict__)
+            self.assertRaises(RuntimeError, tagsub.Profiler().profiling(self.template).__enter__)
+        self.assertNotIn('format', self.template.rootTag.__dict__)
+        self.assertEqual('head\n\n', self.template.format({}))
+        self.assertEqual(0, self.profiler.dump()[0]['calls'])
+
+    def test_profiler3(self):
+        # HTML comments and <@ > tags have no keyword of their own.
+        template = tagsub.Template('@', 'a<!-- <@x> -->b<@ >\n<@loop l><@x><@/loop>')
+        result = template.format({'x': '1', 'l': [{}]}, profiler=self.profiler)
+        self.assertEqual('a<!-- 1 -->b\n1', result)
+        self.assertEqual(['comment', 'loop', 'null', 'root', 'simple', 'simple'],
+                         sorted(entry['tag'] for entry in self.profiler.dump()))
+        self.assertEqual(1, [entry for entry in self.profiler.dump() if entry['tag'] == 'loop'][0]['iterations'])
+        self.assertIn('comment', self.profiler.report())
+
+
+class test_memory_profiler(tagsub_TestCase):
+    def test_memory_profiler1(self):
+        memoryProfiler = tagsub.MemoryProfiler(topSites=3)
+        template = tagsub.Template('@', '<@loop rows><p><@text></p>\n<@/loop>')
+        result = template.format({'rows': [{'text': 'é<&' * 10} for i in range(500)]},
+                                 memoryProfiler=memoryProfiler)
+        report = memoryProfiler.lastReport
+        self.assertEqual(len(result), report.outputCharCount)
+        self.assertGreaterEqual(report.peakBytes, report.finalBytes)
+        self.assertGreater(report.categories['escapedStrings'][0], 0)
+        self.assertGreater(report.categories['outputBuffers'][0], 0)
+        self.assertEqual(3, len(report.topSites))
+        self.assertEqual(set(report.asDict()['categories']),
+                         {'outputBuffers', 'lineTextNodes', 'loopVars', 'escapedStrings', 'other'})
+        self.assertIn('peak:', str(report))
+        # Nothing is left behind on the template afterwards.
+        self.assertNotIn('setLoopVars', template.rootTag._children[0].__dict__)
+
+    def test_memory_profiler2(self):
+        # HTML comments and <@ > tags are no obstacle.
+        memoryProfiler = tagsub.MemoryProfiler()
+        template = tagsub.Template('@', 'a<!-- <@x> -->b<@ >\n<@loop l><@x><@/loop>')
+        result = template.format({'x': '1', 'l': [{}]}, memoryProfiler=memoryProfiler)
+        self.assertEqual('a<!-- 1 -->b\n1', result)
+        self.assertEqual(len(result), memoryProfiler.lastReport.outputCharCount)
+
+
+class test_recursive_substitution(tagsub_TestCase):
+    def test_recursive_substitution1(self):
+        # The value is processed with the current NamespaceStack, so it sees the loop's mapping.
+        result = substitute('@', '<@loop list><@snippet>,<@/loop>',
+                            {'list': [{'name': 'a'}, {'name': 'b'}], 'snippet': '[<@name>]'})
+        self.assertEqual('[a],[b],', result)
+
+    def test_recursive_substitution2(self):
+        result = substitute('@', '<@outer>', {'outer': '(<@inner>)', 'inner': '<@if x>yes<@/if>', 'x': 1})
+        self.assertEqual('(yes)', result)
+
+    def test_recursive_substitution3(self):
+        # A snippet referenced many times is only compiled once.
+        from tagsub.Template import compileValueTemplate
+        compileValueTemplate.cache_clear()
+        substitute('@', '<@loop list><@snippet><@/loop>', {'list': [{}] * 5, 'snippet': '<@x>', 'x': 'x'})
+        self.assertEqual(1, compileValueTemplate.cache_info().misses)
+        self.assertEqual(4, compileValueTemplate.cache_info().hits)
+
+    def test_recursive_substitution3a(self):
+        # The compiled value is shared between Templates, but each renders its cache tags into its own fragment cache.
+        from tagsub.Template import compileValueTemplate
+        compileValueTemplate.cache_clear()
+        caches = [tagsub.LRUFragmentCache(), tagsub.LRUFragmentCache()]
+        for fragmentCache in caches:
+            template = tagsub.Template('@', '<@snippet>', doEncodeHtml=False, fragmentCache=fragmentCache)
+            self.assertEqual('x', template.format({'snippet': '<@cache k><@x><@/cache>', 'k': '1', 'x': 'x'}))
+        self.assertEqual(1, compileValueTemplate.cache_info().misses)
+        self.assertEqual([1, 1], [len(fragmentCache) for fragmentCache in caches])
+
+    def test_recursive_substitution4(self):
+        self.assertRaisesAndMatchesTraceback(RecursiveSubstitutionOverflowError,
+                                             '1(1,1)/' * tagsub.max_recursive_template_depth + '1(1,1)',
+                                             substitute, '@', '<@a>', {'a': '<@a>'})
+
+    def test_recursive_substitution5(self):
+        self.assertRaisesAndMatchesTraceback(AttributeError,
+                                             '10(1,10):1(1,1)[1]/1(1,1)',
+                                             substitute, '@', '<@loop l><@a><@/loop>',
+                                             {'a': '<@b.x>', 'b': 3, 'l': [{}]})
+
+    def test_recursive_substitution6(self):
+        # Tags in a value stay as text when encoding HTML entities.
+        result = substitute('@', '<@a>', {'a': '<@b>', 'b': 'x'}, doEncodeHtml=True)
+        self.assertEqual('&lt;@b&gt;', result)
+
+
+class test_include_tag(tagsub_TestCase):
+    def setUp(self):
+        self.loader = tagsub.DictTemplateLoader({
+            'header': '<h1><@title></h1>\n',
+            'row': '<li><@name>:<@if tag><@tag><@/if></li>',
+            'partials/self': '<@include "partials/self">',
+            'unclosed': '<@if x>',
+        })
+
+    def test_include_tag1(self):
+        # The included template sees the enclosing loop's mapping.
+        template = tagsub.Template('@', '<@include header><@loop rows><@include row><@/loop>',
+                                   templateLoader=self.loader, doEncodeHtml=False)
+        result = template.format({'title': 'T', 'tag': '!', 'rows': [{'name': 'a'}, {'name': 'b', 'tag': '?'}]})
+        self.assertEqual('<h1>T</h1>\n<li>a:!</li><li>b:?</li>', result)
+
+    def test_include_tag2(self):
+        # Every template including 'header' shares one compiled tree.
+        template1 = tagsub.Template('@', '<@include header>', templateLoader=self.loader)
+        template2 = tagsub.Template('@', 'x<@include header>', templateLoader=self.loader)
+        template1.format({'title': '1'})
+        self.assertEqual('x<h1>2</h1>\n', template2.format({'title': '2'}))
+        self.assertEqual(1, len(self.loader._templates))
+
+    def test_include_tag3(self):
+        self.assertRaisesAndMatchesTraceback(tagsub.exceptions.TemplateNotFoundError, '3(1,3)',
+                                             tagsub.Template('@', 'xx<@include missing>',
+                                                             templateLoader=self.loader).format, {})
+
+    def test_include_tag4(self):
+        self.assertRaisesAndMatchesTraceback(RecursiveSubstitutionOverflowError,
+                                             '1(1,1)/' * tagsub.max_recursive_template_depth + '1(1,1)',
+                                             tagsub.Template('@', '<@include "partials/self">',
+                                                             templateLoader=self.loader).format, {})
+
+    def test_include_tag5(self):
+        self.assertRaisesAndMatchesTraceback(TagsubTemplateSyntaxError, '3(2,2)/1(1,1)',
+                                             tagsub.Template('@', '\n <@include unclosed>',
+                                                             templateLoader=self.loader).format, {})
+
+    def test_include_tag6(self):
+        self.assertRaisesAndMatchesTraceback(TagsubTemplateSyntaxError, '1(1,1)',
+                                             tagsub.Template, '@', '<@include header>')
+
+    def test_include_tag7(self):
+        # The shared included template renders its cache tags into the fragment cache of each including Template.
+        self.loader = tagsub.DictTemplateLoader({'cached': '<@cache k><@x><@/cache>'})
+        caches = [tagsub.LRUFragmentCache(), tagsub.LRUFragmentCache()]
+        for fragmentCache, x in zip(caches, 'ab'):
+            template = tagsub.Template('@', '<@include cached>', templateLoader=self.loader,
+                                       fragmentCache=fragmentCache)
+            self.assertEqual(x, template.format({'k': '1', 'x': x}))
+        self.assertEqual(1, len(self.loader._templates))
+        self.assertEqual([1, 1], [len(fragmentCache) for fragmentCache in caches])
+
+
+class test_loop_prefetch(tagsub_TestCase):
+    def waitForProducers(self):
+        for thread in threading.enumerate():
+            if thread.name == "tagsub-loop-prefetch":
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+    def test_loop_prefetch1(self):
+        threads = set()
+        def rows(n):
+            for i in range(n):
+                threads.add(threading.current_thread())
+                yield {'count': i}
+        template = tagsub.Template('@', '<@loop rows><@count><@if !:isLast>,<@/if><@/loop>', loopPrefetchDepth=2,
+                                   doEncodeHtml=False)
+        self.assertEqual('0,1,2,3,4', template.format({'rows': rows(5)}))
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_loop_prefetch2(self):
+        # The queue bounds how far ahead of the render the producer gets.
+        produced = []
+        class Row(collections.abc.Mapping):
+            def __init__(self, i):
+                self.i = i
+            def __getitem__(self, key):
+                return len(produced) if key == 'produced' else self.i
+            def __iter__(self):
+                return iter(['produced'])
+            def __len__(self):
+                return 1
+        def rows(n):
+            for i in range(n):
+                produced.append(i)
+                yield Row(i)
+        template = tagsub.Template('@', '<@loop rows><@produced>,<@/loop>', loopPrefetchDepth=2, doEncodeHtml=False)
+        result = template.format({'rows': rows(20)})
+        # Past the current row, at most the lookahead row, a full queue of 2, and one the producer is waiting to put.
+        counts = [int(n) for n in result.split(',')[:-1]]
+        self.assertEqual(20, len(counts))
+        self.assertTrue(all(n - i <= 5 for i, n in enumerate(counts)))
+
+    def test_loop_prefetch3(self):
+        def rows():
+            yield {}
+            yield {}
+            raise CustomError("fetch failed")
+        template = tagsub.Template('@', '<@loop rows>x<@/loop>', loopPrefetchDepth=4)
+        self.assertRaises(CustomError, template.format, {'rows': rows()})
+        self.waitForProducers()
+
+    def test_loop_prefetch4(self):
+        # An error in the loop body stops the producer, even for an endless iterable.
+        def rows():
+            while True:
+                yield {}
+        template = tagsub.Template('@', '<@loop rows><@value.missing><@/loop>', loopPrefetchDepth=2)
+        self.assertRaisesAndMatchesTraceback(AttributeError, '13(1,13):1(1,1)[1]', template.format,
+                                             {'rows': rows(), 'value': 1})
+        self.waitForProducers()
+
+
+class test_loop_window(tagsub_TestCase):
+    def setUp(self):
+        self.d = {'rows': [{'n': i} for i in range(10)], 'page': 1, 'size': '4'}
+
+    def test_loop_window1(self):
+        template = '<@loop rows start=3 limit=size><@n>:<@:index>:<@:rindex>:<@:isLast>,<@/loop>'
+        self.assertEqual('3:1:4:0,4:2:3:0,5:3:2:0,6:4:1:1,', substitute('@', template, self.d))
+
+    def test_loop_window2(self):
+        template = '<@loop rows start=8 limit=size index=sequence><@n>:<@:index>:<@:rindex>:<@:isLast>,<@/loop>'
+        self.assertEqual('8:9:2:0,9:10:1:1,', substitute('@', template, self.d))
+
+    def test_loop_window3(self):
+        # Iterators get the same windows, and isLast still works without a length.
+        for template, expected in [
+                ('<@loop rows start=page limit=2><@n>:<@:index>:<@:isLast>,<@/loop>', '1:1:0,2:2:1,'),
+                ('<@loop rows start=2 limit=2 index=sequence><@n>:<@:index>:<@:isLast>,<@/loop>', '2:3:0,3:4:0,'),
+                ('<@loop rows start=8 index=sequence><@n>:<@:index>:<@:isLast>,<@/loop>', '8:9:0,9:10:1,'),
+                ('<@loop rows start=20><@n><@/loop>', '')]:
+            self.assertEqual(expected, substitute('@', template, dict(self.d, rows=iter(self.d['rows']))))
+
+    def test_loop_window4(self):
+        # Only the items in the window are read from a Sequence.
+        class Rows(collections.abc.Sequence):
+            def __init__(self):
+                self.read = []
+            def __getitem__(self, index):
+                self.read.append(index)
+                return {'n': index}
+            def __len__(self):
+                return 1000
+        rows = Rows()
+        self.assertEqual('500501', substitute('@', '<@loop rows start=500 limit=2><@n><@/loop>', {'rows': rows}))
+        self.assertEqual([500, 501], rows.read)
+
+    def test_loop_window5(self):
+        self.assertRaisesAndMatchesTraceback(InvalidTagKeyName, '1(1,1)',
+                                             substitute, '@', '<@loop rows offset=1><@/loop>', {})
+        self.assertRaisesAndMatchesTraceback(InvalidTagKeyName, '1(1,1)',
+                                             substitute, '@', '<@loop rows index=all><@/loop>', {})
+        self.assertRaisesAndMatchesTraceback(tagsub.exceptions.TagsubValueError, '1(1,1)',
+                                             substitute, '@', '<@loop rows limit=size><@/loop>',
+                                             {'rows': [], 'size': 'ten'})
+
+
+class test_columnar_data(tagsub_TestCase):
+    def setUp(self):
+        self.rows = tagsub.ColumnarData({
+            'id': array.array('l', [1, 2, 3]),
+            'name': ['a', 'b', 'c'],
+            'flag': memoryview(b'\x01\x00\x01'),
+        })
+
+    def test_columnar_data1(self):
+        result = substitute('@', '<@loop rows><@name><@if flag>*<@/if><@title>,<@/loop>',
+                            {'rows': self.rows, 'title': '!'})
+        self.assertEqual('a*!,b!,c*!,', result)
+
+    def test_columnar_data2(self):
+        # Iterating reuses one RowView; indexing gives a separate one.
+        self.assertEqual(1, len({id(row) for row in self.rows}))
+        self.assertEqual('b', self.rows[1]['name'])
+        self.assertEqual('c', self.rows[-1]['name'])
+        self.assertEqual(['b', 'c'], [row['name'] for row in self.rows[1:]])
+        self.assertRaises(IndexError, self.rows.__getitem__, 3)
+
+    def test_columnar_data3(self):
+        result = substitute('@', '<@loop rows start=1 limit=5><@id>:<@:index>:<@:isLast>,<@/loop>', {'rows': self.rows})
+        self.assertEqual('2:1:0,3:2:1,', result)
+
+    def test_columnar_data4(self):
+        result = substitute('@', '<@loop rows><@if value>x<@else>0<@/if><@/loop>',
+                            {'rows': tagsub.ColumnarData({'value': ['0', '1']})}, is0False=True)
+        self.assertEqual('0x', result)
+
+    def test_columnar_data5(self):
+        self.assertRaises(ValueError, tagsub.ColumnarData, {'a': [1, 2], 'b': [1]})
+
+
+class test_flat_loop(tagsub_TestCase):
+    def renderBothWays(self, template, pageDict, **kwargs):
+        from tagsub.tags.FlatLoop import FlatLoop
+        template = tagsub.Template('@', template, **kwargs)
+        fast = template.format(pageDict)
+        flatLoopFormat = FlatLoop.format
+        FlatLoop.format = lambda *args: False
+        try:
+            slow = template.format(pageDict)
+        finally:
+            FlatLoop.format = flatLoopFormat
+        self.assertEqual(slow, fast)
+        return fast
+
+    def findLoop(self, template):
+        return tagsub.Template('@', template).rootTag._children[0]
+
+    def test_flat_loop1(self):
+        self.assertIsNotNone(self.findLoop('<@loop rows><td><@a></td>\n<@/loop>')._flatLoop)
+        self.assertIsNone(self.findLoop('<@loop rows><@a>\n<@/loop>')._flatLoop)
+        self.assertIsNone(self.findLoop('<@loop rows><@:index>,<@/loop>')._flatLoop)
+        self.assertIsNone(self.findLoop('<@loop rows><@if a>x<@/if><@/loop>')._flatLoop)
+        self.assertIsNone(self.findLoop('<@loop rows start=1><@a>,<@/loop>')._flatLoop)
+
+    def test_flat_loop2(self):
+        rows = [{'a': '<b>', 'b': 'é'}, {'a': None, 'b': tagsub.rawstr('<i>')}, {'a': '\0', 'b': ''}]
+        result = self.renderBothWays('<table>\n<@loop rows>  <tr><@a>|<@b></tr>\n<@/loop></table>', {'rows': rows})
+        self.assertEqual('<table>\n  <tr>&lt;b&gt;|&eacute;</tr>\n  <tr>|<i></tr>\n  <tr>\0|</tr>\n</table>', result)
+
+    def test_flat_loop3(self):
+        # Lines left incomplete at the end of the loop are still suppressed when they produce nothing.
+        for rows in ([{'a': '', 'b': ''}] * 3, [{'a': '', 'b': ' '}] * 3, [{'a': 'x', 'b': ''}] * 2):
+            self.renderBothWays(' <@loop rows>  <@a><@b><@/loop>\n<@z>\nend\n', {'rows': rows, 'z': ''})
+            self.renderBothWays('x\n<@loop rows>x\n <@a><@/loop> \n', {'rows': rows}, doEncodeHtml=False)
+
+    def test_flat_loop4(self):
+        # Anything the batched path cannot reproduce goes back to the tree walk.
+        self.renderBothWays('<@loop rows><@a>,<@/loop>', {'rows': [{'a': 1}, {}], 'a': 'outer'}, doEncodeHtml=False)
+        self.renderBothWays('<@loop rows><@a>,<@/loop>', {'rows': [{'a': '<@b>'}], 'b': 'B'}, doEncodeHtml=False)
+        self.renderBothWays('<@loop rows><@a>,<@/loop>', {'rows': [{'a': '0'}]}, doEncodeHtml=False, is0False=True)
+        self.assertRaises(TypeError, tagsub.Template('@', '<@loop rows><@a>,<@/loop>').format, {'rows': [{'a': 1}]})
+
+    def test_flat_loop5(self):
+        rows = tagsub.ColumnarData({'id': array.array('l', range(3)), 'name': ['<a>', 'b', None]})
+        result = self.renderBothWays('<@loop rows><@id>=<@name>\n<@/loop>', {'rows': rows}, doEncodeHtml=False)
+        self.assertEqual('0=<a>\n1=b\n2=\n', result)
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy is not installed')
+    def test_flat_loop6(self):
+        import numpy
+        rows = tagsub.ColumnarData({'id': numpy.arange(5), 'price': numpy.linspace(0, 1, 5, dtype=numpy.float32)})
+        self.renderBothWays('<@loop rows><@id>:<@price>\n<@/loop>', {'rows': rows}, doEncodeHtml=False)
+
+
+class test_concurrent_render(tagsub_TestCase):
+    def test_concurrent_render1(self):
+        # One Template rendered from several threads at once gives each render its own loop variables and super
+        # references.
+        from concurrent.futures import ThreadPoolExecutor
+        template = tagsub.Template('@', '<@saveraw item>[<@name>]<@/saveraw>'
+                                        '<@saveoverride item>{<@super>}<@/saveoverride>'
+                                        '<@loop rows><@:index>/<@:rindex><@item><@if :isLast>.<@else>,<@/if><@/loop>',
+                                   doEncodeHtml=False)
+        def render(n):
+            rows = [{'name': f'{n}-{i}'} for i in range(n % 7 + 1)]
+            expected = ','.join(f'{i + 1}/{len(rows) - i}{{[{n}-{i}]}}' for i in range(len(rows))) + '.'
+            for _ in range(20):
+                if template.format({'rows': rows}) != expected:
+                    return False
+            return True
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(render, range(64))))
+
+    def test_concurrent_render2(self):
+        # Per-render state is not left behind on the tree.
+        template = tagsub.Template('@', '<@saveoverride x>(<@super>)<@/saveoverride><@x>')
+        self.assertEqual('(a)', template.format({'x': 'a'}))
+        self.assertEqual('()', template.format({}))
+
+
+class test_isolated_saves(tagsub_TestCase):
+    template = ('<@saveeval total><@loop rows><@n><@/loop><@/saveeval>'
+                '<@saveraw label>[<@total>]<@/saveraw><@label>')
+
+    def test_isolated_saves1(self):
+        pageDict = {'rows': [{'n': '1'}, {'n': '2'}]}
+        template = tagsub.Template('@', self.template, doIsolateSaves=True)
+        savedValues = {}
+        self.assertEqual('[12]', template.format(pageDict, savedValues=savedValues))
+        self.assertEqual({'rows': [{'n': '1'}, {'n': '2'}]}, pageDict)
+        self.assertEqual({'@': {'total': '12', 'label': '[12]'}}, savedValues)
+
+    def test_isolated_saves2(self):
+        # Without isolation, the caller's dict still gets the saved values, and they can be exported just the same.
+        pageDict = {'rows': [{'n': '1'}]}
+        savedValues = {}
+        self.assertEqual('[1]', tagsub.Template('@', self.template).format(pageDict, savedValues=savedValues))
+        self.assertEqual('1', pageDict['total'])
+        self.assertEqual({'@': {'total': '1', 'label': '[1]'}}, savedValues)
+
+    def test_isolated_saves3(self):
+        # A render cache hit replays the saved values into the overlay, not the caller's dict.
+        template = tagsub.Template('@', self.template, doIsolateSaves=True, renderCache=tagsub.RenderCache())
+        for _ in range(2):
+            pageDict = {'rows': [{'n': '3'}]}
+            savedValues = {}
+            self.assertEqual('[3]', template.format(pageDict, savedValues=savedValues))
+            self.assertEqual({'rows': [{'n': '3'}]}, pageDict)
+            self.assertEqual('3', savedValues['@']['total'])
+        self.assertEqual(1, template.renderCache.hits)
+
+    def test_isolated_saves4(self):
+        namespace = NamespaceStack({'a': 'base'}, doIsolateSaves=True)
+        namespace['a'] = 'saved'
+        namespace.push({'a': 'loop'})
+        self.assertEqual('loop', namespace['a'])
+        namespace.pop()
+        self.assertEqual('saved', namespace['a'])
+        self.assertEqual({'a': 'saved'}, namespace.savedValues)
+
+    def test_isolated_saves5(self):
+        # A saveraw using a loop's implied variables works inside the loop, but cannot be exported after it.
+        templateStr = '<@loop rows><@saveraw s><@:index><@/saveraw><@s><@/loop><@saveeval t>x<@/saveeval>'
+        savedValues = {}
+        template = tagsub.Template('@', templateStr, doEncodeHtml=False)
+        self.assertEqual('12', template.format({'rows': [{}, {}]}, savedValues=savedValues))
+        self.assertEqual({'@': {'t': 'x'}}, savedValues)
+        # Referenced after the loop, it is an error naming the tag.
+        self.assertRaisesAndMatchesTraceback(tagsub.exceptions.LoopVarOutOfScopeError, '25(1,25):1(1,1)',
+                                             tagsub.Template('@', templateStr + '<@s>', doEncodeHtml=False).format,
+                                             {'rows': [{}]})
+
+
+class test_global_dict(tagsub_TestCase):
+    def test_global_dict1(self):
+        # The render's own Mapping is searched before the globals, and save tags never write to the globals.
+        globalDict = {'site': 'Example', 'title': 'Home'}
+        template = tagsub.Template('@', '<@site>: <@title><@saveeval site>Saved<@/saveeval> <@site>',
+                                   globalDict=globalDict)
+        pageDict = {'title': 'Orders'}
+        self.assertEqual('Example: Orders Saved', template.format(pageDict))
+        self.assertEqual('Saved', pageDict['site'])
+        self.assertEqual('Example: Home Saved', template.format({}))
+        self.assertEqual({'site': 'Example', 'title': 'Home'}, globalDict)
+
+    def test_global_dict2(self):
+        # The globals are copied once when the Template is created, so later changes are not seen.
+        globalDict = {'site': 'Example'}
+        template = tagsub.Template('@', '<@site>', globalDict=globalDict)
+        globalDict['site'] = 'Changed'
+        self.assertEqual('Example', template.format({}))
+
+    def test_global_dict3(self):
+        # A value in a loop row still hides a global of the same name.
+        template = tagsub.Template('@', '<@loop rows>[<@name>]<@/loop>', globalDict={'name': 'global'})
+        self.assertEqual('[row][global]', template.format({'rows': [{'name': 'row'}, {}]}))
+
+    def test_global_dict4(self):
+        # Globals for several tagchars, given in the same forms as format takes.
+        template = tagsub.Template('@#', '<@a><#a>', globalDict=[{'a': '1'}, {'a': '2'}])
+        self.assertEqual('12', template.format([{}, {}]))
+        template = tagsub.Template('@#', '<@a><#a>', globalDict={'@': {'a': '1'}, '#': {}})
+        self.assertEqual('1', template.format({'@': {}, '#': {}}))
+        self.assertRaises(TagcharSequenceMismatchError, tagsub.Template, '@#', '', globalDict=[{}])
+
+    def test_global_dict5(self):
+        # The loader as an environment: its globals are shared by the templates it loads, and by what they include.
+        loader = tagsub.DictTemplateLoader({'page': '<@include header>|<@body>', 'header': '<@site>'},
+                                           globalDict={'site': 'Example'})
+        template = loader.load('page', doEncodeHtml=False)
+        self.assertIs(template, loader.load('page', doEncodeHtml=False))
+        self.assertEqual('Example|text', template.format({'body': 'text'}))
+
+    def test_global_dict5a(self):
+        # Options that can't be hashed, such as a schema given as a list, are still loaded, just not cached.
+        loader = tagsub.DictTemplateLoader({'page': '<@site>|<@body>'}, globalDict={'site': 'Example'})
+        template = loader.load('page', schema=['body'], doEncodeHtml=False)
+        self.assertIsNot(template, loader.load('page', schema=['body'], doEncodeHtml=False))
+        self.assertEqual('Example|text', template.format(('text',)))
+        self.assertEqual({}, loader._loadedTemplates)
+
+    def test_global_dict6(self):
+        # Reads that reach the globals are part of the render cache key like any other root level read.
+        template = tagsub.Template('@', '<@site> <@n>', globalDict={'site': 'Example'},
+                                   renderCache=tagsub.RenderCache())
+        self.assertEqual('Example 1', template.format({'n': '1'}))
+        self.assertEqual('Example 1', template.format({'n': '1'}))
+        self.assertEqual('Other 1', template.format({'n': '1', 'site': 'Other'}))
+        self.assertEqual(1, template.renderCache.hits)
+
+
+class test_output_attribution(tagsub_TestCase):
+    def setUp(self):
+        self.attribution = tagsub.OutputAttribution()
+        self.template = tagsub.Template('@', 'head\n<@loop rows><@if show>\n<@name>\n<@/if><@/loop><@title>')
+
+    def regionsByPosition(self):
+        # The if container and its first choice share a position. Only the container is kept.
+        regions = {}
+        for region in self.attribution.stats():
+            regions.setdefault((region.position, region.tagName), region)
+        return regions
+
+    def test_output_attribution1(self):
+        d = {'rows': [{'name': 'a', 'show': 1}, {'name': 'bb'}, {'name': 'ccc', 'show': 1}], 'title': 'T'}
+        result = self.template.format(d, attribution=self.attribution)
+        self.assertEqual('head\na\nccc\nT', result)
+        regions = self.regionsByPosition()
+        self.assertEqual(len(result), regions['1(1,1)', 'root'].cumulativeBytes)
+        self.assertEqual(len('head\n'), regions['1(1,1)', 'root'].selfBytes)
+        # The blank lines after the if tags are suppressed, so only the line endings after the names count.
+        self.assertEqual(len('a\nccc\n'), regions['6(2,1)', 'loop'].cumulativeBytes)
+        self.assertEqual(len('accc'), regions['29(3,1)', 'simple'].selfBytes)
+        self.assertEqual(2, regions['29(3,1)', 'simple'].spans)
+        # Bytes per iteration, by index0. The second row outputs nothing.
+        self.assertEqual({0: 2, 2: 4}, regions['6(2,1)', 'loop'].iterationBytes)
+
+    def test_output_attribution2(self):
+        # The spans cover the output exactly, in order, each with the innermost tag and loop index.
+        d = {'rows': [{'name': 'a', 'show': 1}, {'name': 'bb', 'show': 1}], 'title': 'T'}
+        result = self.template.format(d, attribution=self.attribution)
+        spans = self.attribution.lastSpans
+        self.assertEqual(len(result), sum(span.length for span in spans))
+        self.assertEqual([0] + [span.start + span.length for span in spans[:-1]], [span.start for span in spans])
+        self.assertEqual([('root', None), ('simple', 0), ('if', 0), ('simple', 1), ('if', 1), ('simple', None)],
+                         [(span.tag.tag or 'root', span.iterationIndex) for span in spans])
+
+    def test_output_attribution3(self):
+        # Bytes, not characters. A suppressed blank line is not counted, and output saved by a saveeval only counts
+        # where it is referenced.
+        template = tagsub.Template('@', '<@saveeval s><@loop rows><@v><@/loop><@/saveeval>\n<@if no>\n<@/if><@s>',
+                                   doEncodeHtml=False)
+        result = template.format({'rows': [{'v': 'é'}, {'v': 'x'}]}, attribution=self.attribution)
+        self.assertEqual('éx', result)
+        regions = self.regionsByPosition()
+        self.assertEqual(3, regions['1(1,1)', 'root'].cumulativeBytes)
+        self.assertEqual(3, regions['66(3,7)', 'simple'].selfBytes)
+        self.assertEqual(0, regions['14(1,14)', 'loop'].cumulativeBytes)
+        self.assertEqual(0, regions['51(2,1)', 'if'].cumulativeBytes)
+
+    def test_output_attribution4(self):
+        # Totals add up over renders, and the template is left without any wrappers afterwards.
+        d = {'rows': [{'name': 'a', 'show': 1}], 'title': 'T'}
+        self.template.format(d, attribution=self.attribution)
+        self.template.format(d, attribution=self.attribution)
+        self.assertEqual({0: 4}, self.regionsByPosition()['6(2,1)', 'loop'].iterationBytes)
+        self.assertIsNone(self.template._profiler)
+        self.assertNotIn('format', vars(self.template.rootTag))
+        self.assertEqual(['tag', 'charpos', 'linenum', 'linepos', 'selfBytes', 'cumulativeBytes', 'spans',
+                          'iterationBytes'], list(self.attribution.dump()[0]))
+        self.assertIn('cumbytes', self.attribution.report())
+        with tagsub.Profiler().profiling(self.template):
+            self.assertRaises(RuntimeError, self.template.format, d, attribution=self.attribution)
+
+    def test_output_attribution5(self):
+        # HTML comments and <@ > tags are attributed like any other tag.
+        template = tagsub.Template('@', 'a<!-- <@x> -->b<@ >\n<@loop l><@x><@/loop>')
+        result = template.format({'x': '1', 'l': [{}]}, attribution=self.attribution)
+        self.assertEqual('a<!-- 1 -->b\n1', result)
+        regions = self.regionsByPosition()
+        self.assertEqual(len('<!-- 1 -->'), regions['2(1,2)', 'comment'].cumulativeBytes)
+        self.assertEqual(0, regions['16(1,16)', 'null'].cumulativeBytes)
+        self.assertEqual({0: 1}, regions['21(2,1)', 'loop'].iterationBytes)
+
+
+class test_sampling_profiler(tagsub_TestCase):
+    template = '<@loop rows><@if show><@name><@/if><@/loop>'
+
+    def test_sampling_profiler1(self):
+        # The sampled path for a marked tag, built from the same walk as the tracebacks.
+        profiler = tagsub.SamplingProfiler()
+        template = tagsub.Template('@', self.template)
+        outputFormatter = OutputFormatter('@', {'@': {}})
+        loopTag = template.rootTag._children[0]
+        simpleTag = loopTag._children[0]._alternateChoices[0]._children[0]
+        self.assertEqual(('root',), profiler.samplePath(outputFormatter))
+        outputFormatter.currentTag = simpleTag
+        self.assertEqual(('root', 'loop@1', 'if@13', 'if@13', 'simple@23'), profiler.samplePath(outputFormatter))
+        loopTag.setLoopVars(2, 5, {}, outputFormatter)
+        self.assertEqual(('root', 'loop@1[3]', 'if@13', 'if@13', 'simple@23'), profiler.samplePath(outputFormatter))
+        profiler.doIncludeIterations = False
+        self.assertEqual(('root', 'loop@1', 'if@13', 'if@13', 'simple@23'), profiler.samplePath(outputFormatter))
+
+    def test_sampling_profiler2(self):
+        # A render slow enough to be sampled. The output is unchanged and the wrappers are removed afterwards.
+        class SlowRow(dict):
+            def __getitem__(self, key):
+                time.sleep(0.001)
+                return super().__getitem__(key)
+
+        template = tagsub.Template('@', self.template)
+        profiler = tagsub.SamplingProfiler(interval=0.0005, doIncludeIterations=False)
+        d = {'rows': [SlowRow(show=1, name='a') for _ in range(20)]}
+        self.assertEqual('a' * 20, template.format(d, profiler=profiler))
+        self.assertGreater(profiler.sampleCount, 0)
+        self.assertNotIn('format', vars(template.rootTag))
+        self.assertIsNone(template._profiler)
+        # Which stacks get sampled depends on timing, but the slow lookups are all inside the loop.
+        paths = []
+        for line in profiler.collapsed().splitlines():
+            path, count = line.rsplit(' ', 1)
+            paths.append(path)
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any('loop@1' in path for path in paths), paths)
+        self.assertIn('samples', profiler.report())
+
+    def test_sampling_profiler3(self):
+        # The sampled paths, like runtime tracebacks, walk up through comments and <@ > tags.
+        template = tagsub.Template('@', '<@loop l><!-- <@x.y> --><@ ><@/loop>')
+        self.assertRaisesAndMatchesTraceback(AttributeError, '15(1,15):1(1,1)[1]', template.format,
+                                             {'l': [{'x': 1}]})
+        class SlowRow(dict):
+            def __getitem__(self, key):
+                time.sleep(0.001)
+                return super().__getitem__(key)
+
+        profiler = tagsub.SamplingProfiler(interval=0.0005, doIncludeIterations=False)
+        template = tagsub.Template('@', '<@loop l><!-- <@x> --><@ ><@/loop>')
+        self.assertEqual('<!-- 1 -->' * 20, template.format({'l': [SlowRow(x='1') for _ in range(20)]},
+                                                             profiler=profiler))
+        self.assertGreater(profiler.sampleCount, 0)
+        self.assertIn(('root', 'loop@1', 'comment@10', 'simple@15'), profiler.samples)
+        nullTag = template.rootTag._children[0]._children[-1]
+        outputFormatter = simple_class()
+        outputFormatter.currentTag, outputFormatter.loopTagData = nullTag, {}
+        self.assertEqual(('root', 'loop@1', 'null@23'), profiler.samplePath(outputFormatter))
+
+
+class test_render_budget(tagsub_TestCase):
+    def test_render_budget1(self):
+        # Loop iterations are totalled over all the loops, and the error has the position and index of the loop.
+        template = tagsub.Template('@', '<@loop a><@loop b>x<@/loop><@/loop>',
+                                   renderBudget=tagsub.RenderBudget(maxLoopIterations=10))
+        self.assertEqual('x' * 6, template.format({'a': [{}, {}], 'b': [{}, {}, {}]}))
+        with self.assertRaises(RenderBudgetExceededError) as cm:
+            template.format({'a': [{}, {}, {}], 'b': [{}, {}, {}]})
+        self.assertEqual('Render budget exceeded: more than 10 loop iterations 10(1,10):1(1,1)[3]:10(1,10)[2]',
+                         str(cm.exception))
+
+    def test_render_budget2(self):
+        # Output characters are counted as they are output, even without any line breaks. A budget passed to format
+        # replaces the Template's for that render.
+        template = tagsub.Template('@', '<@loop rows><@if v><@v><@/if><@/loop>')
+        d = {'rows': [{'v': 'abcd'}] * 100}
+        self.assertEqual('abcd' * 100, template.format(d))
+        with self.assertRaises(RenderBudgetExceededError) as cm:
+            template.format(d, renderBudget=tagsub.RenderBudget(maxOutputChars=50))
+        self.assertEqual('Render budget exceeded: more than 50 output characters 20(1,20):1(1,1)[13]',
+                         str(cm.exception))
+
+    def test_render_budget3(self):
+        # The batched path for flat loops stops before building any output.
+        template = tagsub.Template('@', 'rows: <@loop rows><@v>,<@/loop>')
+        self.assertIsNotNone(template.rootTag._children[1]._flatLoop)
+        budget = tagsub.RenderBudget(maxLoopIterations=99)
+        self.assertEqual('rows: ' + '1,' * 99, template.format({'rows': [{'v': '1'}] * 99}, renderBudget=budget))
+        self.assertRaises(RenderBudgetExceededError, template.format, {'rows': [{'v': '1'}] * 100},
+                          renderBudget=budget)
+
+    def test_render_budget3a(self):
+        # With an output or time limit, a flat loop is walked row by row instead, so the render stops at the row that
+        # goes over rather than once the output of every row is built.
+        template = tagsub.Template('@', 'rows: <@loop rows><@v>,<@/loop>')
+        d = {'rows': [{'v': '1'}] * 1000}
+        with self.assertRaises(RenderBudgetExceededError) as cm:
+            template.format(d, renderBudget=tagsub.RenderBudget(maxOutputChars=100))
+        self.assertEqual('Render budget exceeded: more than 100 output characters 19(1,19):7(1,7)[48]',
+                         str(cm.exception))
+        ticks = iter(range(100))
+        with self.assertRaises(RenderBudgetExceededError) as cm:
+            template.format(d, renderBudget=tagsub.RenderBudget(maxSeconds=5, clock=lambda: next(ticks)))
+        self.assertEqual('Render budget exceeded: more than 5 seconds 19(1,19):7(1,7)[3]', str(cm.exception))
+        self.assertEqual('rows: ' + '1,' * 1000, template.format(d, renderBudget=tagsub.RenderBudget(maxSeconds=60)))
+
+    def test_render_budget4(self):
+        # A saveraw that doubles itself each time it is referenced.
+        template = tagsub.Template('@', '<@saveraw s><@if more><@s><@s><@/if>x<@/saveraw><@s>',
+                                   renderBudget=tagsub.RenderBudget(maxSaveRawExpansions=5))
+        self.assertEqual('x', template.format({}))
+        self.assertRaises(RenderBudgetExceededError, template.format, {'more': 1})
+
+    def test_render_budget5(self):
+        # Time is checked against the budget's clock.
+        ticks = iter(range(100))
+        budget = tagsub.RenderBudget(maxSeconds=5, clock=lambda: next(ticks))
+        template = tagsub.Template('@', '<@loop rows><@/loop>', renderBudget=budget)
+        with self.assertRaises(RenderBudgetExceededError) as cm:
+            template.format({'rows': [{}] * 10})
+        self.assertEqual('Render budget exceeded: more than 5 seconds 1(1,1):1(1,1)[6]', str(cm.exception))
+        self.assertIsInstance(cm.exception, tagsub.exceptions.TagsubRuntimeError)
+
+
+class test_iterative_render(tagsub_TestCase):
+    def test_iterative_render1(self):
+        # Nesting well past the Python recursion limit renders when the nested tag depth limit is turned off.
+        depth = sys.getrecursionlimit() * 2
+        template = tagsub.Template('@', '<@if x>' * depth + '<@x>' + '<@/if>' * depth, maxNestedTagDepth=None)
+        self.assertEqual('1', template.format({'x': '1'}))
+
+    def test_iterative_render2(self):
+        depth = 50
+        templateStr = '<@namespace n>' * depth + '<@x>' + '<@/namespace>' * depth
+        self.assertRaises(TagStackOverflowError, tagsub.Template, '@', templateStr)
+        template = tagsub.Template('@', templateStr, maxNestedTagDepth=depth)
+        self.assertEqual('1', template.format({'n': {}, 'x': '1'}))
+        self.assertRaisesAndMatchesTraceback(TagStackOverflowError, '%d(1,%d)' % ((len('<@if x>') * 3 + 1,) * 2),
+                                             tagsub.Template, '@', '<@if x>' * 4, maxNestedTagDepth=3)
+
+    def test_iterative_render3(self):
+        self.assertRaisesAndMatchesTraceback(RecursiveSubstitutionOverflowError, '1(1,1)/' * 3 + '1(1,1)',
+                                             tagsub.Template('@', '<@a>', maxRecursiveTemplateDepth=3).format,
+                                             {'a': '<@a>'})
+        template = tagsub.Template('@', '<@a0>', doEncodeHtml=False, maxRecursiveTemplateDepth=None)
+        pageDict = {'a%d' % i: '<@a%d>' % (i + 1) for i in range(200)}
+        pageDict['a200'] = 'end'
+        self.assertEqual('end', template.format(pageDict))
+
+    def test_iterative_render4(self):
+        # Errors raised deep in the tree still unwind through the enclosing tags in order.
+        template = tagsub.Template('@', '<@loop l><@namespace n><@a><@/namespace><@/loop>', doEncodeHtml=False)
+        self.assertRaisesAndMatchesTraceback(AttributeError, '24(1,24):1(1,1)[2]/1(1,1)', template.format,
+                                             {'a': '<@b.x>', 'b': 3, 'l': [{'n': {'a': 'ok'}}, {'n': {}}]})
+        self.assertEqual('ok', template.format({'a': '<@b>', 'l': [{'n': {'b': 'ok'}}]}))
+
+
+class test_optimizer(tagsub_TestCase):
+    def assertSameOutput(self, templateStr, pageDict, level=2, **options):
+        # The optimized tree has to format exactly as the parsed one does.
+        template = tagsub.Template('@', templateStr, optimize=level, **options)
+        self.assertEqual(tagsub.Template('@', templateStr, **options).format(pageDict), template.format(pageDict))
+        return template
+
+    def test_optimizer1(self):
+        template = self.assertSameOutput('a<@>b<@>\nc\nd<@x>\n', {'x': 'x'}, level=1)
+        self.assertEqual({'nullTagsRemoved': 2}, template.optimizationStats['removeDeadNodes'])
+        self.assertEqual({'linesMerged': 3}, template.optimizationStats['mergeText'])
+        self.assertNotIn('simplifyExpressions', template.optimizationStats)
+        self.assertEqual({}, tagsub.Template('@', 'a<@>b').optimizationStats)
+
+    def test_optimizer2(self):
+        # Lines holding only tagsub comments and whitespace are still suppressed.
+        templateStr = 'a\n  <@!-->x<@x><@-->  \n <@!--><@--><@!--><@--><@x>\nb <@!--><@-->\n'
+        for pageDict, result in (({'x': ''}, 'a\nb \n'), ({'x': 'x'}, 'a\n x\nb \n')):
+            template = self.assertSameOutput(templateStr, pageDict)
+            self.assertEqual(result, template.format(pageDict))
+        self.assertEqual({'tagsubCommentsStripped': 4, 'markersRemoved': 2},
+                         template.optimizationStats['stripComments'])
+        self.assertEqual({}, template.optimizationStats['removeDeadNodes'])
+
+    def test_optimizer3(self):
+        # Comments are stripped at every level.
+        templateStr = 'a<!-- <@x> -->b\n  <!-- c -->  \n<!--\n<@loop l>x<@/loop>\n-->d'
+        pageDict = {'x': '1', 'l': [{}]}
+        template = tagsub.Template('@', templateStr, doSuppressComments=True)
+        self.assertEqual('ab\nd', template.format(pageDict))
+        self.assertEqual({'stripComments': {'commentsStripped': 3}}, template.optimizationStats)
+        self.assertNotIn('CommentNode', tagsub.dumpTree(template.rootTag))
+        template = tagsub.Template('@', templateStr)
+        self.assertEqual('a<!-- 1 -->b\n  <!-- c -->  \n<!--\nx\n-->d', template.format(pageDict))
+        self.assertEqual({}, template.optimizationStats)
+        # Without the comment, the loop body is flat and can be rendered in batches.
+        template = tagsub.Template('@', '<@loop l><@x><@!--> note <@-->,\n<@/loop>')
+        self.assertIsNotNone(template.rootTag._children[0]._flatLoop)
+        self.assertEqual('1,\n2,\n', template.format({'l': [{'x': '1'}, {'x': '2'}]}))
+
+    def test_optimizer4(self):
+        templateStr = '<@if !!a & (b & c) & d>1<@elif a | !!(b | !!c)>2<@elif !!!a>3<@/if>'
+        for values in range(16):
+            pageDict = {name: (values >> bit) & 1 for bit, name in enumerate('abcd')}
+            template = self.assertSameOutput(templateStr, pageDict)
+        self.assertEqual({'doubleNegationsRemoved': 4, 'operatorsFlattened': 3},
+                         template.optimizationStats['simplifyExpressions'])
+        self.assertIn('IfTag 1(1,1) (a & b & c & d)', tagsub.dumpTree(template.rootTag))
+
+    def test_optimizer5(self):
+        templateStr = '<@case v><@option 1, 2>a<@option 2>b<@option 3>c<@else>d<@/case>' \
+                      '<@case v><@option 1>e<@/case><@case v><@option 1>f<@option =w>g<@/case>'
+        for value in ('1', '2', 3, '4', ''):
+            template = self.assertSameOutput(templateStr, {'v': value, 'w': 4})
+        self.assertEqual({'casesDispatched': 2}, template.optimizationStats['caseDispatch'])
+
+    def test_optimizer6(self):
+        # A pass of our own, run on its own, with the tree dumped around it.
+        class UpperCasePass(tagsub.OptimizationPass):
+            name = 'upperCase'
+
+            def visitLine(self, line):
+                self.stats['lines'] += 1
+                return tagsub.tags.text.TextNode.Line(str(line).upper(), line.isCompleteLine)
+
+        debugStream = io.StringIO()
+        template = tagsub.Template('@', 'a\n<@loop l>b<@/loop>',
+                                   optimize=tagsub.Optimizer(1, passes=[UpperCasePass], debugStream=debugStream))
+        self.assertEqual('A\nBB', template.format({'l': [{}, {}]}))
+        self.assertEqual({'upperCase': {'lines': 2}}, template.optimizationStats)
+        self.assertEqual("before upperCase:\nRootTag 1(1,1)\n  Line 'a\\n'\n  LoopTag 3(2,1)\n    Line 'b' (incomplete)\n"
+                         "after upperCase:\nRootTag 1(1,1)\n  Line 'A\\n'\n  LoopTag 3(2,1)\n    Line 'B' (incomplete)\n",
+                         debugStream.getvalue())
+        # The passes do not recurse, so they take any depth of nesting.
+        depth = sys.getrecursionlimit() * 2
+        template = tagsub.Template('@', '<@if x>' * depth + 'a<@>b' + '<@/if>' * depth, maxNestedTagDepth=None,
+                                   optimize=1)
+        self.assertEqual('ab', template.format({'x': '1'}))
+
+
+class test_static_output(tagsub_TestCase):
+    def test_static_output1(self):
+        template = tagsub.Template('@', 'a\n  <@!-->c<@x><@-->\n<!-- d --><@>\nb')
+        self.assertEqual('a\n<!-- d -->\nb', template._staticOutput)
+        self.assertEqual('a\n<!-- d -->\nb', template.format({}))
+        # The arguments are still checked.
+        self.assertRaises(TypeError, template.format, 'x')
+        self.assertRaises(TagcharSequenceMismatchError, tagsub.Template('@#', 'a').format, [{}])
+
+    def test_static_output2(self):
+        self.assertIsNone(tagsub.Template('@', 'a<@x>').__dict__['_staticOutput'])
+        # Anything that needs to see the render goes the long way round.
+        template = tagsub.Template('@', 'a\n', doIsolateSaves=True)
+        savedValues = {}
+        self.assertEqual('a\n', template.format({}, savedValues=savedValues))
+        self.assertEqual({'@': {}}, savedValues)
+        self.assertEqual('a\n', template.format({}, renderBudget=tagsub.RenderBudget(maxOutputChars=10)))
+        profiler = tagsub.Profiler()
+        self.assertEqual('a\n', template.format({}, profiler=profiler))
+        self.assertEqual(1, profiler.stats()[0].calls)
+
+    def test_static_output3(self):
+        templateStr = '<@loop l><@x>\n  <b>\n\n <@!-->c<@-->\n<!-- d -->\n  <@x><@/loop>'
+        pageDict = {'l': [{'x': 'y'}, {'x': ''}]}
+        template = tagsub.Template('@', templateStr, optimize=1)
+        self.assertEqual(tagsub.Template('@', templateStr).format(pageDict), template.format(pageDict))
+        self.assertEqual({'commentsOpened': 1, 'nodesPrecomputed': 9}, template.optimizationStats['precomputeStatic'])
+        self.assertIn("StaticLines '  <b>\\n\\n<!-- d -->\\n'", tagsub.dumpTree(template.rootTag))
+
+
+class test_schema(tagsub_TestCase):
+    class Record:
+        __slots__ = ['name', 'rows', 'obj']
+
+        def __init__(self, name, rows, obj):
+            self.name = name
+            self.rows = rows
+            self.obj = obj
+
+    templateStr = '<@name>\n<@loop rows><@name>:<@obj.name> <@/loop>\n<@if name>y<@/if>'
+
+    def test_schema1(self):
+        template = tagsub.Template('@', self.templateStr, schema=('name', 'rows', 'obj'))
+        self.assertEqual([0, 1, 0], [value._slot for value in template.rootTag._scopeValues])
+        obj = self.Record('a', [{'name': 'b'}, {}], None)
+        obj.obj = obj
+        expected = 'a\nb:a a:a \ny'
+        self.assertEqual(expected, template.format(('a', [{'name': 'b'}, {}], obj)))
+        self.assertEqual(expected, template.format(['a', [{'name': 'b'}, {}], obj]))
+        self.assertEqual(expected, template.format(obj))
+        self.assertEqual(expected, template.format({'name': 'a', 'rows': [{'name': 'b'}, {}], 'obj': obj}))
+        self.assertEqual(expected, template.format({'@': obj}))
+        self.assertRaises(ValueError, template.format, ('a', []))
+
+    def test_schema2(self):
+        # Unknown top level names are found at compile time. Names inside loops may come from the loop items.
+        self.assertRaisesAndMatchesTraceback(InvalidTagKeyName, '4(1,4)', tagsub.Template,
+                                             '@', 'ab <@x>', schema=('y',))
+        tagsub.Template('@', '<@saveeval x>1<@/saveeval><@x><@g><@loop y><@z><@/loop>', schema=('y',),
+                        globalDict={'g': 1})
+        # Only the tagchars with a schema are checked.
+        template = tagsub.Template('@#', '<@y><#z>', schema={'@': ('y',)})
+        self.assertEqual('12', template.format([('1',), {'z': '2'}]))
+
+    def test_schema3(self):
+        # A save tag writing a schema name takes over from the record, as it would from a Mapping.
+        templateStr = '<@x>,<@saveeval x>2<@/saveeval><@x>,<@saveraw s><@x><@/saveraw><@loop l><@s><@/loop>'
+        pageDict = {'x': '1', 'l': [{'x': '3'}]}
+        expected = tagsub.Template('@', templateStr).format(pageDict)
+        self.assertEqual('1,2,3', expected)
+        template = tagsub.Template('@', templateStr, schema=('x', 'l'))
+        self.assertEqual(expected, template.format(('1', [{'x': '3'}])))
+        template = tagsub.Template('@', templateStr, schema=('x', 'l'), doIsolateSaves=True)
+        self.assertEqual(expected, template.format(('1', [{'x': '3'}])))
+
+    def test_schema4(self):
+        # Records with a RenderCache: reads still have to be recorded.
+        template = tagsub.Template('@', '<@a>', schema=('a',), renderCache=tagsub.RenderCache())
+        self.assertEqual('1', template.format(('1',)))
+        self.assertEqual('2', template.format(('2',)))
+        self.assertEqual('2', template.format(['2']))
+
+
+class test_attribute_chains(tagsub_TestCase):
+    class Record:
+        def __init__(self, **attributes):
+            self.__dict__.update(attributes)
+
+    def test_attribute_chains1(self):
+        template = tagsub.Template('@', '<@a.b.c> <@a.b.d> <@a.b.c>')
+        first, second, third = template.rootTag._children[::2]
+        # One accessor per distinct chain.
+        self.assertIs(first._value._getAttributes, third._value._getAttributes)
+        self.assertIsNot(first._value._getAttributes, second._value._getAttributes)
+        pageDict = {'a': self.Record(b=self.Record(c='x', d=None))}
+        self.assertEqual('x  x', template.format(pageDict))
+        try:
+            template.format({'a': self.Record(b=self.Record(c='x'))})
+        except AttributeError as e:
+            self.assertEqual("'Record' object has no attribute 'd'  10(1,10)", str(e))
+        else:
+            self.fail('AttributeError not raised')
+        # Without doMappingAttributes, a dict only has its own attributes.
+        self.assertRaisesAndMatchesTraceback(AttributeError, '1(1,1)', template.format, {'a': {'b': {}}})
+
+    def test_attribute_chains2(self):
+        templateStr = '<@loop l><@a.b.c> <@a.keys.x> <@a.d><@/loop>'
+        template = tagsub.Template('@', templateStr, doMappingAttributes=True)
+        pageDict = {'l': [{'a': {'b': {'c': 'x'}, 'keys': self.Record(x='y'), 'd': ''}}]}
+        self.assertEqual('x y ', template.format(pageDict))
+        self.assertRaisesAndMatchesTraceback(AttributeError, '31(1,31):1(1,1)[1]', template.format,
+                                             {'l': [{'a': {'b': {'c': 'x'}, 'keys': {'x': 'y'}}}]})
+        # Values that are themselves templates are compiled with the same option.
+        template = tagsub.Template('@', '<@v>', doEncodeHtml=False, doMappingAttributes=True)
+        self.assertEqual('x', template.format({'v': '<@a.b>', 'a': {'b': 'x'}}))
+
+    def test_attribute_chains3(self):
+        # A RenderCache replays the reads through the same accessors.
+        template = tagsub.Template('@', '<@a.b>', doMappingAttributes=True, renderCache=tagsub.RenderCache())
+        self.assertEqual('1', template.format({'a': {'b': '1', 'c': '2'}}))
+        self.assertEqual('1', template.format({'a': {'b': '1', 'c': '3'}}))
+        self.assertEqual(1, template.renderCache.hits)
+        self.assertEqual('2', template.format({'a': {'b': '2'}}))
+
+
 if __name__ == "__main__":
     #print("Testing version:", tagsub.__version__.split()[1])
     #print("Nested tag stack depth:", tagsub.max_nested_tag_depth)